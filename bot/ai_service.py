@@ -1,14 +1,50 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-import os
 from random import choice, random
 import re
-from typing import Iterable
+from dataclasses import dataclass
+from time import monotonic, perf_counter
 
 import aiohttp
 
+from bot.config import get_runtime_config
+from bot.metrics import observe_upstream, record_cache
+from bot.ollama_pool import (
+    OllamaBackend,
+    acquire_backend,
+    get_ollama_base_urls,
+    normalize_model_name,
+    refresh_backends,
+)
+from bot.prompt_builder import PromptPlan, build_prompt_plan, estimate_tokens, trim_to_tokens
+from bot.resilience import CircuitBreaker, LatencyTracker
+
 logger = logging.getLogger(__name__)
+_AI_KEEP_ALIVE = "30m"
+_CONTEXT_REUSE_TTL_SECONDS = 20 * 60
+_MODEL_LOAD_TIMEOUT_SECONDS = 300
+_MODEL_PROBE_TIMEOUT_SECONDS = 5
+_MODEL_RETRY_SECONDS = 15
+# An UP model is only marked DOWN after this many failed probes in a row, so
+# one slow /api/ps or warm-up does not push every reply to the local tier.
+_MODEL_DOWN_AFTER_FAILURES = 3
+_GENERATION_MIN_DEADLINE_SECONDS = 1.5
+_GENERATION_MIN_SAMPLES = 5
+_GENERATION_BREAKER_FAILURES = 3
+_GENERATION_BREAKER_RESET_SECONDS = 20.0
+_SUMMARY_NUM_PREDICT = 96
+_SUMMARY_LINE_MAX_TOKENS = 48
+_SUMMARY_SAFETY_MARGIN_TOKENS = 32
+_SUMMARY_SYSTEM_PROMPT = (
+    "Ты ведешь краткую сводку группового чата. Обнови сводку по новым сообщениям: "
+    "2-4 коротких предложения на русском, кто о чем говорил, важные факты, планы и договоренности. "
+    "Без оценок, без приветствий, только сводка."
+)
+MODEL_STATE_UP = "up"
+MODEL_STATE_LOADING = "loading"
+MODEL_STATE_DOWN = "down"
 _AI_VOCAB = (
     "натуре",
     "натури",
@@ -45,30 +81,156 @@ _NON_TARGET_MARKERS = (
 )
 
 
+@dataclass(frozen=True)
+class _ReplyOutcome:
+    text: str | None
+    # True when Ollama answered, False when the request failed and None when
+    # nothing was sent (empty message, prompt did not fit). Only False counts
+    # against the generation breaker.
+    model_ok: bool | None
+
+
+@dataclass(frozen=True)
+class _ContextEntry:
+    tokens: list[int]
+    last_history_key: tuple[str, str] | None
+    updated_at: float
+
+
+_context_cache: dict[tuple[int, str, str], _ContextEntry] = {}
+_model_state = MODEL_STATE_LOADING
+_model_probe_failures = 0
+_generation_latency = LatencyTracker()
+_generation_breaker = CircuitBreaker(
+    failure_threshold=_GENERATION_BREAKER_FAILURES,
+    reset_timeout=_GENERATION_BREAKER_RESET_SECONDS,
+)
+_active_generations = 0
+_last_generation_at = 0.0
+
+
 def get_ollama_base_url() -> str:
-    return (os.getenv("OLLAMA_BASE_URL") or "http://127.0.0.1:11434").rstrip("/")
+    return get_ollama_base_urls()[0]
 
 
 def get_ollama_model() -> str:
-    return (os.getenv("OLLAMA_MODEL") or "qwen2.5:1.5b").strip()
+    return get_runtime_config().ollama_model
 
 
 def get_ai_max_tokens() -> int:
-    raw = (os.getenv("AI_MAX_TOKENS") or "32").strip()
-    try:
-        value = int(raw)
-    except ValueError:
-        return 32
-    return max(12, min(value, 96))
+    return get_runtime_config().ai_max_tokens
+
+
+def get_ai_num_ctx() -> int:
+    return get_runtime_config().ai_num_ctx
 
 
 def get_ai_timeout_seconds() -> int:
-    raw = (os.getenv("AI_TIMEOUT_SECONDS") or "45").strip()
+    return get_runtime_config().ai_timeout_seconds
+
+
+def get_ai_keep_alive_ping_seconds() -> int:
+    return get_runtime_config().ai_keep_alive_ping_seconds
+
+
+def get_ai_context_reuse_enabled() -> bool:
+    return get_runtime_config().ai_context_reuse
+
+
+def get_model_state() -> str:
+    return _model_state
+
+
+def is_model_ready() -> bool:
+    return _model_state == MODEL_STATE_UP
+
+
+def _set_model_state(state: str) -> None:
+    global _model_state
+    if state != _model_state:
+        logger.info("Ollama model state: %s -> %s (model=%s)", _model_state, state, get_ollama_model())
+    _model_state = state
+
+
+async def _load_model(session: aiohttp.ClientSession, base_url: str, model: str, timeout_seconds: int) -> bool:
+    # An empty prompt makes Ollama load the model and refresh keep_alive
+    # without generating anything.
+    payload = {"model": model, "prompt": "", "stream": False, "keep_alive": _AI_KEEP_ALIVE}
+    timeout = aiohttp.ClientTimeout(total=timeout_seconds)
     try:
-        value = int(raw)
-    except ValueError:
-        return 45
-    return max(10, min(value, 120))
+        async with session.post(f"{base_url}/api/generate", json=payload, timeout=timeout) as response:
+            if response.status != 200:
+                logger.warning(
+                    "Ollama warm-up failed: url=%s status=%s model=%s body=%s",
+                    base_url,
+                    response.status,
+                    model,
+                    _trim_text(await response.text(), 260),
+                )
+                return False
+            await response.read()
+    except (aiohttp.ClientError, TimeoutError) as exc:
+        logger.warning("Ollama warm-up failed: url=%s model=%s error=%s", base_url, model, exc)
+        return False
+    return True
+
+
+def _record_model_probe(ok: bool) -> None:
+    global _model_probe_failures
+    if ok:
+        _model_probe_failures = 0
+        _set_model_state(MODEL_STATE_UP)
+        return
+    _model_probe_failures += 1
+    if _model_state != MODEL_STATE_UP or _model_probe_failures >= _MODEL_DOWN_AFTER_FAILURES:
+        _set_model_state(MODEL_STATE_DOWN)
+    else:
+        logger.warning(
+            "Ollama model probe failed, keeping it up: failures=%s/%s model=%s",
+            _model_probe_failures,
+            _MODEL_DOWN_AFTER_FAILURES,
+            get_ollama_model(),
+        )
+
+
+async def refresh_model_state() -> str:
+    model = get_ollama_model()
+    backends = [backend for backend in await refresh_backends() if backend.reachable]
+    if not backends:
+        _record_model_probe(False)
+        return _model_state
+
+    if any(backend.has_model(model) for backend in backends):
+        _set_model_state(MODEL_STATE_UP)
+    else:
+        _set_model_state(MODEL_STATE_LOADING)
+
+    async with aiohttp.ClientSession() as session:
+        loaded = await asyncio.gather(
+            *(
+                _load_model(
+                    session,
+                    backend.base_url,
+                    model,
+                    _MODEL_PROBE_TIMEOUT_SECONDS if backend.has_model(model) else _MODEL_LOAD_TIMEOUT_SECONDS,
+                )
+                for backend in backends
+            )
+        )
+
+    _record_model_probe(any(loaded))
+    return _model_state
+
+
+async def run_model_keeper() -> None:
+    while True:
+        state = await refresh_model_state()
+        # A failed probe is confirmed or cleared quickly instead of waiting
+        # out a whole keep-alive interval.
+        if state == MODEL_STATE_UP and not _model_probe_failures:
+            await asyncio.sleep(get_ai_keep_alive_ping_seconds())
+        else:
+            await asyncio.sleep(_MODEL_RETRY_SECONDS)
 
 
 def get_fast_fallback_text() -> str:
@@ -106,106 +268,473 @@ def _contains_non_target_language(text: str) -> bool:
     return any(marker in lowered for marker in _NON_TARGET_MARKERS)
 
 
-def _format_history_lines(history: Iterable[dict[str, str]]) -> str:
-    lines: list[str] = []
-    for item in history:
-        username = (item.get("username") or "user").strip()
-        text = _trim_text(item.get("text") or "", 120)
-        if not text:
-            continue
-        lines.append(f"@{username}: {text}")
-    return "\n".join(lines[-4:])
+def _build_system_prompt(style_username: str) -> str:
+    return (
+        "Ты телеграм бот для группы. "
+        "Отвечай только на казахском кириллицей и иногда вставляй русские слова. "
+        "Не используй узбекский или кыргызский язык. "
+        f"Держи стиль общения пользователя @{style_username}. "
+        "Тон грубый дерзкий без уважения без вежливости. "
+        "Не говори что ты ИИ. "
+        "Не используй знаки препинания. "
+        f"Чаще используй слова из словаря: {', '.join(_AI_VOCAB)}."
+    )
 
 
-def _format_style_examples(style_examples: Iterable[str]) -> str:
-    lines: list[str] = []
-    for text in style_examples:
-        trimmed = _trim_text(text, 90)
-        if trimmed:
-            lines.append(f"- {trimmed}")
-    return "\n".join(lines[-3:])
+def _build_options(plan: PromptPlan) -> dict[str, float | int | list[str]]:
+    return {
+        "temperature": 0.6,
+        "num_predict": plan.num_predict,
+        "num_ctx": get_ai_num_ctx(),
+        "top_k": 20,
+        "stop": list(plan.stop),
+    }
 
 
-async def generate_style_reply(
+def _plan_prompt(
     *,
     user_message: str,
     style_username: str,
     history: list[dict[str, str]],
     style_examples: list[str],
-) -> str | None:
-    clean_user_message = user_message.strip()
-    if not clean_user_message:
-        return None
+    style_words: list[str],
+    summary: str = "",
+    context_tokens: int = 0,
+) -> PromptPlan | None:
+    is_turn = context_tokens > 0
+    return build_prompt_plan(
+        system_prompt=_build_system_prompt(style_username),
+        user_message=user_message,
+        style_username=style_username,
+        style_examples=style_examples,
+        style_words=style_words,
+        history=history,
+        summary=summary,
+        num_ctx=get_ai_num_ctx(),
+        max_tokens=get_ai_max_tokens(),
+        context_tokens=context_tokens,
+        include_system=not is_turn,
+        include_style=not is_turn,
+    )
 
-    history_block = _format_history_lines(history)
-    style_block = _format_style_examples(style_examples)
-    model = get_ollama_model()
-    max_tokens = get_ai_max_tokens()
-    timeout_seconds = get_ai_timeout_seconds()
-    base_url = get_ollama_base_url()
 
-    system_prompt = (
-        "Ты телеграм бот для группы. "
-        "Отвечай только на казахском кириллицей и иногда вставляй русские слова. "
-        "Не используй узбекский или кыргызский язык. "
-        f"Держи стиль общения пользователя @{style_username}. "
-        "Тон грубый дерзкий без уважения без вежливости. "
-        "Не говори что ты ИИ. "
-        "Не используй знаки препинания. "
-        f"Чаще используй слова из словаря: {', '.join(_AI_VOCAB)}."
-    )
-    user_prompt = (
-        f"Recent chat context:\n{history_block or 'none'}\n\n"
-        f"Style examples of @{style_username}:\n{style_block or 'none'}\n\n"
-        f"Current user message:\n{_trim_text(clean_user_message, 160)}\n\n"
-        "Return one short reply in the same style."
+def _history_key(item: dict[str, str]) -> tuple[str, str]:
+    return (str(item.get("sent_at") or ""), str(item.get("text") or ""))
+
+
+def _prune_context_cache(now: float) -> None:
+    for key, entry in tuple(_context_cache.items()):
+        if now - entry.updated_at > _CONTEXT_REUSE_TTL_SECONDS:
+            _context_cache.pop(key, None)
+
+
+def _unseen_history(history: list[dict[str, str]], last_key: tuple[str, str] | None) -> list[dict[str, str]]:
+    if last_key is None:
+        return history
+    for index in range(len(history) - 1, -1, -1):
+        if _history_key(history[index]) == last_key:
+            return history[index + 1 :]
+    return history
+
+
+async def _post_ollama_backend(
+    session: aiohttp.ClientSession,
+    backend: OllamaBackend,
+    path: str,
+    payload: dict,
+) -> dict | None:
+    started = perf_counter()
+    ok = False
+    try:
+        data = await _read_ollama_response(session, backend, path, payload)
+        ok = data is not None
+        return data
+    finally:
+        observe_upstream("ollama", perf_counter() - started, ok)
+
+
+async def _read_ollama_response(
+    session: aiohttp.ClientSession,
+    backend: OllamaBackend,
+    path: str,
+    payload: dict,
+) -> dict | None:
+    async with session.post(f"{backend.base_url}{path}", json=payload) as response:
+        # 404 is Ollama's "model not found": another backend may have it.
+        if response.status >= 500 or response.status == 404:
+            raise aiohttp.ClientResponseError(
+                response.request_info,
+                response.history,
+                status=response.status,
+                message=_trim_text(await response.text(), 260),
+            )
+        if response.status != 200:
+            logger.warning(
+                "Ollama %s failed: url=%s status=%s model=%s body=%s",
+                path,
+                backend.base_url,
+                response.status,
+                payload.get("model"),
+                _trim_text(await response.text(), 260),
+            )
+            return None
+        data = await response.json()
+    return data if isinstance(data, dict) else None
+
+
+async def post_ollama(
+    path: str,
+    payload: dict,
+    timeout_seconds: float,
+    *,
+    embed: bool = False,
+) -> dict | None:
+    model = str(payload.get("model") or "")
+    timeout = aiohttp.ClientTimeout(total=timeout_seconds)
+    tried: set[str] = set()
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        while True:
+            async with acquire_backend(model, tried, embed=embed) as backend:
+                if backend is None:
+                    if not tried:
+                        logger.warning("No Ollama backend available: model=%s", model)
+                    return None
+                tried.add(backend.base_url)
+                breaker = backend.breaker_for(embed)
+                try:
+                    data = await _post_ollama_backend(session, backend, path, payload)
+                except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError) as exc:
+                    # Connection refused, reset, 5xx or a missing model: the
+                    # next backend may still answer within the same deadline.
+                    if isinstance(exc, aiohttp.ClientResponseError) and exc.status == 404:
+                        # The backend is healthy, it just lost the model.
+                        breaker.release_probe()
+                        backend.loaded_models = backend.loaded_models - {normalize_model_name(model)}
+                    else:
+                        breaker.record_failure()
+                    logger.warning(
+                        "Ollama request failed, trying next backend: url=%s model=%s error=%s",
+                        backend.base_url,
+                        model,
+                        exc,
+                    )
+                    continue
+                except (aiohttp.ClientError, TimeoutError, ValueError) as exc:
+                    # ValueError is a body that is not valid JSON.
+                    breaker.record_failure()
+                    logger.warning(
+                        "Ollama request failed: url=%s model=%s error=%s",
+                        backend.base_url,
+                        model,
+                        exc,
+                    )
+                    return None
+                except asyncio.CancelledError:
+                    # Abandoned by the caller's deadline: release a half-open
+                    # probe slot without judging the backend either way.
+                    breaker.release_probe()
+                    raise
+
+                if data is None:
+                    # A rejected request says nothing about the backend and
+                    # must not pin the model to it.
+                    breaker.release_probe()
+                    return None
+                breaker.record_success()
+                backend.loaded_models = backend.loaded_models | {normalize_model_name(model)}
+                return data
+
+
+async def _request_chat_reply(
+    *,
+    user_message: str,
+    style_username: str,
+    history: list[dict[str, str]],
+    style_examples: list[str],
+    style_words: list[str],
+    summary: str,
+) -> _ReplyOutcome:
+    plan = _plan_prompt(
+        user_message=user_message,
+        style_username=style_username,
+        history=history,
+        style_examples=style_examples,
+        style_words=style_words,
+        summary=summary,
     )
+    if plan is None:
+        return _ReplyOutcome(None, None)
 
     payload = {
+        "model": get_ollama_model(),
+        "stream": False,
+        "messages": [
+            {"role": "system", "content": plan.system},
+            {"role": "user", "content": plan.user},
+        ],
+        "options": _build_options(plan),
+        "keep_alive": _AI_KEEP_ALIVE,
+    }
+    data = await post_ollama("/api/chat", payload, get_ai_timeout_seconds())
+    if data is None:
+        return _ReplyOutcome(None, False)
+    return _ReplyOutcome(str(((data.get("message") or {}).get("content")) or data.get("response") or ""), True)
+
+
+async def _request_reused_context_reply(
+    *,
+    chat_id: int,
+    user_message: str,
+    style_username: str,
+    history: list[dict[str, str]],
+    style_examples: list[str],
+    style_words: list[str],
+    summary: str,
+) -> _ReplyOutcome:
+    model = get_ollama_model()
+    now = monotonic()
+    _prune_context_cache(now)
+
+    key = (chat_id, model, style_username.casefold())
+    entry = _context_cache.get(key)
+    record_cache("ai_context", entry is not None)
+    plan: PromptPlan | None = None
+    if entry is not None:
+        plan = _plan_prompt(
+            user_message=user_message,
+            style_username=style_username,
+            history=_unseen_history(history, entry.last_history_key),
+            style_examples=style_examples,
+            style_words=style_words,
+            summary=summary,
+            context_tokens=len(entry.tokens),
+        )
+        if plan is None:
+            # The turn no longer fits next to the cached context; Ollama
+            # would truncate the shared prefix, so start over instead.
+            _context_cache.pop(key, None)
+            entry = None
+    if plan is None:
+        plan = _plan_prompt(
+            user_message=user_message,
+            style_username=style_username,
+            history=history,
+            style_examples=style_examples,
+            style_words=style_words,
+            summary=summary,
+        )
+    if plan is None:
+        return _ReplyOutcome(None, None)
+
+    payload: dict = {
         "model": model,
         "stream": False,
+        "prompt": plan.user,
+        "options": _build_options(plan),
+        "keep_alive": _AI_KEEP_ALIVE,
+    }
+    if entry is None:
+        payload["system"] = plan.system
+    else:
+        payload["context"] = entry.tokens
+
+    data = await post_ollama("/api/generate", payload, get_ai_timeout_seconds())
+    if data is None:
+        _context_cache.pop(key, None)
+        return _ReplyOutcome(None, False)
+
+    tokens = data.get("context")
+    if isinstance(tokens, list) and tokens:
+        _context_cache[key] = _ContextEntry(
+            tokens=[int(token) for token in tokens],
+            last_history_key=_history_key(history[-1]) if history else None,
+            updated_at=monotonic(),
+        )
+    else:
+        _context_cache.pop(key, None)
+    return _ReplyOutcome(str(data.get("response") or ""), True)
+
+
+async def request_chat_summary(
+    previous_summary: str,
+    lines: list[str],
+    timeout_seconds: float,
+) -> tuple[str, int] | None:
+    # Uses the reply num_ctx on purpose: Ollama reloads the model when a
+    # request asks for a different context size.
+    num_ctx = get_ai_num_ctx()
+    previous = trim_to_tokens(previous_summary, _SUMMARY_NUM_PREDICT)
+    budget = (
+        num_ctx
+        - _SUMMARY_NUM_PREDICT
+        - _SUMMARY_SAFETY_MARGIN_TOKENS
+        - estimate_tokens(_SUMMARY_SYSTEM_PROMPT)
+        - estimate_tokens(previous)
+    )
+    picked: list[str] = []
+    for line in lines:
+        trimmed = trim_to_tokens(line, _SUMMARY_LINE_MAX_TOKENS)
+        cost = estimate_tokens(trimmed) + 1
+        if cost > budget:
+            break
+        picked.append(trimmed)
+        budget -= cost
+    if not picked:
+        return None
+
+    sections = [f"Прошлая сводка:\n{previous}"] if previous else []
+    sections.append("Новые сообщения:\n" + "\n".join(picked))
+    payload = {
+        "model": get_ollama_model(),
+        "stream": False,
         "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
+            {"role": "system", "content": _SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": "\n\n".join(sections)},
         ],
         "options": {
-            "temperature": 0.6,
-            "num_predict": max_tokens,
-            "num_ctx": 512,
-            "top_k": 20,
+            "temperature": 0.2,
+            "num_predict": _SUMMARY_NUM_PREDICT,
+            "num_ctx": num_ctx,
         },
-        "keep_alive": "30m",
+        "keep_alive": _AI_KEEP_ALIVE,
     }
-
-    timeout = aiohttp.ClientTimeout(total=timeout_seconds)
-    try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(f"{base_url}/api/chat", json=payload) as response:
-                if response.status != 200:
-                    body = _trim_text(await response.text(), 260)
-                    logger.warning(
-                        "Ollama /api/chat failed: status=%s model=%s body=%s",
-                        response.status,
-                        model,
-                        body,
-                    )
-                    return None
-                data = await response.json()
-    except (aiohttp.ClientError, aiohttp.ContentTypeError, TimeoutError) as exc:
-        logger.warning("Ollama request failed: model=%s error=%s", model, exc)
+    data = await post_ollama("/api/chat", payload, timeout_seconds)
+    if data is None:
         return None
+    summary = " ".join(str(((data.get("message") or {}).get("content")) or "").split())
+    if not summary:
+        return None
+    return summary, len(picked)
 
-    content = (
-        ((data.get("message") or {}).get("content"))
-        or data.get("response")
-        or ""
-    )
-    cleaned = str(content).strip()
+
+async def _generate_style_reply(
+    *,
+    user_message: str,
+    style_username: str,
+    history: list[dict[str, str]],
+    style_examples: list[str],
+    style_words: list[str] | None = None,
+    chat_id: int | None = None,
+    summary: str = "",
+) -> _ReplyOutcome:
+    clean_user_message = user_message.strip()
+    if not clean_user_message:
+        return _ReplyOutcome(None, None)
+
+    if chat_id is not None and get_ai_context_reuse_enabled():
+        outcome = await _request_reused_context_reply(
+            chat_id=chat_id,
+            user_message=clean_user_message,
+            style_username=style_username,
+            history=history,
+            style_examples=style_examples,
+            style_words=style_words or [],
+            summary=summary,
+        )
+    else:
+        outcome = await _request_chat_reply(
+            user_message=clean_user_message,
+            style_username=style_username,
+            history=history,
+            style_examples=style_examples,
+            style_words=style_words or [],
+            summary=summary,
+        )
+
+    cleaned = (outcome.text or "").strip()
     if not cleaned:
-        return None
+        return _ReplyOutcome(None, outcome.model_ok)
+    _set_model_state(MODEL_STATE_UP)
     final_text = _enforce_street_style(_trim_text(cleaned, 700))
     if not final_text:
-        return None
+        return _ReplyOutcome(None, True)
     if _contains_non_target_language(final_text):
-        return get_fast_fallback_text()
-    return _inject_vocab(final_text)
+        return _ReplyOutcome(get_fast_fallback_text(), True)
+    return _ReplyOutcome(_inject_vocab(final_text), True)
+
+
+def get_generation_deadline(max_seconds: float) -> float:
+    if _generation_latency.count < _GENERATION_MIN_SAMPLES:
+        return max_seconds
+    p95 = _generation_latency.percentile(0.95) or max_seconds
+    ewma = _generation_latency.ewma or max_seconds
+    # Leave headroom over the usual latency, but never wait longer than the
+    # configured fast-reply budget.
+    deadline = max(p95 * 1.25, ewma * 2.0)
+    return max(_GENERATION_MIN_DEADLINE_SECONDS, min(deadline, max_seconds))
+
+
+def is_generation_available() -> bool:
+    return _generation_breaker.is_available()
+
+
+def is_generation_idle(min_idle_seconds: float) -> bool:
+    return _active_generations == 0 and monotonic() - _last_generation_at >= min_idle_seconds
+
+
+def describe_generation_state(max_seconds: float) -> str:
+    p95 = _generation_latency.percentile(0.95)
+    p95_text = f"{p95:.1f}s" if p95 is not None else "-"
+    return (
+        f"{_generation_breaker.state}, p95 {p95_text}, "
+        f"дедлайн {get_generation_deadline(max_seconds):.1f}s"
+    )
+
+
+async def generate_style_reply_within_deadline(
+    *,
+    max_seconds: float,
+    user_message: str,
+    style_username: str,
+    history: list[dict[str, str]],
+    style_examples: list[str],
+    style_words: list[str] | None = None,
+    chat_id: int | None = None,
+    summary: str = "",
+) -> str | None:
+    global _active_generations, _last_generation_at
+    if not _generation_breaker.allow_request():
+        return None
+
+    deadline = get_generation_deadline(max_seconds)
+    started = monotonic()
+    _active_generations += 1
+    try:
+        outcome = await asyncio.wait_for(
+            _generate_style_reply(
+                user_message=user_message,
+                style_username=style_username,
+                history=history,
+                style_examples=style_examples,
+                style_words=style_words,
+                chat_id=chat_id,
+                summary=summary,
+            ),
+            timeout=deadline,
+        )
+    except asyncio.TimeoutError:
+        # Count the miss at the deadline so a slowing backend pushes the
+        # next deadline up instead of being invisible to the tracker.
+        _generation_latency.observe(deadline)
+        _generation_breaker.record_failure()
+        logger.info("AI reply missed its deadline: deadline=%.1fs", deadline)
+        return None
+    except asyncio.CancelledError:
+        _generation_breaker.release_probe()
+        raise
+    finally:
+        _active_generations -= 1
+        _last_generation_at = monotonic()
+
+    if outcome.model_ok is None:
+        # Nothing reached the model, so there is nothing to judge it by.
+        _generation_breaker.release_probe()
+        return None
+    if not outcome.model_ok:
+        _generation_breaker.record_failure()
+        return None
+
+    # An answer that cleans up to nothing is still a healthy model.
+    _generation_latency.observe(monotonic() - started)
+    _generation_breaker.record_success()
+    return outcome.text
@@ -1,4 +1,6 @@
-﻿_pending_targets: dict[int, int] = {}
+﻿from bot.state_snapshot import register_state
+
+_pending_targets: dict[int, int] = {}
 
 
 def set_pending_target(user_id: int, chat_id: int) -> None:
@@ -11,3 +13,15 @@ def pop_pending_target(user_id: int) -> int | None:
 
 def clear_pending_target(user_id: int) -> None:
     _pending_targets.pop(user_id, None)
+
+
+def _dump_pending_targets() -> dict[str, int]:
+    return {str(user_id): chat_id for user_id, chat_id in _pending_targets.items()}
+
+
+def _restore_pending_targets(value: dict[str, int]) -> None:
+    for user_id, chat_id in value.items():
+        _pending_targets.setdefault(int(user_id), int(chat_id))
+
+
+register_state("anon_pending_targets", _dump_pending_targets, _restore_pending_targets)
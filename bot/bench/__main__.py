@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import defaultdict
+import random
+from time import perf_counter, time
+
+from aiogram.types import Update
+
+from bot.bench.harness import offline_bot, print_latency_table, print_session_summary
+
+_SCENARIOS = (
+    ("chatter", 0.55),
+    ("greeting", 0.05),
+    ("ai_trigger", 0.15),
+    ("ai_poke", 0.05),
+    ("mem_photo", 0.05),
+    ("mem_video", 0.05),
+    ("admin_command", 0.10),
+)
+_WORDS = (
+    "кеше", "бугн", "кешке", "акша", "машина", "кино", "футбол", "пиво", "работа", "дом",
+    "жаксы", "жаман", "натуре", "каям", "шша", "кайда", "барамыз", "ешнарсе", "болды", "мал",
+)
+_AI_PROMPTS = (
+    "алдик кеше не болды у вас",
+    "алдик сен каяксн сегодня вечером",
+    "алдик маган акша бершы пожалуйста",
+    "алдик кто самый крутой в чате",
+    "одеяло расскажи что нибудь смешное",
+)
+_ADMIN_COMMANDS = ("/ai_status", "/group_info", "/search пиво футбол", "/help")
+
+
+def _message_text(kind: str, rng: random.Random) -> str:
+    if kind == "chatter":
+        return " ".join(rng.choices(_WORDS, k=rng.randint(3, 10)))
+    if kind == "greeting":
+        return rng.choice(("пр всем", "привет ребята"))
+    if kind == "ai_trigger":
+        return rng.choice(_AI_PROMPTS)
+    if kind == "ai_poke":
+        return "алдик"
+    if kind == "mem_photo":
+        return rng.choice(("алдик фото кинь", "алдик фотку давай"))
+    if kind == "mem_video":
+        return rng.choice(("алдик видео кинь", "алдик видос давай"))
+    return rng.choice(_ADMIN_COMMANDS)
+
+
+def _build_update(update_id: int, kind: str, rng: random.Random, chats: int, users: int) -> Update:
+    chat_id = -1001000000000 - rng.randrange(chats)
+    user_id = 1000 + rng.randrange(users)
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": f"bench {chat_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "user", "username": f"user{user_id}"},
+                "text": _message_text(kind, rng),
+            },
+        }
+    )
+
+
+async def _run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    kinds = [kind for kind, _ in _SCENARIOS]
+    weights = [weight for _, weight in _SCENARIOS]
+    plan = list(enumerate(rng.choices(kinds, weights=weights, k=args.updates), start=1))
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with offline_bot(
+        telegram_latency=args.telegram_latency,
+        ollama_latency=args.ollama_latency,
+        upstream_latency=args.upstream_latency,
+    ) as offline:
+
+        async def feed(update_id: int, kind: str) -> None:
+            update = _build_update(update_id, kind, rng, args.chats, args.users)
+            async with semaphore:
+                started = perf_counter()
+                try:
+                    await offline.dp.feed_update(offline.bot, update)
+                except Exception:
+                    errors[kind] += 1
+                latencies[kind].append(perf_counter() - started)
+
+        started = perf_counter()
+        await asyncio.gather(*(feed(update_id, kind) for update_id, kind in plan))
+        elapsed = perf_counter() - started
+
+    print(f"updates: {len(plan)} in {elapsed:.2f}s -> {len(plan) / elapsed:.1f} updates/s")
+    print_latency_table(latencies, errors, kinds)
+    print_session_summary(offline.session)
+    print(f"work dir: {offline.workdir}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Feed synthetic group updates through the real dispatcher against local stubs."
+    )
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--ollama-latency", type=float, default=0.3)
+    parser.add_argument("--upstream-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from statistics import median
+from time import perf_counter
+
+import aiohttp
+
+from bot.ai_service import (
+    _build_options,
+    _plan_prompt,
+    get_ollama_base_url,
+    get_ollama_model,
+)
+
+_STYLE_USERNAME = "odeyalow"
+_STYLE_EXAMPLES = [
+    "шша мал каз келем",
+    "натуре базар жок",
+    "аузнды жапшы чорт",
+]
+_CHAT_TURNS = (
+    ("user1", "алдик кеше не болды"),
+    ("user2", "ешнарсе болган жок"),
+    ("user1", "алдик сен каяксн"),
+    ("user3", "пр всем"),
+    ("user2", "алдик маган акша бершы"),
+    ("user1", "кайда барамыз кешке"),
+    ("user3", "алдик кто самый крутой"),
+    ("user2", "дану гульбану"),
+)
+
+
+async def _stream_generate(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    payload: dict,
+) -> tuple[float, float, dict]:
+    started = perf_counter()
+    first_token_at: float | None = None
+    final: dict = {}
+    parts: list[str] = []
+    async with session.post(f"{base_url}/api/generate", json={**payload, "stream": True}) as response:
+        response.raise_for_status()
+        async for raw_line in response.content:
+            line = raw_line.strip()
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                if first_token_at is None:
+                    first_token_at = perf_counter()
+                parts.append(str(chunk["response"]))
+            if chunk.get("done"):
+                final = chunk
+    finished = perf_counter()
+    final["response"] = "".join(parts)
+    ttft = (first_token_at or finished) - started
+    return ttft, finished - started, final
+
+
+async def _run_scenario(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    model: str,
+    turns: int,
+    reuse: bool,
+) -> list[tuple[float, float, int]]:
+    results: list[tuple[float, float, int]] = []
+    history: list[dict[str, str]] = []
+    unseen: list[dict[str, str]] = []
+    context: list[int] | None = None
+
+    for index in range(turns):
+        username, text = _CHAT_TURNS[index % len(_CHAT_TURNS)]
+        plan = None
+        if reuse and context:
+            plan = _plan_prompt(
+                user_message=text,
+                style_username=_STYLE_USERNAME,
+                history=unseen,
+                style_examples=_STYLE_EXAMPLES,
+                style_words=[],
+                context_tokens=len(context),
+            )
+        if plan is None:
+            context = None
+            plan = _plan_prompt(
+                user_message=text,
+                style_username=_STYLE_USERNAME,
+                history=history,
+                style_examples=_STYLE_EXAMPLES,
+                style_words=[],
+            )
+        if plan is None:
+            raise RuntimeError("benchmark message does not fit into num_ctx")
+
+        payload: dict = {
+            "model": model,
+            "prompt": plan.user,
+            "options": _build_options(plan),
+            "keep_alive": "30m",
+        }
+        if context:
+            payload["context"] = context
+        else:
+            payload["system"] = plan.system
+
+        ttft, total, final = await _stream_generate(session, base_url, payload)
+        results.append((ttft, total, int(final.get("prompt_eval_count") or 0)))
+
+        unseen = [
+            {"username": username, "text": text},
+            {"username": "aldik", "text": str(final.get("response") or "шша мал")},
+        ]
+        history = (history + unseen)[-4:]
+        context = final.get("context") if reuse else None
+
+    return results
+
+
+def _print_summary(label: str, results: list[tuple[float, float, int]]) -> None:
+    warm = results[1:] or results
+    print(
+        f"{label:>12}: "
+        f"ttft_median={median(item[0] for item in warm) * 1000:.0f}ms "
+        f"total_median={median(item[1] for item in warm) * 1000:.0f}ms "
+        f"prompt_tokens_median={median(item[2] for item in warm):.0f} "
+        f"first_turn_ttft={results[0][0] * 1000:.0f}ms"
+    )
+
+
+async def _main(args: argparse.Namespace) -> None:
+    base_url = (args.base_url or get_ollama_base_url()).rstrip("/")
+    model = args.model or get_ollama_model()
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # Load the model first so neither scenario pays for it.
+        await _stream_generate(session, base_url, {"model": model, "prompt": "", "keep_alive": "30m"})
+        without_reuse = await _run_scenario(session, base_url, model, args.turns, reuse=False)
+        with_reuse = await _run_scenario(session, base_url, model, args.turns, reuse=True)
+
+    print(f"model={model} base_url={base_url} turns={args.turns}")
+    _print_summary("full prompt", without_reuse)
+    _print_summary("reused ctx", with_reuse)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare Ollama time-to-first-token with and without context reuse.",
+    )
+    parser.add_argument("--base-url", default="")
+    parser.add_argument("--model", default="")
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--timeout", type=int, default=300)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import tempfile
+
+from aiogram import Bot, Dispatcher
+
+from bot.bench.stubs import create_media_stub_app, create_ollama_stub_app, start_stub, stub_base_url
+from bot.bench.telegram import FakeTelegramSession
+
+
+@dataclass(frozen=True)
+class OfflineBot:
+    bot: Bot
+    dp: Dispatcher
+    session: FakeTelegramSession
+    workdir: Path
+
+
+@asynccontextmanager
+async def offline_bot(
+    *,
+    bot_id: int = 123456,
+    telegram_latency: float = 0.02,
+    ollama_latency: float = 0.3,
+    upstream_latency: float = 0.05,
+) -> AsyncIterator[OfflineBot]:
+    # A real dispatcher and routers on a scratch database, with every
+    # upstream replaced by a local stub so nothing leaves the machine.
+    workdir = Path(tempfile.mkdtemp(prefix="bot-bench-"))
+    ollama_runner = await start_stub(
+        create_ollama_stub_app(latency=ollama_latency, load_delay=0.0),
+        "127.0.0.1",
+        0,
+    )
+    media_runner = await start_stub(create_media_stub_app(latency=upstream_latency), "127.0.0.1", 0)
+    media_url = stub_base_url(media_runner)
+    os.environ.pop("UPDATE_RECORD_PATH", None)
+    os.environ.update(
+        {
+            "OLLAMA_BASE_URLS": stub_base_url(ollama_runner),
+            "INFLACT_POSTS_URL": f"{media_url}/inflact/posts/",
+            "TIKWM_SEARCH_URL": f"{media_url}/tikwm/api/feed/search",
+            "SLOW_UPDATE_LOG": str(workdir / "slow_updates.log"),
+        }
+    )
+
+    # Imported after the environment points at the stubs.
+    from bot.ai_service import refresh_model_state
+    from bot.config import reload_runtime_config
+    from bot.load_shedding import flush_ingest_buffer, run_load_shedding_controller
+    from bot.loop_watchdog import start_loop_watchdog
+    from bot.main import create_bot, create_dispatcher
+    from bot.metrics import run_loop_lag_monitor
+    from bot.storage import init_storage
+
+    reload_runtime_config(read_dotenv=False)
+    init_storage(str(workdir / "bench.db"))
+    await refresh_model_state()
+    session = FakeTelegramSession(latency=telegram_latency)
+    bot = create_bot(f"{bot_id}:bench", session=session)
+    watchdog = start_loop_watchdog()
+    tasks = [asyncio.create_task(run_loop_lag_monitor()), asyncio.create_task(run_load_shedding_controller())]
+    try:
+        yield OfflineBot(bot=bot, dp=create_dispatcher(), session=session, workdir=workdir)
+    finally:
+        for task in tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        flush_ingest_buffer()
+        watchdog.stop()
+        await bot.session.close()
+        await media_runner.cleanup()
+        await ollama_runner.cleanup()
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def print_latency_table(latencies: dict[str, list[float]], errors: dict[str, int], order: list[str]) -> None:
+    print(f"{'kind':<22}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind in order:
+        values = latencies.get(kind, [])
+        if not values:
+            continue
+        print(
+            f"{kind:<22}{len(values):>7}{errors.get(kind, 0):>8}"
+            f"{percentile(values, 0.50) * 1000:>10.1f}"
+            f"{percentile(values, 0.95) * 1000:>10.1f}"
+            f"{percentile(values, 0.99) * 1000:>10.1f}"
+            f"{max(values) * 1000:>10.1f}"
+        )
+
+
+def print_session_summary(session: FakeTelegramSession) -> None:
+    from bot.load_shedding import shed_actions
+    from bot.metrics import loop_stalls
+    from bot.rate_limits import rate_limited_triggers
+
+    calls = ", ".join(f"{method}={count}" for method, count in sorted(session.calls.items()))
+    print(f"bot api calls: {calls or '-'}")
+    print(f"uploaded: {session.uploaded_bytes / 1024:.0f} KiB")
+    print(f"event loop stalls: {int(loop_stalls.get())}")
+    shed = ", ".join(f"{action}={int(shed_actions.get(action))}" for action in ("ai", "media", "ingest_only"))
+    print(f"load shedding: {shed}")
+    print(f"rate limited triggers: {int(rate_limited_triggers.total())}")
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import argparse
+from collections.abc import Callable
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import random
+import sqlite3
+import sys
+import tempfile
+import timeit
+
+from bot import ai_service
+from bot.handlers import group_features
+from bot.storage import (
+    add_ai_message,
+    get_recent_ai_messages,
+    get_recent_ai_messages_by_username,
+    init_storage,
+)
+
+_BASELINES_PATH = Path(__file__).with_name("micro_baselines.json")
+_DEFAULT_THRESHOLD = 1.3
+_DEFAULT_ROWS = (10_000, 1_000_000)
+_REPEAT = 7
+_INSERT_BATCH = 50_000
+_CHATS = 200
+_USERS_PER_CHAT = 40
+_SAMPLE_MESSAGES = (
+    "алдик кеше не болды у вас",
+    "Алдик, мем кинь пж!!!",
+    "алдик фото кинь",
+    "алдик мен грусни",
+    "пр всем кто тут",
+    "эээммм ну такое",
+    "отн шша мал каз келем",
+    "кайда барамыз кешке? го в кино",
+    "алдик анон ссылка дай",
+    "натуре базар жок, аузнды жапшы чорт 😂😂",
+    "A long message with latin words and some punctuation: hello, world; how are you?",
+    "кешке футбол бар ма, кто идет кто не идет пишите в лс а то опять никто не придет",
+)
+_TRIGGER_CHECKS = (
+    "_is_anon_link_request",
+    "_is_aldik_name_trigger",
+    "_is_mem_request",
+    "_is_mem_photo_request",
+    "_is_paroshka_trigger",
+    "_is_otn_trigger",
+    "_is_em_trigger",
+    "_is_sad_trigger",
+    "_is_pr_trigger",
+)
+
+
+@dataclass(frozen=True)
+class MicroResult:
+    name: str
+    seconds: float
+
+
+def _time_call(func: Callable[[], object]) -> float:
+    # The fastest repeat is the least disturbed by the rest of the machine,
+    # which keeps small benchmarks stable enough to gate on.
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    return min(timer.repeat(repeat=_REPEAT, number=loops)) / loops
+
+
+def _text_benchmarks() -> dict[str, Callable[[], object]]:
+    normalized = [group_features._normalize_text(text) for text in _SAMPLE_MESSAGES]
+    benchmarks: dict[str, Callable[[], object]] = {
+        "text.normalize_text": lambda: [group_features._normalize_text(text) for text in _SAMPLE_MESSAGES],
+    }
+    for name in _TRIGGER_CHECKS:
+        check = getattr(group_features, name)
+        benchmarks[f"text.{name.lstrip('_')}"] = lambda check=check: [check(text) for text in normalized]
+    return benchmarks
+
+
+def _ai_text_benchmarks() -> dict[str, Callable[[], object]]:
+    replies = [text.lower() for text in _SAMPLE_MESSAGES]
+    random.seed(1)
+    return {
+        "ai.enforce_street_style": lambda: [ai_service._enforce_street_style(text) for text in _SAMPLE_MESSAGES],
+        "ai.inject_vocab": lambda: [ai_service._inject_vocab(text) for text in replies],
+    }
+
+
+def _instagram_payload(posts: int) -> list[dict]:
+    # Shaped like the inflact posts response: images, videos and carousels
+    # with long CDN URLs carrying the query strings we rewrite.
+    query = "stp=dst-jpg_e35_p1080x1080&_nc_ht=scontent.cdninstagram.com&_nc_cat=1&oh=00_AfB&oe=65F0A1B2"
+    nodes: list[dict] = []
+    for index in range(posts):
+        image = f"https://scontent.cdninstagram.com/v/t51.2885-15/{index}_n.jpg?{query}"
+        video = f"https://scontent.cdninstagram.com/o1/v/t16/f1/{index}.mp4?efg=abc&_nc_ht=video"
+        kind = index % 3
+        if kind == 0:
+            nodes.append({"__typename": "GraphImage", "id": str(index), "shortcode": f"C{index}", "display_url": image})
+        elif kind == 1:
+            nodes.append({"__typename": "GraphVideo", "id": str(index), "shortcode": f"C{index}", "video_url": video})
+        else:
+            children = [
+                {
+                    "node": {
+                        "__typename": "GraphImage" if child % 2 == 0 else "GraphVideo",
+                        "id": f"{index}_{child}",
+                        "display_url": f"{image}&child={child}",
+                        "video_url": f"{video}&child={child}",
+                    }
+                }
+                for child in range(10)
+            ]
+            nodes.append(
+                {
+                    "__typename": "GraphSidecar",
+                    "id": str(index),
+                    "shortcode": f"C{index}",
+                    "edge_sidecar_to_children": {"edges": children},
+                }
+            )
+    return nodes
+
+
+def _instagram_benchmarks() -> dict[str, Callable[[], object]]:
+    nodes = _instagram_payload(300)
+    extract = group_features._extract_instagram_post_media_candidates
+    return {"insta.extract_post_media_candidates": lambda: [extract(node, "memes") for node in nodes]}
+
+
+def _populate_database(path: Path, rows: int) -> None:
+    init_storage(str(path))
+    with sqlite3.connect(path) as conn:
+        existing = conn.execute("SELECT COALESCE(MAX(id), 0) FROM ai_messages").fetchone()[0]
+        rng = random.Random(rows)
+        for start in range(existing, rows, _INSERT_BATCH):
+            batch = []
+            for index in range(start, min(rows, start + _INSERT_BATCH)):
+                chat = index % _CHATS
+                user = rng.randrange(_USERS_PER_CHAT)
+                batch.append(
+                    (-1000 - chat, user, f"user{user}", rng.choice(_SAMPLE_MESSAGES), 1_700_000_000 + index)
+                )
+            conn.executemany(
+                "INSERT INTO ai_messages (chat_id, user_id, username, text, sent_at) VALUES (?, ?, ?, ?, ?)",
+                batch,
+            )
+            conn.commit()
+
+
+def _storage_benchmarks(db_dir: Path, rows: int) -> dict[str, Callable[[], object]]:
+    path = db_dir / f"micro_{rows}.db"
+    _populate_database(path, rows)
+    init_storage(str(path))
+    suffix = f"[{rows}]"
+    return {
+        f"storage.add_ai_message{suffix}": lambda: add_ai_message(-1000, 1, "user1", "шша мал каз келем"),
+        f"storage.get_recent_ai_messages{suffix}": lambda: get_recent_ai_messages(-1001, 30),
+        f"storage.get_recent_ai_messages_by_username{suffix}": lambda: get_recent_ai_messages_by_username(
+            -1002, "user7", 25
+        ),
+    }
+
+
+def _load_baselines(path: Path) -> dict[str, float]:
+    if not path.exists():
+        return {}
+    payload = json.loads(path.read_text(encoding="utf-8"))
+    return {str(name): float(seconds) for name, seconds in (payload.get("results") or {}).items()}
+
+
+def _save_baselines(path: Path, baselines: dict[str, float], results: list[MicroResult]) -> None:
+    merged = {**baselines, **{result.name: result.seconds for result in results}}
+    payload = {"results": {name: round(merged[name], 9) for name in sorted(merged)}}
+    path.write_text(json.dumps(payload, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def run_benchmarks(rows: list[int], db_dir: Path, only: str = "") -> list[MicroResult]:
+    groups: list[Callable[[], dict[str, Callable[[], object]]]] = [
+        _text_benchmarks,
+        _ai_text_benchmarks,
+        _instagram_benchmarks,
+        *[lambda count=count: _storage_benchmarks(db_dir, count) for count in rows],
+    ]
+    results: list[MicroResult] = []
+    for group in groups:
+        for name, func in group().items():
+            if only and only not in name:
+                continue
+            results.append(MicroResult(name, _time_call(func)))
+            print(f"  {name}: {_format_seconds(results[-1].seconds)}", file=sys.stderr)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for hot paths, compared against stored baselines.")
+    parser.add_argument(
+        "--rows",
+        default=",".join(str(count) for count in _DEFAULT_ROWS),
+        help="comma separated ai_messages table sizes, e.g. 10000,1000000,10000000",
+    )
+    parser.add_argument("--db-dir", help="keep generated databases here and reuse them between runs")
+    parser.add_argument("--only", default="", help="run benchmarks whose name contains this substring")
+    parser.add_argument("--baselines", default=str(_BASELINES_PATH))
+    parser.add_argument("--threshold", type=float, default=_DEFAULT_THRESHOLD, help="allowed slowdown ratio")
+    parser.add_argument("--save", action="store_true", help="store these results as the new baselines")
+    args = parser.parse_args()
+
+    rows = [int(value) for value in args.rows.split(",") if value.strip()]
+    db_dir = Path(args.db_dir) if args.db_dir else Path(tempfile.mkdtemp(prefix="bot-micro-"))
+    db_dir.mkdir(parents=True, exist_ok=True)
+    baselines_path = Path(args.baselines)
+    baselines = _load_baselines(baselines_path)
+
+    results = run_benchmarks(rows, db_dir, args.only)
+
+    regressions = 0
+    print(f"{'benchmark':<58}{'time':>12}{'baseline':>12}{'ratio':>8}")
+    for result in results:
+        baseline = baselines.get(result.name)
+        if baseline is None:
+            print(f"{result.name:<58}{_format_seconds(result.seconds):>12}{'-':>12}{'new':>8}")
+            continue
+        ratio = result.seconds / baseline if baseline > 0 else 0.0
+        marker = ""
+        if ratio > args.threshold:
+            regressions += 1
+            marker = "  REGRESSION"
+        print(f"{result.name:<58}{_format_seconds(result.seconds):>12}{_format_seconds(baseline):>12}{ratio:>7.2f}x{marker}")
+
+    if args.save:
+        _save_baselines(baselines_path, baselines, results)
+        print(f"baselines saved to {baselines_path}")
+        return
+    if regressions:
+        print(f"{regressions} benchmark(s) slower than {args.threshold:.2f}x baseline")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
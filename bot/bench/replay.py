@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import defaultdict
+import cProfile
+import gzip
+import json
+from pathlib import Path
+import pstats
+from time import perf_counter, time
+from typing import Any
+
+from aiogram.types import Update
+
+from bot.bench.harness import offline_bot, print_latency_table, print_session_summary
+
+_DATE_KEYS = {"date", "edit_date", "forward_date"}
+_DEFAULT_BOT_ID = 123456
+
+
+def load_recording(path: Path) -> tuple[int, list[tuple[float, dict[str, Any]]]]:
+    opener = gzip.open if path.suffix == ".gz" else open
+    bot_id = 0
+    records: list[tuple[float, dict[str, Any]]] = []
+    with opener(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "bot_id" in record:
+                bot_id = bot_id or int(record["bot_id"])
+                continue
+            records.append((float(record["ts"]), record["update"]))
+    records.sort(key=lambda item: item[0])
+    return bot_id or _DEFAULT_BOT_ID, records
+
+
+def _shift_dates(value: Any, delta: int) -> Any:
+    # Handlers compare message dates with the clock, so recorded updates are
+    # moved to "now" as if they had just arrived.
+    if isinstance(value, list):
+        return [_shift_dates(item, delta) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {
+        key: item + delta if key in _DATE_KEYS and isinstance(item, int) else _shift_dates(item, delta)
+        for key, item in value.items()
+    }
+
+
+async def _replay(args: argparse.Namespace) -> None:
+    bot_id, records = load_recording(Path(args.path))
+    if args.limit:
+        records = records[: args.limit]
+    if not records:
+        print("recording is empty")
+        return
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+
+    async with offline_bot(
+        bot_id=bot_id,
+        telegram_latency=args.telegram_latency,
+        ollama_latency=args.ollama_latency,
+        upstream_latency=args.upstream_latency,
+    ) as offline:
+        from bot.metrics import get_handler_kind
+
+        async def feed(update: Update) -> None:
+            started = perf_counter()
+            failed = False
+            try:
+                await offline.dp.feed_update(offline.bot, update)
+            except Exception:
+                failed = True
+            kind = get_handler_kind() or "unhandled"
+            latencies[kind].append(perf_counter() - started)
+            if failed:
+                errors[kind] += 1
+
+        first_ts = records[0][0]
+        delta = int(time() - first_ts)
+        profiler = cProfile.Profile() if args.profile else None
+        tasks: list[asyncio.Task] = []
+        started = perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            # Updates are dispatched as tasks on the recorded schedule, like
+            # polling does, so bursts overlap the way they did live.
+            for ts, payload in records:
+                gap = (ts - first_ts) / args.speed if args.speed > 0 else 0.0
+                wait = gap - (perf_counter() - started)
+                if wait > 0:
+                    await asyncio.sleep(min(wait, args.max_gap))
+                    if wait > args.max_gap:
+                        started -= wait - args.max_gap
+                update = Update.model_validate(_shift_dates(payload, delta))
+                tasks.append(asyncio.create_task(feed(update)))
+            await asyncio.gather(*tasks)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        elapsed = perf_counter() - started
+
+    recorded_span = records[-1][0] - first_ts
+    print(
+        f"replayed {len(records)} updates ({recorded_span:.0f}s recorded) in {elapsed:.2f}s "
+        f"-> {len(records) / elapsed:.1f} updates/s"
+    )
+    print_latency_table(latencies, errors, sorted(latencies, key=lambda kind: -len(latencies[kind])))
+    print_session_summary(offline.session)
+    slow_log = offline.workdir / "slow_updates.log"
+    if slow_log.exists():
+        print(f"slow updates: {sum(1 for _ in slow_log.open(encoding='utf-8'))} in {slow_log}")
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(args.profile).sort_stats("cumulative").print_stats(args.profile_top)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded update log through the dispatcher offline.")
+    parser.add_argument("path", help="log written by UPDATE_RECORD_PATH (.jsonl or .jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=1.0, help="time acceleration, 0 replays as fast as possible")
+    parser.add_argument("--max-gap", type=float, default=5.0, help="cap on idle time between updates, seconds")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--profile", help="write cProfile stats for the whole replay to this file")
+    parser.add_argument("--profile-top", type=int, default=25)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--ollama-latency", type=float, default=0.3)
+    parser.add_argument("--upstream-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(_replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from random import choice, random
+
+from aiohttp import web
+
+# Mutable so a test can turn a running stub's failures on and off.
+OLLAMA_STUB_FAULTS = web.AppKey("ollama_stub_faults", dict[str, float])
+_STUB_REPLIES = (
+    "шша мал базар жок",
+    "натуре каям",
+    "аузнды жапшы чорт",
+    "дану гульбану",
+)
+
+
+def create_ollama_stub_app(
+    *,
+    latency: float = 0.05,
+    load_delay: float = 0.5,
+    error_rate: float = 0.0,
+    models: frozenset[str] | None = None,
+) -> web.Application:
+    # With `models` set, any other model gets Ollama's 404 "model not found".
+    loaded: set[str] = set()
+
+    async def ensure_loaded(model: str) -> None:
+        if model not in loaded:
+            await asyncio.sleep(load_delay)
+            loaded.add(model)
+
+    def failed(model: str) -> web.Response | None:
+        if models is not None and model not in models:
+            return web.json_response({"error": f"model '{model}' not found"}, status=404)
+        rate = app[OLLAMA_STUB_FAULTS]["error_rate"]
+        if rate and random() < rate:
+            return web.json_response({"error": "stub failure"}, status=500)
+        return None
+
+    async def ps(request: web.Request) -> web.Response:
+        return web.json_response({"models": [{"name": name, "model": name} for name in sorted(loaded)]})
+
+    async def generate(request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        model = str(payload.get("model") or "")
+        error = failed(model)
+        if error is not None:
+            return error
+        await ensure_loaded(model)
+        if not payload.get("prompt"):
+            return web.json_response({"model": model, "response": "", "done": True})
+
+        await asyncio.sleep(latency)
+        text = choice(_STUB_REPLIES)
+        context = [*(payload.get("context") or []), *range(len(str(payload["prompt"])) // 4 + len(text))]
+        if payload.get("stream") is False:
+            return web.json_response({"model": model, "response": text, "context": context, "done": True})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for word in text.split():
+            await response.write((json.dumps({"response": f"{word} ", "done": False}) + "\n").encode("utf-8"))
+        final = {"response": "", "done": True, "context": context, "prompt_eval_count": len(context)}
+        await response.write((json.dumps(final) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def chat(request: web.Request) -> web.Response:
+        payload = await request.json()
+        model = str(payload.get("model") or "")
+        error = failed(model)
+        if error is not None:
+            return error
+        await ensure_loaded(model)
+        await asyncio.sleep(latency)
+        return web.json_response({"message": {"role": "assistant", "content": choice(_STUB_REPLIES)}, "done": True})
+
+    app = web.Application()
+    app[OLLAMA_STUB_FAULTS] = {"error_rate": error_rate}
+    app.router.add_get("/api/ps", ps)
+    app.router.add_post("/api/generate", generate)
+    app.router.add_post("/api/chat", chat)
+    return app
+
+
+def create_media_stub_app(
+    *,
+    latency: float = 0.05,
+    posts: int = 12,
+    image_bytes: int = 64 * 1024,
+) -> web.Application:
+    # One app stands in for inflact, the Instagram CDN and tikwm; media URLs
+    # in the payloads point back at it.
+    image = b"\xff\xd8\xff\xe0" + bytes(max(0, image_bytes - 4))
+
+    def base_url(request: web.Request) -> str:
+        return f"{request.scheme}://{request.host}"
+
+    async def inflact_posts(request: web.Request) -> web.Response:
+        form = await request.post()
+        username = str(form.get("url") or "user")
+        await asyncio.sleep(latency)
+        edges = []
+        for index in range(posts):
+            node: dict = {"id": f"{username}{index}", "shortcode": f"{username}{index}"}
+            if index % 4 == 3:
+                node.update({"__typename": "GraphVideo", "video_url": f"{base_url(request)}/cdn/{username}{index}.mp4"})
+            else:
+                node.update({"__typename": "GraphImage", "display_url": f"{base_url(request)}/cdn/{username}{index}.jpg"})
+            edges.append({"node": node})
+        data = {"posts": {"data": {"user": {"edge_owner_to_timeline_media": {"edges": edges}}}}}
+        return web.json_response({"status": "success", "data": data})
+
+    async def cdn_image(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        return web.Response(body=image, content_type="image/jpeg")
+
+    async def tikwm_search(request: web.Request) -> web.Response:
+        keyword = request.query.get("keywords") or "meme"
+        await asyncio.sleep(latency)
+        videos = [
+            {
+                "video_id": f"{keyword}{index}",
+                "title": f"#meme {keyword} {index}",
+                "play": f"{base_url(request)}/cdn/{keyword}{index}.mp4",
+                "play_count": 1000 - index,
+                "author": {"unique_id": "bench"},
+            }
+            for index in range(int(request.query.get("count") or 20))
+        ]
+        return web.json_response({"code": 0, "msg": "success", "data": {"videos": videos}})
+
+    app = web.Application()
+    app.router.add_post("/inflact/posts/", inflact_posts)
+    app.router.add_get("/cdn/{name}", cdn_image)
+    app.router.add_get("/tikwm/api/feed/search", tikwm_search)
+    return app
+
+
+async def start_stub(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def stub_base_url(runner: web.AppRunner) -> str:
+    host, port = runner.addresses[0][:2]
+    return f"http://{host}:{port}"
+
+
+async def _main(args: argparse.Namespace) -> None:
+    runners = []
+    for port in args.ollama:
+        app = create_ollama_stub_app(
+            latency=args.latency,
+            load_delay=args.load_delay,
+            error_rate=args.error_rate,
+        )
+        runners.append(await start_stub(app, args.host, port))
+        print(f"ollama stub listening on http://{args.host}:{port}")
+    if args.media is not None:
+        runner = await start_stub(create_media_stub_app(latency=args.latency), args.host, args.media)
+        runners.append(runner)
+        base_url = stub_base_url(runner)
+        print(f"media stub listening on {base_url}")
+        print(f"  INFLACT_POSTS_URL={base_url}/inflact/posts/")
+        print(f"  TIKWM_SEARCH_URL={base_url}/tikwm/api/feed/search")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run local stub servers standing in for upstream APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ollama", type=int, action="append", default=[], metavar="PORT")
+    parser.add_argument("--media", type=int, default=None, metavar="PORT", help="inflact, CDN and tikwm stub")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--load-delay", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    if not args.ollama and args.media is None:
+        parser.error("pass at least one --ollama PORT or --media PORT")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
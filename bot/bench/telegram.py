@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from collections.abc import AsyncGenerator
+import json
+from time import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetChatMember, GetMe, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+
+_MESSAGE_METHODS = {
+    "sendMessage",
+    "sendPhoto",
+    "sendVideo",
+    "sendAnimation",
+    "sendVoice",
+    "sendAudio",
+    "sendDocument",
+}
+
+
+class FakeTelegramSession(BaseSession):
+    def __init__(self, latency: float = 0.02) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.uploaded_bytes = 0
+        self._message_id = 0
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+        timeout: int | None = None,
+    ) -> TelegramType:
+        api_method = method.__api_method__
+        self.calls[api_method] += 1
+        # Uploads are drained like the real session would stream them.
+        for name in type(method).model_fields:
+            value = getattr(method, name, None)
+            if isinstance(value, InputFile):
+                async for chunk in value.read(bot):
+                    self.uploaded_bytes += len(chunk)
+        await asyncio.sleep(self.latency)
+
+        response: Response[TelegramType] = self.check_response(
+            bot,
+            method,
+            200,
+            json.dumps({"ok": True, "result": self._result(bot, method)}),
+        )
+        return response.result
+
+    def _result(self, bot: Bot, method: TelegramMethod[Any]) -> Any:
+        if isinstance(method, GetMe):
+            return {"id": bot.id, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if isinstance(method, GetChatMember):
+            return {
+                "status": "creator",
+                "is_anonymous": False,
+                "user": {"id": method.user_id, "is_bot": False, "first_name": "admin"},
+            }
+        if method.__api_method__ in _MESSAGE_METHODS:
+            self._message_id += 1
+            chat_id = getattr(method, "chat_id", 0)
+            return {
+                "message_id": self._message_id,
+                "date": int(time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+                "from": {"id": bot.id, "is_bot": True, "first_name": "bench"},
+                "text": str(getattr(method, "text", "") or ""),
+            }
+        return True
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: dict[str, Any] | None = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        return None
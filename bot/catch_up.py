@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from time import time
+
+from aiogram.types import Message, Update
+
+from bot.config import get_runtime_config
+from bot.metrics import Counter
+from bot.storage import get_bot_state, set_bot_state
+
+logger = logging.getLogger(__name__)
+_CURSOR_FLUSH_INTERVAL_SECONDS = 1.0
+# Telegram keeps undelivered updates for a day, and after a week without any
+# it starts new update ids at random, possibly below the old cursor.
+_CURSOR_MAX_AGE_SECONDS = 24 * 60 * 60
+
+stale_triggers = Counter(
+    "bot_catch_up_stale_triggers_total",
+    "Triggers skipped because the message was too old when it was processed.",
+)
+
+_cursor_key = ""
+_resume_from = 0
+_persisted_cursor = 0
+_highest_seen = 0
+_in_flight: dict[int, tuple[Update, asyncio.Task | None]] = {}
+
+
+def get_catch_up_stale_seconds() -> float:
+    return get_runtime_config().catch_up_stale_seconds
+
+
+def load_update_cursor(bot_id: int) -> int:
+    global _cursor_key, _resume_from, _persisted_cursor, _highest_seen
+    # Update ids are per bot, so a new token starts from scratch.
+    _cursor_key = f"last_update_id:{bot_id}"
+    # Stored as "<update_id>:<unix time>"; older values have no time.
+    raw_id, _, raw_saved_at = (get_bot_state(_cursor_key) or "").partition(":")
+    _resume_from = int(raw_id) if raw_id.isdigit() else 0
+    if raw_saved_at.isdigit() and time() - int(raw_saved_at) > _CURSOR_MAX_AGE_SECONDS:
+        logger.info("Ignoring update cursor %s saved more than a day ago", _resume_from)
+        _resume_from = 0
+    _persisted_cursor = _highest_seen = _resume_from
+    return _resume_from
+
+
+def is_already_processed(update_id: int) -> bool:
+    global _resume_from
+    if not _resume_from:
+        return False
+    if update_id <= _resume_from:
+        return True
+    # Only the first batch after a restart can be redelivered. Once a newer
+    # id shows up the cursor has done its job, and keeping it would drop
+    # every later id that happens to be lower.
+    logger.info("Caught up past update %s, cursor no longer filters updates", _resume_from)
+    _resume_from = 0
+    return False
+
+
+def update_started(update: Update) -> None:
+    global _highest_seen
+    _in_flight[update.update_id] = (update, asyncio.current_task())
+    _highest_seen = max(_highest_seen, update.update_id)
+
+
+def update_finished(update_id: int) -> None:
+    _in_flight.pop(update_id, None)
+
+
+def get_in_flight_updates() -> list[tuple[Update, asyncio.Task | None]]:
+    return list(_in_flight.values())
+
+
+def get_in_flight_count() -> int:
+    return len(_in_flight)
+
+
+def get_update_cursor() -> int:
+    # Updates run concurrently; everything below the oldest one still in
+    # flight is done, so that is as far as a restart may skip.
+    if _in_flight:
+        return min(_in_flight) - 1
+    return _highest_seen
+
+
+def flush_update_cursor() -> None:
+    global _persisted_cursor
+    if not _cursor_key:
+        return
+    cursor = get_update_cursor()
+    if cursor > _persisted_cursor:
+        set_bot_state(_cursor_key, f"{cursor}:{int(time())}")
+        _persisted_cursor = cursor
+
+
+async def run_update_cursor_flusher() -> None:
+    while True:
+        await asyncio.sleep(_CURSOR_FLUSH_INTERVAL_SECONDS)
+        try:
+            flush_update_cursor()
+        except Exception:
+            logger.exception("Failed to persist the update cursor")
+
+
+def is_stale_message(message: Message) -> bool:
+    # Backlog from a restart still feeds history, but answering a meme or
+    # greeting minutes later only confuses the chat.
+    age = time() - message.date.timestamp()
+    if age <= get_catch_up_stale_seconds():
+        return False
+    stale_triggers.inc()
+    return True
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+import logging
+
+from aiogram import Bot
+from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+from bot.metrics import Gauge
+
+logger = logging.getLogger(__name__)
+# Telegram shows an action for ~5 seconds or until the bot sends a message.
+_ACTION_REFRESH_SECONDS = 4.0
+# When several jobs run in one chat, the heaviest action is the one shown.
+_ACTION_PRIORITY = (ChatAction.UPLOAD_VIDEO, ChatAction.UPLOAD_PHOTO, ChatAction.TYPING)
+
+
+@dataclass
+class _ChatActionState:
+    counts: Counter[ChatAction] = field(default_factory=Counter)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    task: asyncio.Task | None = None
+
+
+_states: dict[int, _ChatActionState] = {}
+
+
+def _current_action(state: _ChatActionState) -> ChatAction | None:
+    for action in _ACTION_PRIORITY:
+        if state.counts[action] > 0:
+            return action
+    return None
+
+
+async def _broadcast(bot: Bot, chat_id: int, state: _ChatActionState) -> None:
+    while True:
+        action = _current_action(state)
+        if action is None:
+            return
+        state.changed.clear()
+        try:
+            await bot.send_chat_action(chat_id, action)
+        except TelegramRetryAfter as error:
+            await asyncio.sleep(error.retry_after)
+            continue
+        except TelegramAPIError:
+            # No rights or the chat is gone: stay quiet until the jobs finish.
+            logger.debug("Chat action stopped for chat=%s", chat_id, exc_info=True)
+            return
+        # Wake early when a heavier action joins, so it shows right away.
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(state.changed.wait(), timeout=_ACTION_REFRESH_SECONDS)
+
+
+def get_active_chat_actions() -> int:
+    return len(_states)
+
+
+Gauge("bot_chat_action_loops", "Chats with a running chat-action loop.", function=get_active_chat_actions)
+
+
+@asynccontextmanager
+async def chat_action(bot: Bot, chat_id: int, action: ChatAction = ChatAction.TYPING) -> AsyncIterator[None]:
+    state = _states.get(chat_id)
+    if state is None:
+        state = _ChatActionState()
+        _states[chat_id] = state
+    previous = _current_action(state)
+    state.counts[action] += 1
+    if state.task is None:
+        state.task = asyncio.create_task(_broadcast(bot, chat_id, state))
+    elif _current_action(state) != previous:
+        state.changed.set()
+
+    try:
+        yield
+    finally:
+        state.counts[action] -= 1
+        if _current_action(state) is None:
+            _states.pop(chat_id, None)
+            if state.task is not None:
+                state.task.cancel()
@@ -1,30 +1,38 @@
+import asyncio
+import hashlib
+import json
+import logging
+
 from aiogram import Bot
 from aiogram.types import (
     BotCommand,
+    BotCommandScope,
     BotCommandScopeAllChatAdministrators,
     BotCommandScopeAllGroupChats,
     BotCommandScopeAllPrivateChats,
 )
 
+from bot.storage import get_bot_state, set_bot_state
 
-async def setup_bot_commands(bot: Bot) -> None:
-    await bot.set_my_commands(
-        commands=[
+logger = logging.getLogger(__name__)
+
+_COMMAND_SETS: tuple[tuple[BotCommandScope, list[BotCommand]], ...] = (
+    (
+        BotCommandScopeAllPrivateChats(),
+        [
             BotCommand(command="help", description="help"),
         ],
-        scope=BotCommandScopeAllPrivateChats(),
-    )
-
-    await bot.set_my_commands(
-        commands=[
+    ),
+    (
+        BotCommandScopeAllGroupChats(),
+        [
             BotCommand(command="help", description="help"),
             BotCommand(command="group_info", description="group info"),
         ],
-        scope=BotCommandScopeAllGroupChats(),
-    )
-
-    await bot.set_my_commands(
-        commands=[
+    ),
+    (
+        BotCommandScopeAllChatAdministrators(),
+        [
             BotCommand(command="help", description="help"),
             BotCommand(command="group_info", description="group info"),
             BotCommand(command="bot_on", description="enable bot"),
@@ -36,6 +44,35 @@ async def setup_bot_commands(bot: Bot) -> None:
             BotCommand(command="ai_off", description="disable local ai replies"),
             BotCommand(command="ai_style", description="set ai style username"),
             BotCommand(command="ai_status", description="show ai status"),
+            BotCommand(command="search", description="search chat history"),
+            BotCommand(command="limits", description="show trigger rate limits"),
+            BotCommand(command="set_limit", description="tune a trigger rate limit"),
+            BotCommand(command="triggers", description="list custom triggers"),
+            BotCommand(command="trigger_add", description="add a custom trigger"),
+            BotCommand(command="trigger_del", description="remove a custom trigger"),
         ],
-        scope=BotCommandScopeAllChatAdministrators(),
+    ),
+)
+
+
+def _command_sets_hash() -> str:
+    payload = [
+        [scope.type, [[command.command, command.description] for command in commands]]
+        for scope, commands in _COMMAND_SETS
+    ]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+async def setup_bot_commands(bot: Bot) -> None:
+    # Commands live on Telegram's side; re-sending an unchanged set only
+    # slows every restart down.
+    state_key = f"bot_commands_hash:{bot.id}"
+    commands_hash = _command_sets_hash()
+    if get_bot_state(state_key) == commands_hash:
+        logger.info("Bot commands unchanged, skipping registration")
+        return
+
+    await asyncio.gather(
+        *(bot.set_my_commands(commands=commands, scope=scope) for scope, commands in _COMMAND_SETS)
     )
+    set_bot_state(state_key, commands_hash)
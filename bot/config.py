@@ -1,7 +1,18 @@
-﻿from dataclasses import dataclass
+﻿from collections.abc import Mapping
+from dataclasses import dataclass, fields
+import logging
 import os
 
-from dotenv import load_dotenv
+from dotenv import dotenv_values
+
+logger = logging.getLogger(__name__)
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+_FALSE_VALUES = {"0", "false", "no", "off"}
+# Read once at startup; a reload stores the new value but it only takes
+# effect after a restart.
+RESTART_ONLY_FIELDS = frozenset(
+    {"metrics_port", "metrics_host", "slow_update_log", "update_record_path", "loop_block_seconds"}
+)
 
 
 @dataclass(frozen=True)
@@ -10,10 +21,212 @@ class Config:
     db_path: str
 
 
+@dataclass(frozen=True)
+class RuntimeConfig:
+    ollama_base_urls: tuple[str, ...]
+    ollama_model: str
+    ai_max_tokens: int
+    ai_num_ctx: int
+    ai_timeout_seconds: int
+    ai_fast_reply_timeout_seconds: int
+    ai_keep_alive_ping_seconds: int
+    ai_context_reuse: bool
+    ai_retrieval: bool
+    ai_embed_model: str
+    ai_retrieval_dim: int
+    ai_summaries: bool
+    ai_reply_cooldown_seconds: float
+    ai_low_effort_max_words: int
+    reply_seen_ttl_seconds: float
+    search_results_limit: int
+    inflact_posts_url: str
+    tikwm_search_url: str
+    catch_up_stale_seconds: float
+    shutdown_drain_seconds: float
+    load_shedding: bool
+    load_shed_queue_levels: tuple[float, ...]
+    load_shed_lag_levels: tuple[float, ...]
+    load_shed_recover_seconds: float
+    slow_update_seconds: float
+    slow_update_log: str
+    update_record_path: str
+    loop_block_seconds: float
+    metrics_port: int
+    metrics_host: str
+    bot_admin_ids: frozenset[int]
+
+
+# Keys the .env file put into os.environ, each with the value it replaced
+# (None if it was unset), so a key later removed from .env can be undone.
+_dotenv_applied: dict[str, str | None] = {}
+
+
+def _apply_dotenv(override: bool) -> None:
+    values = {key: value for key, value in dotenv_values().items() if value is not None}
+    for key in set(_dotenv_applied) - set(values):
+        original = _dotenv_applied.pop(key)
+        if original is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = original
+    for key, value in values.items():
+        if key not in _dotenv_applied:
+            if key in os.environ and not override:
+                continue
+            _dotenv_applied[key] = os.environ.get(key)
+        os.environ[key] = value
+
+
 def load_config() -> Config:
-    load_dotenv()
+    _apply_dotenv(override=False)
     bot_token = os.getenv("BOT_TOKEN")
     if not bot_token:
         raise RuntimeError("BOT_TOKEN is not set. Add it to .env")
     db_path = os.getenv("BOT_DB_PATH", "bot.db")
     return Config(bot_token=bot_token, db_path=db_path)
+
+
+class _EnvReader:
+    def __init__(self, env: Mapping[str, str]) -> None:
+        self.env = env
+        self.problems: list[str] = []
+
+    def text(self, name: str, default: str) -> str:
+        return (self.env.get(name) or default).strip()
+
+    def number(self, name: str, default: float, low: float, high: float, cast: type = float) -> float:
+        raw = (self.env.get(name) or "").strip()
+        if not raw:
+            return cast(default)
+        try:
+            value = cast(raw)
+        except ValueError:
+            self.problems.append(f"{name}={raw!r} is not a number, using {default}")
+            return cast(default)
+        clamped = max(low, min(value, high))
+        if clamped != value:
+            self.problems.append(f"{name}={raw} is outside {low}..{high}, using {clamped}")
+        return cast(clamped)
+
+    def integer(self, name: str, default: int, low: int, high: int) -> int:
+        return int(self.number(name, default, low, high, cast=int))
+
+    def flag(self, name: str, default: bool) -> bool:
+        raw = (self.env.get(name) or "").strip().casefold()
+        if not raw:
+            return default
+        if raw in _TRUE_VALUES:
+            return True
+        if raw not in _FALSE_VALUES:
+            self.problems.append(f"{name}={raw!r} is not a boolean, treating it as off")
+        return False
+
+    def urls(self, name: str, fallback_name: str, default: str) -> tuple[str, ...]:
+        raw = self.env.get(name) or self.env.get(fallback_name) or default
+        urls: list[str] = []
+        for item in raw.split(","):
+            url = item.strip().rstrip("/")
+            if url and url not in urls:
+                urls.append(url)
+        return tuple(urls) or (default,)
+
+    def levels(self, name: str, default: tuple[float, ...]) -> tuple[float, ...]:
+        raw = (self.env.get(name) or "").strip()
+        if not raw:
+            return default
+        try:
+            values = tuple(float(item) for item in raw.split(","))
+        except ValueError:
+            self.problems.append(f"{name}={raw!r} is not a list of numbers, using {default}")
+            return default
+        increasing = all(low < high for low, high in zip(values, values[1:]))
+        if len(values) != len(default) or not increasing or values[0] <= 0:
+            self.problems.append(
+                f"{name}={raw!r} needs {len(default)} increasing positive values, using {default}"
+            )
+            return default
+        return values
+
+    def ids(self, name: str) -> frozenset[int]:
+        result: set[int] = set()
+        for item in (self.env.get(name) or "").replace(" ", ",").split(","):
+            item = item.strip()
+            if not item:
+                continue
+            try:
+                result.add(int(item))
+            except ValueError:
+                self.problems.append(f"{name} has a non-numeric id {item!r}, skipping it")
+        return frozenset(result)
+
+
+def load_runtime_config(env: Mapping[str, str] | None = None) -> tuple[RuntimeConfig, list[str]]:
+    reader = _EnvReader(os.environ if env is None else env)
+    config = RuntimeConfig(
+        ollama_base_urls=reader.urls("OLLAMA_BASE_URLS", "OLLAMA_BASE_URL", "http://127.0.0.1:11434"),
+        ollama_model=reader.text("OLLAMA_MODEL", "qwen2.5:1.5b"),
+        ai_max_tokens=reader.integer("AI_MAX_TOKENS", 32, 12, 96),
+        ai_num_ctx=reader.integer("AI_NUM_CTX", 512, 256, 8192),
+        ai_timeout_seconds=reader.integer("AI_TIMEOUT_SECONDS", 45, 10, 120),
+        ai_fast_reply_timeout_seconds=reader.integer("AI_FAST_REPLY_TIMEOUT_SECONDS", 7, 3, 20),
+        ai_keep_alive_ping_seconds=reader.integer("AI_KEEP_ALIVE_PING_SECONDS", 240, 15, 1800),
+        ai_context_reuse=reader.flag("AI_CONTEXT_REUSE", False),
+        ai_retrieval=reader.flag("AI_RETRIEVAL", False),
+        ai_embed_model=reader.text("AI_EMBED_MODEL", "stub"),
+        ai_retrieval_dim=reader.integer("AI_RETRIEVAL_DIM", 256, 32, 1024),
+        ai_summaries=reader.flag("AI_SUMMARIES", True),
+        ai_reply_cooldown_seconds=reader.number("AI_REPLY_COOLDOWN_SECONDS", 5.0, 0.0, 600.0),
+        ai_low_effort_max_words=reader.integer("AI_LOW_EFFORT_MAX_WORDS", 2, 0, 20),
+        reply_seen_ttl_seconds=reader.number("REPLY_SEEN_TTL_SECONDS", 15.0, 1.0, 600.0),
+        search_results_limit=reader.integer("SEARCH_RESULTS_LIMIT", 10, 1, 50),
+        inflact_posts_url=reader.text("INFLACT_POSTS_URL", "https://inflact.com/downloader/api/viewer/posts/"),
+        tikwm_search_url=reader.text("TIKWM_SEARCH_URL", "https://www.tikwm.com/api/feed/search"),
+        catch_up_stale_seconds=reader.number("CATCH_UP_STALE_SECONDS", 60.0, 5.0, 3600.0),
+        shutdown_drain_seconds=reader.number("SHUTDOWN_DRAIN_SECONDS", 20.0, 0.0, 120.0),
+        load_shedding=reader.flag("LOAD_SHEDDING", True),
+        load_shed_queue_levels=reader.levels("LOAD_SHED_QUEUE_LEVELS", (60.0, 150.0, 400.0)),
+        load_shed_lag_levels=reader.levels("LOAD_SHED_LAG_LEVELS", (0.3, 1.0, 3.0)),
+        load_shed_recover_seconds=reader.number("LOAD_SHED_RECOVER_SECONDS", 15.0, 1.0, 600.0),
+        slow_update_seconds=reader.number("SLOW_UPDATE_SECONDS", 5.0, 0.1, 120.0),
+        slow_update_log=reader.text("SLOW_UPDATE_LOG", "slow_updates.log"),
+        update_record_path=reader.text("UPDATE_RECORD_PATH", ""),
+        loop_block_seconds=reader.number("LOOP_BLOCK_SECONDS", 0.2, 0.02, 10.0),
+        metrics_port=reader.integer("METRICS_PORT", 0, 0, 65535),
+        metrics_host=reader.text("METRICS_HOST", "127.0.0.1"),
+        bot_admin_ids=reader.ids("BOT_ADMIN_IDS"),
+    )
+    return config, reader.problems
+
+
+_runtime_config: RuntimeConfig | None = None
+
+
+def get_runtime_config() -> RuntimeConfig:
+    global _runtime_config
+    if _runtime_config is None:
+        config, problems = load_runtime_config()
+        for problem in problems:
+            logger.warning("Config: %s", problem)
+        _runtime_config = config
+    return _runtime_config
+
+
+def reload_runtime_config(read_dotenv: bool = True) -> tuple[list[str], list[str]]:
+    # Builds a complete new snapshot and swaps it in one assignment, so a
+    # handler never sees half of an update.
+    global _runtime_config
+    if read_dotenv:
+        _apply_dotenv(override=True)
+    previous = _runtime_config
+    config, problems = load_runtime_config()
+    changed = [
+        field.name
+        for field in fields(RuntimeConfig)
+        if previous is None or getattr(previous, field.name) != getattr(config, field.name)
+    ]
+    _runtime_config = config
+    for problem in problems:
+        logger.warning("Config: %s", problem)
+    if changed:
+        logger.info("Runtime config reloaded, changed: %s", ", ".join(changed))
+    return changed, problems
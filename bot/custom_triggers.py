@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+from collections import deque
+import logging
+import re
+
+import regex
+
+try:
+    from re import _parser as _regex_parser
+except ImportError:  # Python < 3.11
+    import sre_parse as _regex_parser
+
+from bot.storage import (
+    CustomTrigger,
+    add_custom_trigger,
+    count_custom_triggers,
+    delete_custom_trigger,
+    get_custom_triggers,
+)
+
+logger = logging.getLogger(__name__)
+
+CUSTOM_TRIGGER_TYPES = ("exact", "prefix", "regex")
+MAX_CUSTOM_TRIGGERS_PER_CHAT = 5000
+MAX_CUSTOM_PATTERN_LENGTH = 200
+MAX_CUSTOM_REPLY_LENGTH = 1000
+# Regexes without a usable literal run on every message, so they are capped.
+MAX_FULL_SCAN_REGEXES_PER_CHAT = 50
+# Bounds the work one message can cost the regex rules.
+_REGEX_TEXT_LIMIT = 2000
+_MIN_REGEX_LITERAL_LENGTH = 2
+# Backtracking a check cannot rule out is cut off at run time instead; a rule
+# that hits the deadline is dropped until the chat's rules are rebuilt.
+_REGEX_TIMEOUT_SECONDS = 0.05
+_REPEAT_OPS = (
+    _regex_parser.MAX_REPEAT,
+    _regex_parser.MIN_REPEAT,
+    getattr(_regex_parser, "POSSESSIVE_REPEAT", _regex_parser.MAX_REPEAT),
+)
+
+
+class _TrieNode:
+    __slots__ = ("children", "exact", "prefix")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _TrieNode] = {}
+        self.exact: CustomTrigger | None = None
+        self.prefix: CustomTrigger | None = None
+
+
+class _KeywordAutomaton:
+    # Aho-Corasick over the literal every regex rule has to contain: one pass
+    # over the text names the few rules whose regex is worth running.
+    def __init__(self, keywords: dict[str, list[int]]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+        for keyword, rule_ids in keywords.items():
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._out[state].extend(rule_ids)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def search(self, text: str) -> set[int]:
+        found: set[int] = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._out[state]:
+                found.update(self._out[state])
+        return found
+
+
+def required_literal(pattern: str) -> str:
+    # Longest run of plain characters at the top level of the regex; any
+    # match must contain it.
+    try:
+        parsed = _regex_parser.parse(pattern, re.IGNORECASE)
+    except (re.error, OverflowError, RecursionError):
+        return ""
+    best = run = ""
+    for op, value in parsed:
+        if op is _regex_parser.LITERAL:
+            run += chr(value)
+            if len(run) > len(best):
+                best = run
+        else:
+            run = ""
+    return best.lower() if len(best) >= _MIN_REGEX_LITERAL_LENGTH else ""
+
+
+class CustomTriggerMatcher:
+    # Exact and prefix rules are anchored at the start of the normalized
+    # text, so one walk down a shared trie checks all of them. Regex rules
+    # are prefiltered by their literals; the few without one are joined
+    # into a single alternation that only says whether any of them matches.
+    def __init__(self, triggers: list[CustomTrigger]) -> None:
+        self.size = len(triggers)
+        self._root = _TrieNode()
+        self._regexes: dict[int, tuple[CustomTrigger, regex.Pattern[str]]] = {}
+        self._full_scan: regex.Pattern[str] | None = None
+        self._full_scan_triggers: dict[str, CustomTrigger] = {}
+        self._full_scan_rules: list[tuple[CustomTrigger, regex.Pattern[str]]] = []
+
+        keywords: dict[str, list[int]] = {}
+        alternatives: list[str] = []
+        for trigger in sorted(triggers, key=lambda item: item.id):
+            if trigger.match_type == "regex":
+                if check_regex_pattern(trigger.pattern) is not None:
+                    logger.warning("Skipping invalid custom trigger regex #%s", trigger.id)
+                    continue
+                literal = required_literal(trigger.pattern)
+                if literal:
+                    keywords.setdefault(literal, []).append(trigger.id)
+                    self._regexes[trigger.id] = (trigger, regex.compile(trigger.pattern, regex.IGNORECASE))
+                else:
+                    group = f"t{trigger.id}"
+                    alternatives.append(f"(?P<{group}>{trigger.pattern})")
+                    self._full_scan_triggers[group] = trigger
+                    self._full_scan_rules.append((trigger, regex.compile(trigger.pattern, regex.IGNORECASE)))
+                continue
+
+            node = self._root
+            for char in trigger.pattern:
+                node = node.children.setdefault(char, _TrieNode())
+            if trigger.match_type == "exact":
+                node.exact = trigger
+            else:
+                node.prefix = trigger
+        self._keywords = _KeywordAutomaton(keywords) if keywords else None
+        self.full_scan_regex_count = len(alternatives)
+        if alternatives:
+            self._full_scan = regex.compile("|".join(alternatives), regex.IGNORECASE)
+
+    def match(self, normalized_text: str, text: str) -> CustomTrigger | None:
+        # An exact rule beats the longest matching prefix, which beats regex.
+        node = self._root
+        longest_prefix: CustomTrigger | None = None
+        for char in normalized_text:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.prefix is not None:
+                longest_prefix = node.prefix
+        else:
+            if node.exact is not None:
+                return node.exact
+        if longest_prefix is not None:
+            return longest_prefix
+        return self._match_regex(text[:_REGEX_TEXT_LIMIT])
+
+    def _match_regex(self, text: str) -> CustomTrigger | None:
+        # Among matching regex rules the oldest one wins.
+        best: CustomTrigger | None = None
+        if self._full_scan is not None:
+            try:
+                found = self._full_scan.search(text, timeout=_REGEX_TIMEOUT_SECONDS)
+            except TimeoutError:
+                logger.warning("Custom trigger full-scan regexes timed out, dropping %s rules", len(self._full_scan_triggers))
+                self._full_scan = None
+                found = None
+            if found is not None and found.lastgroup is not None:
+                best = self._full_scan_triggers.get(found.lastgroup)
+            if best is not None:
+                # The alternation reports the leftmost match, which may not
+                # be the oldest rule: recheck the older ones on their own.
+                best = self._oldest_full_scan_match(text, best)
+        if self._keywords is None:
+            return best
+        for rule_id in sorted(self._keywords.search(text.lower())):
+            if best is not None and rule_id > best.id:
+                break
+            entry = self._regexes.get(rule_id)
+            if entry is None:
+                continue
+            trigger, compiled = entry
+            try:
+                if compiled.search(text, timeout=_REGEX_TIMEOUT_SECONDS):
+                    return trigger
+            except TimeoutError:
+                logger.warning("Custom trigger regex #%s timed out, dropping it", rule_id)
+                del self._regexes[rule_id]
+        return best
+
+    def _oldest_full_scan_match(self, text: str, found: CustomTrigger) -> CustomTrigger:
+        for trigger, compiled in list(self._full_scan_rules):
+            if trigger.id >= found.id:
+                break
+            try:
+                if compiled.search(text, timeout=_REGEX_TIMEOUT_SECONDS):
+                    return trigger
+            except TimeoutError:
+                logger.warning("Custom trigger regex #%s timed out, dropping it", trigger.id)
+                self._full_scan_rules.remove((trigger, compiled))
+        return found
+
+
+# Built lazily per chat and dropped whenever that chat's rules change.
+_matchers: dict[int, CustomTriggerMatcher] = {}
+
+
+def get_custom_trigger_matcher(chat_id: int) -> CustomTriggerMatcher:
+    matcher = _matchers.get(chat_id)
+    if matcher is None:
+        matcher = CustomTriggerMatcher(get_custom_triggers(chat_id))
+        _matchers[chat_id] = matcher
+    return matcher
+
+
+def match_custom_trigger(chat_id: int, normalized_text: str, text: str) -> CustomTrigger | None:
+    matcher = get_custom_trigger_matcher(chat_id)
+    if not matcher.size:
+        return None
+    return matcher.match(normalized_text, text)
+
+
+def _backtracking_risk(items, inside_repeat: bool = False) -> str | None:
+    # A repeat that can match more than once, nested in another one or
+    # wrapped around an alternation, lets the engine split the same text
+    # in exponentially many ways before it gives up.
+    for op, value in items:
+        children: list = []
+        nested_repeat = inside_repeat
+        if op in _REPEAT_OPS:
+            _, max_count, sub = value
+            repeats = max_count is _regex_parser.MAXREPEAT or max_count > 1
+            if repeats and inside_repeat:
+                return "вложенные повторы типа (a+)+"
+            nested_repeat = inside_repeat or repeats
+            children = [sub]
+        elif op is _regex_parser.BRANCH:
+            if inside_repeat:
+                return "выбор через | внутри повтора"
+            children = value[1]
+        elif op is _regex_parser.SUBPATTERN:
+            children = [value[3]]
+        elif op in (_regex_parser.ASSERT, _regex_parser.ASSERT_NOT):
+            children = [value[1]]
+        elif op is _regex_parser.GROUPREF_EXISTS:
+            children = [branch for branch in value[1:] if branch is not None]
+        elif op is getattr(_regex_parser, "ATOMIC_GROUP", None):
+            children = [value]
+        for child in children:
+            risk = _backtracking_risk(child, nested_repeat)
+            if risk is not None:
+                return risk
+    return None
+
+
+def check_regex_pattern(pattern: str) -> str | None:
+    try:
+        compiled = re.compile(pattern, re.IGNORECASE)
+        # Inline global flags are only legal at the very start, which they
+        # would not be once joined with other rules.
+        re.compile(f"(?:{pattern})|x", re.IGNORECASE)
+        regex.compile(pattern, regex.IGNORECASE)
+    except (re.error, regex.error) as error:
+        return f"регулярка кривая: {error}"
+    if compiled.groups:
+        # Capturing groups would shift the group numbers of other rules.
+        return "без скобок-групп, пиши (?:...) вместо (...)"
+    risk = _backtracking_risk(_regex_parser.parse(pattern, re.IGNORECASE))
+    if risk is not None:
+        return f"регулярка может зависнуть: {risk}"
+    if compiled.search(""):
+        return "регулярка срабатывает на пустой текст"
+    return None
+
+
+def is_full_scan_limit_reached(chat_id: int, pattern: str) -> bool:
+    if required_literal(pattern):
+        return False
+    return get_custom_trigger_matcher(chat_id).full_scan_regex_count >= MAX_FULL_SCAN_REGEXES_PER_CHAT
+
+
+def save_custom_trigger(chat_id: int, match_type: str, pattern: str, reply: str, created_by: int) -> int:
+    trigger_id = add_custom_trigger(chat_id, match_type, pattern, reply, created_by)
+    _matchers.pop(chat_id, None)
+    return trigger_id
+
+
+def remove_custom_trigger(chat_id: int, trigger_id: int) -> bool:
+    deleted = delete_custom_trigger(chat_id, trigger_id)
+    _matchers.pop(chat_id, None)
+    return deleted
+
+
+def has_room_for_custom_trigger(chat_id: int) -> bool:
+    return count_custom_triggers(chat_id) < MAX_CUSTOM_TRIGGERS_PER_CHAT
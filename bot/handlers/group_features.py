@@ -2,18 +2,20 @@
 
 import asyncio
 import base64
-from contextlib import suppress
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import datetime
 import hashlib
 import hmac
 import json
 import logging
-import os
+from math import ceil
 from pathlib import Path
 import re
 import secrets
 from random import choice, randint
 from time import time
-from time import monotonic
+from time import monotonic, perf_counter
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
 import aiohttp
@@ -22,24 +24,68 @@ from aiogram import Bot, F, Router
 from aiogram.enums import ChatAction, ChatMemberStatus
 from aiogram.filters import Command, CommandObject
 from aiogram.exceptions import TelegramAPIError
-from aiogram.types import BufferedInputFile, ChatMemberUpdated, FSInputFile, Message
+from aiogram.types import ChatMemberUpdated, FSInputFile, InputFile, Message
 from aiogram.utils.deep_linking import create_start_link
 
 from bot.ai_service import (
-    generate_style_reply,
+    describe_generation_state,
+    generate_style_reply_within_deadline,
     get_fast_fallback_text,
-    get_ollama_base_url,
+    get_model_state,
     get_ollama_model,
+    is_generation_available,
+    is_model_ready,
 )
+from bot.catch_up import is_stale_message
+from bot.chat_actions import chat_action
+from bot.config import get_runtime_config
+from bot.custom_triggers import (
+    CUSTOM_TRIGGER_TYPES,
+    MAX_CUSTOM_PATTERN_LENGTH,
+    MAX_CUSTOM_REPLY_LENGTH,
+    check_regex_pattern,
+    has_room_for_custom_trigger,
+    is_full_scan_limit_reached,
+    match_custom_trigger,
+    remove_custom_trigger,
+    save_custom_trigger,
+)
+from bot.load_shedding import (
+    SHED_AI,
+    SHED_INGEST_ONLY,
+    SHED_MEDIA,
+    describe_load_shedding,
+    get_load_shed_level,
+    ingest_ai_message,
+    shed_actions,
+)
+from bot.markov import generate_local_reply
+from bot.metrics import count_upstream_skip, observe_upstream, set_handler_kind
+from bot.ollama_pool import describe_backends
+from bot.rate_limits import (
+    MAX_RATE_LIMIT_CAPACITY,
+    MAX_RATE_LIMIT_PERIOD_SECONDS,
+    RATE_LIMIT_SCOPES,
+    TRIGGER_KINDS,
+    acquire_trigger,
+    describe_rate_limits,
+    reset_chat_rate_limit,
+    set_chat_rate_limit,
+)
+from bot.resilience import BREAKER_CLOSED, BREAKER_OPEN, CircuitBreaker, NegativeCache, backoff_delay
+from bot.retrieval import retrieve_context
+from bot.search import find_keyword_style_examples, search_chat_messages
+from bot.state_snapshot import monotonic_to_wall, register_state, wall_to_monotonic
+from bot.style_profile import get_style_snapshot, track_style_username
+from bot.summarizer import get_chat_summary
 from bot.storage import (
     add_meme_history,
-    add_ai_message,
     ensure_ai_group_settings,
     GroupSettings,
     ensure_anonymous_token,
     ensure_group,
+    get_custom_triggers,
     get_recent_ai_messages,
-    get_recent_ai_messages_by_username,
     get_recent_meme_video_ids,
     set_ai_enabled,
     set_ai_style_username,
@@ -57,24 +103,17 @@ router = Router()
 logger = logging.getLogger(__name__)
 
 
-def _safe_int_env(name: str, default: int, low: int, high: int) -> int:
-    raw = (os.getenv(name) or str(default)).strip()
-    try:
-        value = int(raw)
-    except ValueError:
-        value = default
-    return max(low, min(value, high))
-
 _GROUP_CHAT_TYPES = {"group", "supergroup"}
 _MODERATOR_PATTERN = re.compile(r"\bмодер(?:атор)?\b", re.IGNORECASE)
 _HASHTAG_MEME_PATTERN = re.compile(r"#(?:meme|мем)\b", re.IGNORECASE)
 _EM_PATTERN = re.compile(r"э+м+", re.IGNORECASE)
-_REPLY_SEEN_TTL_SECONDS = 15.0
 _MEM_HISTORY_WINDOW_SECONDS = 30 * 24 * 60 * 60
 _seen_reply_messages: dict[tuple[str, int, int], float] = {}
 _yeuoia_reply_state: dict[tuple[int, int], tuple[int, int, float]] = {}
 _otn_paroshka_state: dict[int, tuple[int, int, float]] = {}
 _ai_reply_cooldowns: dict[int, float] = {}
+_CUSTOM_TRIGGERS_LIST_LIMIT = 50
+_MEDIA_SHED_TEXT = "ща завал, мемы чуть позже кидаю"
 _MEM_WAIT_RESPONSES = (
     "болд болд родной ка бр миныт",
     "зяныыыым каз жберем",
@@ -98,11 +137,9 @@ _YEUOIA_USERNAME = "yeuoia"
 _ODEYALOW_USERNAME = "odeyalow"
 _YEUOIA_REPLY_STATE_TTL_SECONDS = 24 * 60 * 60
 _OTN_PAROSHKA_STATE_TTL_SECONDS = 24 * 60 * 60
-_AI_REPLY_COOLDOWN_SECONDS = 5
-_AI_FAST_REPLY_TIMEOUT_SECONDS = _safe_int_env("AI_FAST_REPLY_TIMEOUT_SECONDS", 7, 3, 20)
+_SEARCH_LINE_MAX_CHARS = 120
 _INSTA_USERNAMES = ("aramems", "wasteprod")
 _SAD_INSTA_USERNAME = "famouszayo"
-_INSTA_POSTS_ENDPOINT = "https://inflact.com/downloader/api/viewer/posts/"
 _INSTA_TOKEN_BLOCKS: tuple[tuple[int, ...], ...] = (
     (57, 100, 48, 54, 51, 60, 48, 102),
     (98, 53, 59, 55, 51, 100, 103, 100),
@@ -114,6 +151,30 @@ _INSTA_TOKEN_BLOCKS: tuple[tuple[int, ...], ...] = (
     (100, 101, 97, 55, 103, 51, 54, 97),
 )
 _INSTA_CLIENT_ID = secrets.token_hex(16)
+# Telegram takes photos up to 10 MB.
+_PHOTO_MAX_BYTES = 9_500_000
+_PHOTO_CHUNK_BYTES = 64 * 1024
+# A CDN trickling bytes just fast enough to dodge sock_read would otherwise
+# hold the upload open forever: even the biggest photo must arrive at this
+# rate, which caps a download at about 40 seconds.
+_PHOTO_MIN_BYTES_PER_SECOND = 256 * 1024
+_PHOTO_CONNECT_SECONDS = 5
+_PHOTO_DEADLINE_SECONDS = _PHOTO_CONNECT_SECONDS + _PHOTO_MAX_BYTES / _PHOTO_MIN_BYTES_PER_SECOND
+# Scraper upstreams: a dead or rate-limiting one is skipped in milliseconds
+# instead of costing every meme request a full timeout.
+_UPSTREAM_BREAKER_FAILURES = 3
+_UPSTREAM_BREAKER_RESET_SECONDS = 30.0
+_UPSTREAM_NEGATIVE_TTL_SECONDS = 60.0
+_INFLACT_ATTEMPTS = 2
+_TIKWM_ATTEMPTS = 2
+_upstream_breakers = {
+    upstream: CircuitBreaker(
+        failure_threshold=_UPSTREAM_BREAKER_FAILURES,
+        reset_timeout=_UPSTREAM_BREAKER_RESET_SECONDS,
+    )
+    for upstream in ("inflact", "tikwm")
+}
+_upstream_misses = NegativeCache(ttl=_UPSTREAM_NEGATIVE_TTL_SECONDS)
 _GIFS_DIR = Path(__file__).resolve().parents[1] / "gifs"
 _PAROSHKA_MEDIA_PATH = next(
     (
@@ -220,6 +281,14 @@ _SAD_RESPONSES = (
 )
 
 
+def _get_insta_posts_endpoint() -> str:
+    return get_runtime_config().inflact_posts_url
+
+
+def _get_tikwm_search_endpoint() -> str:
+    return get_runtime_config().tikwm_search_url
+
+
 def _enabled_text(value: bool) -> str:
     return "вкл" if value else "выкл"
 
@@ -342,19 +411,43 @@ def _normalize_username(value: str) -> str:
 def _should_reply_with_ai(chat_id: int) -> bool:
     now = monotonic()
     last = _ai_reply_cooldowns.get(chat_id, 0.0)
-    if now - last < _AI_REPLY_COOLDOWN_SECONDS:
+    if now - last < get_runtime_config().ai_reply_cooldown_seconds:
         return False
     _ai_reply_cooldowns[chat_id] = now
     return True
 
 
-async def _typing_status_worker(bot: Bot, chat_id: int) -> None:
-    while True:
-        try:
-            await bot.send_chat_action(chat_id, ChatAction.TYPING)
-        except TelegramAPIError:
-            return
-        await asyncio.sleep(2.0)
+async def _is_rate_limited(message: Message, kind: str, resumed: bool) -> bool:
+    # Charged right before the bot answers, so a message it would have
+    # ignored anyway never costs a token. A resumed update already paid.
+    if resumed or message.from_user is None:
+        return False
+    hit = acquire_trigger(message.chat.id, message.from_user.id, kind)
+    if hit is None:
+        return False
+    set_handler_kind("rate_limited")
+    if hit.first:
+        await message.reply(f"тормозни родной, {ceil(hit.retry_after)} сек кут")
+    return True
+
+
+def _merge_history(relevant: list[dict[str, str]], recent: list[dict[str, str]]) -> list[dict[str, str]]:
+    # Recent lines go last so the prompt builder keeps them first when the
+    # token budget runs out.
+    recent_keys = {(item.get("sent_at"), item.get("text")) for item in recent}
+    merged = [item for item in relevant if (item.get("sent_at"), item.get("text")) not in recent_keys]
+    return [*merged, *recent]
+
+
+async def _local_ai_reply(chat_id: int, prompt: str) -> str:
+    return await generate_local_reply(chat_id, prompt) or get_fast_fallback_text()
+
+
+def _trim_search_line(text: str) -> str:
+    cleaned = " ".join(text.split())
+    if len(cleaned) <= _SEARCH_LINE_MAX_CHARS:
+        return cleaned
+    return cleaned[: _SEARCH_LINE_MAX_CHARS - 1].rstrip() + "…"
 
 
 def _is_yeuoia_user(message: Message) -> bool:
@@ -493,51 +586,145 @@ def _guess_image_filename(url: str, content_type: str) -> str:
     return f"meme_photo{ext}"
 
 
-async def _download_photo_bytes(url: str, source_username: str = _INSTA_USERNAMES[0]) -> tuple[bytes, str] | None:
-    timeout = aiohttp.ClientTimeout(total=20)
+class _StreamedPhoto(InputFile):
+    # Pipes the CDN response straight into the Telegram upload, so a photo
+    # is never held in memory as a whole.
+    def __init__(self, response: aiohttp.ClientResponse, filename: str, started: float) -> None:
+        super().__init__(filename=filename, chunk_size=_PHOTO_CHUNK_BYTES)
+        self._response = response
+        self._started = started
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        received = 0
+        try:
+            async for chunk in self._response.content.iter_chunked(self.chunk_size):
+                received += len(chunk)
+                # Content-Length was checked up front; this catches chunked
+                # or lying responses as soon as they cross the cap.
+                if received > _PHOTO_MAX_BYTES:
+                    raise aiohttp.ClientPayloadError(f"Photo is larger than {_PHOTO_MAX_BYTES} bytes")
+                yield chunk
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            observe_upstream("instagram_cdn", perf_counter() - self._started, False)
+            raise
+        observe_upstream("instagram_cdn", perf_counter() - self._started, True)
+
+
+@asynccontextmanager
+async def _open_photo_stream(
+    url: str,
+    source_username: str = _INSTA_USERNAMES[0],
+) -> AsyncIterator[_StreamedPhoto | None]:
+    # Yields None when the photo is unusable before a single byte is sent,
+    # so the caller can still hand Telegram the bare URL.
+    timeout = aiohttp.ClientTimeout(
+        total=_PHOTO_DEADLINE_SECONDS,
+        connect=_PHOTO_CONNECT_SECONDS,
+        sock_read=20,
+    )
     headers = {
         "User-Agent": "Mozilla/5.0",
         "Referer": _insta_referer_url(source_username),
     }
-    try:
-        async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
-            async with session.get(url, allow_redirects=True) as response:
-                if response.status != 200:
-                    return None
-                content_type = str(response.headers.get("Content-Type") or "").split(";", 1)[0].strip()
-                if content_type and not content_type.lower().startswith("image/"):
-                    return None
-                payload = await response.read()
-    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
-        return None
+    started = perf_counter()
+    async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
+        try:
+            response = await session.get(url, allow_redirects=True)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            observe_upstream("instagram_cdn", perf_counter() - started, False)
+            yield None
+            return
+
+        async with response:
+            content_type = str(response.headers.get("Content-Type") or "").split(";", 1)[0].strip()
+            usable = (
+                response.status == 200
+                and (not content_type or content_type.lower().startswith("image/"))
+                and response.content_length != 0
+                and (response.content_length or 0) <= _PHOTO_MAX_BYTES
+            )
+            if not usable:
+                observe_upstream("instagram_cdn", perf_counter() - started, False)
+                yield None
+                return
+            yield _StreamedPhoto(response, _guess_image_filename(url, content_type), started)
 
-    if not payload:
-        return None
-    if len(payload) > 9_500_000:
-        return None
 
-    filename = _guess_image_filename(url, content_type)
-    return payload, filename
+def _is_upstream_skipped(upstream: str, key: tuple[str, str]) -> bool:
+    if _upstream_misses.contains(key):
+        count_upstream_skip(upstream, "negative_cache")
+        return True
+    if not _upstream_breakers[upstream].allow_request():
+        count_upstream_skip(upstream, "breaker_open")
+        return True
+    return False
 
 
-async def _fetch_instagram_timeline_edges(username: str) -> list[dict]:
-    timeout = aiohttp.ClientTimeout(total=20)
+def _record_upstream_result(upstream: str, key: tuple[str, str], ok: bool) -> None:
+    if ok:
+        _upstream_breakers[upstream].record_success()
+        _upstream_misses.forget(key)
+    else:
+        _upstream_breakers[upstream].record_failure()
+        _upstream_misses.remember(key)
+
+
+def _describe_upstreams() -> str:
+    labels = {BREAKER_CLOSED: "ок", BREAKER_OPEN: "пауза"}
+    return ", ".join(
+        f"{upstream} {labels.get(breaker.state, 'проверка')}" for upstream, breaker in _upstream_breakers.items()
+    )
+
+
+async def _request_inflact_timeline(username: str) -> dict | None:
+    timeout = aiohttp.ClientTimeout(total=10, connect=3)
     headers = {
         "User-Agent": "Mozilla/5.0",
         **_build_insta_auth_headers(username),
     }
-    form = aiohttp.FormData()
-    form.add_field("url", username)
-    form.add_field("cursor", "")
+    async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
+        for attempt in range(_INFLACT_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt - 1, base=1.0, cap=4.0))
+            form = aiohttp.FormData()
+            form.add_field("url", username)
+            form.add_field("cursor", "")
+            started = perf_counter()
+            try:
+                async with session.post(_get_insta_posts_endpoint(), data=form) as response:
+                    retryable = response.status == 429 or response.status >= 500
+                    data = None if retryable else await response.json(content_type=None)
+            except asyncio.TimeoutError:
+                # A hanging upstream would only hang again; do not retry.
+                observe_upstream("inflact", perf_counter() - started, False)
+                return None
+            except aiohttp.ClientError:
+                observe_upstream("inflact", perf_counter() - started, False)
+                continue
+            except ValueError:
+                observe_upstream("inflact", perf_counter() - started, False)
+                return None
 
-    try:
-        async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
-            async with session.post(_INSTA_POSTS_ENDPOINT, data=form) as response:
-                data = await response.json(content_type=None)
-    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
-        return []
+            succeeded = isinstance(data, dict) and data.get("status") == "success"
+            observe_upstream("inflact", perf_counter() - started, succeeded)
+            if succeeded:
+                return data
+            if not retryable:
+                return None
+    return None
 
-    if not isinstance(data, dict) or data.get("status") != "success":
+
+async def _fetch_instagram_timeline_edges(username: str) -> list[dict]:
+    key = ("inflact", username)
+    if _is_upstream_skipped("inflact", key):
+        return []
+    try:
+        data = await _request_inflact_timeline(username)
+    except asyncio.CancelledError:
+        _upstream_breakers["inflact"].release_probe()
+        raise
+    _record_upstream_result("inflact", key, data is not None)
+    if data is None:
         return []
 
     payload = data.get("data") or {}
@@ -721,8 +908,9 @@ def _extract_instagram_post_media_candidates(node: dict, source_username: str) -
 async def _fetch_instagram_photo_candidates() -> list[dict[str, str]]:
     unique_candidates: dict[str, dict[str, str]] = {}
 
-    for username in _INSTA_USERNAMES:
-        for edge in await _fetch_instagram_timeline_edges(username):
+    timelines = await asyncio.gather(*(_fetch_instagram_timeline_edges(username) for username in _INSTA_USERNAMES))
+    for username, edges in zip(_INSTA_USERNAMES, timelines):
+        for edge in edges:
             node = edge.get("node") or {}
             if not isinstance(node, dict):
                 continue
@@ -804,53 +992,80 @@ def _get_tiktok_web_url(item: dict) -> str | None:
     return f"https://www.tiktok.com/video/{video_id}"
 
 
+async def _search_tikwm(session: aiohttp.ClientSession, endpoint: str, keyword: str) -> dict | None:
+    for attempt in range(_TIKWM_ATTEMPTS):
+        if attempt:
+            # The free API allows about one request a second.
+            await asyncio.sleep(backoff_delay(attempt - 1, base=2.0, cap=4.0))
+        started = perf_counter()
+        try:
+            async with session.get(endpoint, params={"keywords": keyword, "count": 40}) as response:
+                retryable = response.status == 429 or response.status >= 500
+                data = None if retryable else await response.json(content_type=None)
+        except asyncio.TimeoutError:
+            observe_upstream("tikwm", perf_counter() - started, False)
+            return None
+        except aiohttp.ClientError:
+            observe_upstream("tikwm", perf_counter() - started, False)
+            continue
+        except ValueError:
+            observe_upstream("tikwm", perf_counter() - started, False)
+            return None
+
+        succeeded = isinstance(data, dict) and data.get("code") == 0
+        observe_upstream("tikwm", perf_counter() - started, succeeded)
+        if succeeded:
+            return data
+        rate_limited = isinstance(data, dict) and data.get("code") == -1
+        if not retryable and not rate_limited:
+            return None
+    return None
+
+
 async def _fetch_popular_meme_candidates() -> list[dict]:
     keywords = ("meme", "мем")
-    endpoint = "https://www.tikwm.com/api/feed/search"
-    timeout = aiohttp.ClientTimeout(total=15)
+    endpoint = _get_tikwm_search_endpoint()
+    timeout = aiohttp.ClientTimeout(total=8, connect=3)
     headers = {"User-Agent": "Mozilla/5.0"}
 
     aggregated: dict[str, dict] = {}
     async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
         for keyword in keywords:
-            for attempt in range(2):
-                try:
-                    async with session.get(endpoint, params={"keywords": keyword, "count": 40}) as response:
-                        data = await response.json(content_type=None)
-                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
-                    break
-
-                if not isinstance(data, dict):
-                    break
-
-                if data.get("code") == -1 and attempt == 0:
-                    await asyncio.sleep(1.1)
-                    continue
+            key = ("tikwm", keyword)
+            if _is_upstream_skipped("tikwm", key):
+                continue
+            try:
+                data = await _search_tikwm(session, endpoint, keyword)
+            except asyncio.CancelledError:
+                _upstream_breakers["tikwm"].release_probe()
+                raise
+            _record_upstream_result("tikwm", key, data is not None)
+            if data is None:
+                continue
 
-                videos = _extract_tikwm_videos(data.get("data"))
-                for item in videos:
-                    if not _is_meme_video(item):
-                        continue
+            videos = _extract_tikwm_videos(data.get("data"))
+            for item in videos:
+                if not _is_meme_video(item):
+                    continue
 
-                    video_id = str(item.get("video_id") or "").strip()
-                    if not video_id:
-                        continue
+                video_id = str(item.get("video_id") or "").strip()
+                if not video_id:
+                    continue
 
-                    play_url = str(item.get("play") or item.get("wmplay") or "").strip()
-                    web_url = _get_tiktok_web_url(item)
-                    if not play_url and not web_url:
-                        continue
+                play_url = str(item.get("play") or item.get("wmplay") or "").strip()
+                web_url = _get_tiktok_web_url(item)
+                if not play_url and not web_url:
+                    continue
 
-                    play_count = _to_int(item.get("play_count"))
-                    existing = aggregated.get(video_id)
-                    if existing is None or play_count > _to_int(existing.get("play_count")):
-                        aggregated[video_id] = {
-                            "video_id": video_id,
-                            "play_url": play_url,
-                            "web_url": web_url,
-                            "play_count": play_count,
-                        }
-                break
+                play_count = _to_int(item.get("play_count"))
+                existing = aggregated.get(video_id)
+                if existing is None or play_count > _to_int(existing.get("play_count")):
+                    aggregated[video_id] = {
+                        "video_id": video_id,
+                        "play_url": play_url,
+                        "web_url": web_url,
+                        "play_count": play_count,
+                    }
 
     candidates = list(aggregated.values())
     candidates.sort(key=lambda x: _to_int(x.get("play_count")), reverse=True)
@@ -860,7 +1075,7 @@ async def _fetch_popular_meme_candidates() -> list[dict]:
 def _is_duplicate_reply(kind: str, chat_id: int, message_id: int) -> bool:
     now = monotonic()
     for key, seen_at in tuple(_seen_reply_messages.items()):
-        if now - seen_at > _REPLY_SEEN_TTL_SECONDS:
+        if now - seen_at > get_runtime_config().reply_seen_ttl_seconds:
             _seen_reply_messages.pop(key, None)
 
     key = (kind, chat_id, message_id)
@@ -871,6 +1086,41 @@ def _is_duplicate_reply(kind: str, chat_id: int, message_id: int) -> bool:
     return False
 
 
+def _dump_handler_state() -> dict[str, list]:
+    # Monotonic stamps do not survive a restart, so they travel as wall time.
+    return {
+        "ai_reply_cooldowns": [
+            [chat_id, monotonic_to_wall(seen_at)] for chat_id, seen_at in _ai_reply_cooldowns.items()
+        ],
+        "yeuoia_reply_state": [
+            [chat_id, user_id, count, target, monotonic_to_wall(seen_at)]
+            for (chat_id, user_id), (count, target, seen_at) in _yeuoia_reply_state.items()
+        ],
+        "otn_paroshka_state": [
+            [chat_id, count, target, monotonic_to_wall(seen_at)]
+            for chat_id, (count, target, seen_at) in _otn_paroshka_state.items()
+        ],
+        "seen_reply_messages": [
+            [kind, chat_id, message_id, monotonic_to_wall(seen_at)]
+            for (kind, chat_id, message_id), seen_at in _seen_reply_messages.items()
+        ],
+    }
+
+
+def _restore_handler_state(value: dict[str, list]) -> None:
+    for chat_id, seen_at in value.get("ai_reply_cooldowns") or []:
+        _ai_reply_cooldowns[int(chat_id)] = wall_to_monotonic(float(seen_at))
+    for chat_id, user_id, count, target, seen_at in value.get("yeuoia_reply_state") or []:
+        _yeuoia_reply_state[(int(chat_id), int(user_id))] = (int(count), int(target), wall_to_monotonic(float(seen_at)))
+    for chat_id, count, target, seen_at in value.get("otn_paroshka_state") or []:
+        _otn_paroshka_state[int(chat_id)] = (int(count), int(target), wall_to_monotonic(float(seen_at)))
+    for kind, chat_id, message_id, seen_at in value.get("seen_reply_messages") or []:
+        _seen_reply_messages[(str(kind), int(chat_id), int(message_id))] = wall_to_monotonic(float(seen_at))
+
+
+register_state("group_features", _dump_handler_state, _restore_handler_state)
+
+
 async def _require_admin(message: Message, bot: Bot) -> bool:
     if not message.from_user:
         await message.answer("Чота бул адам жок или мен туснбедм")
@@ -1012,6 +1262,7 @@ async def ai_style(message: Message, command: CommandObject, bot: Bot) -> None:
 
     ensure_ai_group_settings(message.chat.id)
     set_ai_style_username(message.chat.id, username)
+    track_style_username(message.chat.id, username)
     await message.answer(f"ИИ стилы енды @{username} болд.")
 
 
@@ -1026,11 +1277,166 @@ async def ai_status(message: Message, bot: Bot) -> None:
     await message.answer(
         f"ИИ статус: {state}\n"
         f"Стиль: @{ai_settings.ai_style_username}\n"
-        f"Модель: {get_ollama_model()}\n"
-        f"Ollama: {get_ollama_base_url()}"
+        f"Модель: {get_ollama_model()} ({get_model_state()})\n"
+        f"Ollama: {describe_backends()}\n"
+        f"Генерация: {describe_generation_state(get_runtime_config().ai_fast_reply_timeout_seconds)}\n"
+        f"Нагрузка: {describe_load_shedding()}\n"
+        f"Мемы: {_describe_upstreams()}"
+    )
+
+
+@router.message(F.chat.type.in_(_GROUP_CHAT_TYPES), Command("limits"))
+async def show_limits(message: Message, bot: Bot) -> None:
+    ensure_group(message.chat.id, message.chat.title or "")
+    if not await _require_admin(message, bot):
+        return
+
+    lines = describe_rate_limits(message.chat.id)
+    await message.answer(
+        "Лимиты триггеров (* - настроено в этой группе):\n" + "\n".join(lines or ["лимитов нет"])
     )
 
 
+@router.message(F.chat.type.in_(_GROUP_CHAT_TYPES), Command("set_limit"))
+async def set_limit(message: Message, command: CommandObject, bot: Bot) -> None:
+    ensure_group(message.chat.id, message.chat.title or "")
+    if not await _require_admin(message, bot):
+        return
+
+    parts = (command.args or "").split()
+    if len(parts) != 3 or parts[0] not in TRIGGER_KINDS or parts[1] not in RATE_LIMIT_SCOPES:
+        await message.answer(
+            "Колдану: /set_limit <триггер> <chat|user> <сколько/секунд|off|default>\n"
+            "Например: /set_limit mem_request user 2/60\n"
+            f"Триггеры: {', '.join(TRIGGER_KINDS)}"
+        )
+        return
+
+    kind, scope, value = parts
+    if value == "default":
+        reset_chat_rate_limit(message.chat.id, kind, scope)
+        await message.answer(f"Лимит {kind} {scope} снова по умолчанию.")
+        return
+    if value == "off":
+        set_chat_rate_limit(message.chat.id, kind, scope, 0, 0.0)
+        await message.answer(f"Лимит {kind} {scope} убрал.")
+        return
+
+    capacity_raw, _, period_raw = value.partition("/")
+    try:
+        capacity = int(capacity_raw)
+        per_seconds = float(period_raw)
+    except ValueError:
+        await message.answer("Лимит пиши так: 2/60 - два раза за 60 секунд.")
+        return
+    if not 1 <= capacity <= MAX_RATE_LIMIT_CAPACITY or not 1 <= per_seconds <= MAX_RATE_LIMIT_PERIOD_SECONDS:
+        await message.answer(
+            f"Раз от 1 до {MAX_RATE_LIMIT_CAPACITY}, секунд от 1 до {MAX_RATE_LIMIT_PERIOD_SECONDS:g}."
+        )
+        return
+
+    set_chat_rate_limit(message.chat.id, kind, scope, capacity, per_seconds)
+    await message.answer(f"Лимит {kind} {scope}: {capacity} раз за {per_seconds:g} сек.")
+
+
+@router.message(F.chat.type.in_(_GROUP_CHAT_TYPES), Command("trigger_add"))
+async def trigger_add(message: Message, command: CommandObject, bot: Bot) -> None:
+    ensure_group(message.chat.id, message.chat.title or "")
+    if not await _require_admin(message, bot):
+        return
+
+    match_type, _, rest = (command.args or "").strip().partition(" ")
+    raw_pattern, separator, raw_reply = rest.partition("=>")
+    reply = raw_reply.strip()
+    if match_type not in CUSTOM_TRIGGER_TYPES or not separator or not raw_pattern.strip() or not reply:
+        await message.answer(
+            "Колдану: /trigger_add <exact|prefix|regex> <текст> => <ответ>\n"
+            "exact - сообщение целиком, prefix - начинается с текста, regex - регулярка\n"
+            "Например: /trigger_add prefix салам => салем родной"
+        )
+        return
+
+    pattern = raw_pattern.strip() if match_type == "regex" else _normalize_text(raw_pattern)
+    if not pattern or len(pattern) > MAX_CUSTOM_PATTERN_LENGTH:
+        await message.answer(f"Текст триггера нужен от 1 до {MAX_CUSTOM_PATTERN_LENGTH} символов.")
+        return
+    if len(reply) > MAX_CUSTOM_REPLY_LENGTH:
+        await message.answer(f"Ответ длинноват, максимум {MAX_CUSTOM_REPLY_LENGTH} символов.")
+        return
+    if match_type == "regex" and (problem := check_regex_pattern(pattern)):
+        await message.answer(f"Не добавил: {problem}")
+        return
+    if match_type == "regex" and is_full_scan_limit_reached(message.chat.id, pattern):
+        await message.answer("Не добавил: в регулярке нужен кусок обычного текста хотя бы из 2 букв.")
+        return
+    if not has_room_for_custom_trigger(message.chat.id):
+        await message.answer("Триггеров уже слишком много, удали лишние через /trigger_del.")
+        return
+
+    trigger_id = save_custom_trigger(message.chat.id, match_type, pattern, reply, message.from_user.id)
+    await message.answer(f"Триггер #{trigger_id} добавил.")
+
+
+@router.message(F.chat.type.in_(_GROUP_CHAT_TYPES), Command("triggers"))
+async def triggers_list(message: Message, bot: Bot) -> None:
+    ensure_group(message.chat.id, message.chat.title or "")
+    if not await _require_admin(message, bot):
+        return
+
+    triggers = get_custom_triggers(message.chat.id)
+    if not triggers:
+        await message.answer("Своих триггеров нет. Добавить: /trigger_add")
+        return
+
+    lines = [
+        f"#{item.id} {item.match_type} «{_trim_search_line(item.pattern)}» → {_trim_search_line(item.reply)}"
+        for item in triggers[:_CUSTOM_TRIGGERS_LIST_LIMIT]
+    ]
+    if len(triggers) > _CUSTOM_TRIGGERS_LIST_LIMIT:
+        lines.append(f"…и еще {len(triggers) - _CUSTOM_TRIGGERS_LIST_LIMIT}")
+    await message.answer("\n".join(lines))
+
+
+@router.message(F.chat.type.in_(_GROUP_CHAT_TYPES), Command("trigger_del"))
+async def trigger_del(message: Message, command: CommandObject, bot: Bot) -> None:
+    ensure_group(message.chat.id, message.chat.title or "")
+    if not await _require_admin(message, bot):
+        return
+
+    raw = (command.args or "").strip().lstrip("#")
+    if not raw.isdigit():
+        await message.answer("Колдану: /trigger_del <номер из /triggers>")
+        return
+
+    if remove_custom_trigger(message.chat.id, int(raw)):
+        await message.answer(f"Триггер #{raw} удалил.")
+    else:
+        await message.answer(f"Триггера #{raw} тут нет.")
+
+
+@router.message(F.chat.type.in_(_GROUP_CHAT_TYPES), Command("search"))
+async def search_messages(message: Message, command: CommandObject, bot: Bot) -> None:
+    ensure_group(message.chat.id, message.chat.title or "")
+    if not await _require_admin(message, bot):
+        return
+
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Колдану: /search слова")
+        return
+
+    found = search_chat_messages(message.chat.id, query, limit=get_runtime_config().search_results_limit)
+    if not found:
+        await message.answer("Ничего не нашел.")
+        return
+
+    lines = [
+        f"{datetime.fromtimestamp(item.sent_at):%d.%m %H:%M} @{item.username}: {_trim_search_line(item.text)}"
+        for item in found
+    ]
+    await message.answer("\n".join(lines))
+
+
 @router.my_chat_member(F.chat.type.in_(_GROUP_CHAT_TYPES))
 async def on_bot_added(event: ChatMemberUpdated, bot: Bot) -> None:
     old_status = event.old_chat_member.status
@@ -1043,7 +1449,7 @@ async def on_bot_added(event: ChatMemberUpdated, bot: Bot) -> None:
 
 
 @router.message(F.chat.type.in_(_GROUP_CHAT_TYPES), F.text, ~F.text.startswith("/"))
-async def on_group_text(message: Message, bot: Bot) -> None:
+async def on_group_text(message: Message, bot: Bot, resumed: bool = False) -> None:
     if not message.from_user or message.from_user.is_bot:
         return
 
@@ -1053,7 +1459,13 @@ async def on_group_text(message: Message, bot: Bot) -> None:
         or message.from_user.full_name
         or f"user_{message.from_user.id}"
     )
-    add_ai_message(message.chat.id, message.from_user.id, author_username, text)
+    ingest_ai_message(message.chat.id, message.from_user.id, author_username, text)
+    shed_level = get_load_shed_level()
+    if shed_level >= SHED_INGEST_ONLY:
+        # Deep backlog: only record history until the bot catches up.
+        set_handler_kind("shed")
+        shed_actions.inc("ingest_only")
+        return
 
     normalized_text = _normalize_text(text)
     is_mem_photo_request = _is_mem_photo_request(normalized_text)
@@ -1099,7 +1511,15 @@ async def on_group_text(message: Message, bot: Bot) -> None:
         or is_moderator_word
     )
 
+    # Admin-defined replies only get messages no built-in trigger claimed.
+    custom_trigger = None
     if not has_regular_trigger and not is_yeuoia_reply_to_odeyalow:
+        custom_trigger = match_custom_trigger(message.chat.id, normalized_text, text)
+        if custom_trigger is None:
+            set_handler_kind("chatter")
+            return
+    if is_stale_message(message):
+        set_handler_kind("stale")
         return
 
     if is_mem_photo_request:
@@ -1124,12 +1544,17 @@ async def on_group_text(message: Message, bot: Bot) -> None:
         kind = "anon_link_text"
     elif is_aldik_name_trigger:
         kind = "aldik_name"
+    elif custom_trigger is not None:
+        kind = "custom_trigger"
     elif is_yeuoia_reply_to_odeyalow:
         kind = "yeuoia_user"
     else:
         kind = "moderator_word"
 
-    if _is_duplicate_reply(kind, message.chat.id, message.message_id):
+    set_handler_kind(kind)
+    # A resumed update was cut off by a shutdown before replying, so its own
+    # dedup mark and AI cooldown must not block it now.
+    if _is_duplicate_reply(kind, message.chat.id, message.message_id) and not resumed:
         return
 
     settings = ensure_group(message.chat.id, message.chat.title or "")
@@ -1140,42 +1565,51 @@ async def on_group_text(message: Message, bot: Bot) -> None:
     if is_ai_trigger:
         if not ai_settings.ai_enabled:
             return
-        if not _should_reply_with_ai(message.chat.id):
+        if not _should_reply_with_ai(message.chat.id) and not resumed:
+            return
+        if await _is_rate_limited(message, kind, resumed):
             return
 
+        # One snapshot for the whole reply, so a reload mid-way cannot mix
+        # old and new limits.
+        config = get_runtime_config()
         prompt = _extract_ai_user_prompt(message, normalized_text)
-        if not prompt:
-            prompt = "че думаешь по теме?"
+        is_low_effort = len(prompt.split()) <= config.ai_low_effort_max_words
+        if shed_level >= SHED_AI:
+            shed_actions.inc("ai")
+        if (
+            is_low_effort
+            or shed_level >= SHED_AI
+            or not is_model_ready()
+            or not is_generation_available()
+        ):
+            # Short pokes, load shedding and an unavailable model are served by
+            # the local tier without touching Ollama.
+            await message.reply(await _local_ai_reply(message.chat.id, prompt))
+            return
 
         history = get_recent_ai_messages(message.chat.id, limit=4)
-        style_examples = get_recent_ai_messages_by_username(
-            message.chat.id,
-            ai_settings.ai_style_username,
-            limit=3,
-        )
-        typing_task = asyncio.create_task(_typing_status_worker(bot, message.chat.id))
-        try:
-            try:
-                reply_text = await asyncio.wait_for(
-                    generate_style_reply(
-                        user_message=prompt,
-                        style_username=ai_settings.ai_style_username,
-                        history=history,
-                        style_examples=style_examples,
-                    ),
-                    timeout=_AI_FAST_REPLY_TIMEOUT_SECONDS,
-                )
-            except asyncio.TimeoutError:
-                reply_text = get_fast_fallback_text()
-        finally:
-            typing_task.cancel()
-            with suppress(asyncio.CancelledError):
-                await typing_task
-
-        if reply_text:
-            await message.reply(reply_text)
-        else:
-            await message.reply(get_fast_fallback_text())
+        style = get_style_snapshot(message.chat.id, ai_settings.ai_style_username)
+        keyword_examples = find_keyword_style_examples(message.chat.id, prompt, ai_settings.ai_style_username)
+        style_examples = list(dict.fromkeys([*keyword_examples, *style.examples]))
+        async with chat_action(bot, message.chat.id, ChatAction.TYPING):
+            retrieved = await retrieve_context(message.chat.id, prompt, ai_settings.ai_style_username)
+            if retrieved is not None:
+                history = _merge_history(retrieved.history, history[-2:])
+                style_examples = list(dict.fromkeys([*retrieved.style_examples, *style_examples]))
+
+            reply_text = await generate_style_reply_within_deadline(
+                max_seconds=config.ai_fast_reply_timeout_seconds,
+                user_message=prompt,
+                style_username=ai_settings.ai_style_username,
+                history=history,
+                style_examples=style_examples,
+                style_words=list(style.top_words),
+                chat_id=message.chat.id,
+                summary=get_chat_summary(message.chat.id),
+            )
+
+        await message.reply(reply_text or await _local_ai_reply(message.chat.id, prompt))
         return
 
     should_reply_to_yeuoia = False
@@ -1186,160 +1620,177 @@ async def on_group_text(message: Message, bot: Bot) -> None:
         )
 
     if should_reply_to_yeuoia:
+        if await _is_rate_limited(message, kind, resumed):
+            return
         await message.reply(choice(_YEUOIA_RESPONSES))
         return
 
+    if custom_trigger is not None:
+        if await _is_rate_limited(message, kind, resumed):
+            return
+        await message.reply(custom_trigger.reply)
+        return
+
     if not has_regular_trigger:
         return
 
+    if shed_level >= SHED_MEDIA and (is_mem_photo_request or is_mem_request or is_sad_trigger):
+        if await _is_rate_limited(message, kind, resumed):
+            return
+        shed_actions.inc("media")
+        if is_sad_trigger and normalized_text in _SAD_TRIGGERS_EXACT:
+            await message.reply(choice(_SAD_RESPONSES))
+        else:
+            await message.reply(_MEDIA_SHED_TEXT)
+        return
+
     if is_mem_photo_request:
+        if await _is_rate_limited(message, kind, resumed):
+            return
         try:
             await message.reply(choice(_MEM_WAIT_RESPONSES))
 
-            since_ts = int(time()) - _MEM_HISTORY_WINDOW_SECONDS
-            recent_ids = get_recent_meme_video_ids(message.chat.id, since_ts)
-            candidates = await _fetch_instagram_photo_candidates()
-            fresh_candidates = [item for item in candidates if str(item.get("photo_id")) not in recent_ids]
+            async with chat_action(bot, message.chat.id, ChatAction.UPLOAD_PHOTO):
+                since_ts = int(time()) - _MEM_HISTORY_WINDOW_SECONDS
+                recent_ids = get_recent_meme_video_ids(message.chat.id, since_ts)
+                candidates = await _fetch_instagram_photo_candidates()
+                fresh_candidates = [item for item in candidates if str(item.get("photo_id")) not in recent_ids]
 
-            if not fresh_candidates:
-                await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
-                return
+                if not fresh_candidates:
+                    await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
+                    return
 
-            pool = fresh_candidates[:]
-            while pool:
-                selected = choice(pool)
-                pool.remove(selected)
+                pool = fresh_candidates[:]
+                while pool:
+                    selected = choice(pool)
+                    pool.remove(selected)
 
-                photo_id = str(selected.get("photo_id") or "").strip()
-                photo_url = str(selected.get("photo_url") or "").strip()
-                source_username = str(selected.get("source_username") or "").strip()
-                if not photo_id or not photo_url:
-                    continue
-                if not source_username:
-                    source_username = _INSTA_USERNAMES[0]
-
-                try:
-                    downloaded = await _download_photo_bytes(photo_url, source_username)
-                    if downloaded is not None:
-                        photo_bytes, filename = downloaded
-                        await message.answer_photo(BufferedInputFile(photo_bytes, filename=filename))
-                    else:
-                        await message.answer_photo(photo_url)
-                    add_meme_history(message.chat.id, photo_id)
-                    return
-                except TelegramAPIError:
-                    pass
+                    photo_id = str(selected.get("photo_id") or "").strip()
+                    photo_url = str(selected.get("photo_url") or "").strip()
+                    source_username = str(selected.get("source_username") or "").strip()
+                    if not photo_id or not photo_url:
+                        continue
+                    if not source_username:
+                        source_username = _INSTA_USERNAMES[0]
 
-            await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
-            return
+                    try:
+                        async with _open_photo_stream(photo_url, source_username) as photo:
+                            await message.answer_photo(photo or photo_url)
+                        add_meme_history(message.chat.id, photo_id)
+                        return
+                    except TelegramAPIError:
+                        pass
+
+                await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
+                return
         except Exception:
             logger.exception("Unexpected error while handling meme photo request")
             await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
             return
 
     if is_mem_request:
+        if await _is_rate_limited(message, kind, resumed):
+            return
         try:
             await message.reply(choice(_MEM_WAIT_RESPONSES))
 
-            since_ts = int(time()) - _MEM_HISTORY_WINDOW_SECONDS
-            recent_ids = get_recent_meme_video_ids(message.chat.id, since_ts)
-            candidates = await _fetch_popular_meme_candidates()
-            fresh_candidates = [item for item in candidates if str(item.get("video_id")) not in recent_ids]
+            async with chat_action(bot, message.chat.id, ChatAction.UPLOAD_VIDEO):
+                since_ts = int(time()) - _MEM_HISTORY_WINDOW_SECONDS
+                recent_ids = get_recent_meme_video_ids(message.chat.id, since_ts)
+                candidates = await _fetch_popular_meme_candidates()
+                fresh_candidates = [item for item in candidates if str(item.get("video_id")) not in recent_ids]
 
-            if not fresh_candidates:
-                await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
-                return
+                if not fresh_candidates:
+                    await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
+                    return
 
-            top_fresh = fresh_candidates[: min(20, len(fresh_candidates))]
-            while top_fresh:
-                selected = choice(top_fresh)
-                top_fresh.remove(selected)
+                top_fresh = fresh_candidates[: min(20, len(fresh_candidates))]
+                while top_fresh:
+                    selected = choice(top_fresh)
+                    top_fresh.remove(selected)
 
-                video_id = str(selected.get("video_id") or "").strip()
-                play_url = str(selected.get("play_url") or "").strip()
-                web_url = str(selected.get("web_url") or "").strip()
+                    video_id = str(selected.get("video_id") or "").strip()
+                    play_url = str(selected.get("play_url") or "").strip()
+                    web_url = str(selected.get("web_url") or "").strip()
 
-                if play_url:
-                    try:
-                        await message.answer_video(play_url)
-                        add_meme_history(message.chat.id, video_id)
-                        return
-                    except TelegramAPIError:
-                        pass
+                    if play_url:
+                        try:
+                            await message.answer_video(play_url)
+                            add_meme_history(message.chat.id, video_id)
+                            return
+                        except TelegramAPIError:
+                            pass
 
-                if web_url:
-                    try:
-                        await message.answer(web_url)
-                        add_meme_history(message.chat.id, video_id)
-                        return
-                    except TelegramAPIError:
-                        pass
+                    if web_url:
+                        try:
+                            await message.answer(web_url)
+                            add_meme_history(message.chat.id, video_id)
+                            return
+                        except TelegramAPIError:
+                            pass
 
-            await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
-            return
+                await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
+                return
         except Exception:
             logger.exception("Unexpected error while handling meme video request")
             await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
             return
 
     if is_sad_trigger:
+        if await _is_rate_limited(message, kind, resumed):
+            return
         try:
             if normalized_text in _SAD_TRIGGERS_EXACT:
                 await message.reply(choice(_SAD_RESPONSES))
 
-            candidates = await _fetch_instagram_post_candidates(_SAD_INSTA_USERNAME)
-            if not candidates:
-                await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
-                return
-
-            pool = candidates[:]
-            while pool:
-                selected = choice(pool)
-                pool.remove(selected)
+            async with chat_action(bot, message.chat.id, ChatAction.UPLOAD_PHOTO):
+                candidates = await _fetch_instagram_post_candidates(_SAD_INSTA_USERNAME)
+                if not candidates:
+                    await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
+                    return
 
-                media_type = str(selected.get("media_type") or "").strip()
-                media_url = str(selected.get("media_url") or "").strip()
-                post_url = str(selected.get("post_url") or "").strip()
-                source_username = str(selected.get("source_username") or "").strip()
-                if not media_type or not media_url:
-                    continue
+                pool = candidates[:]
+                while pool:
+                    selected = choice(pool)
+                    pool.remove(selected)
 
-                if media_type == "photo":
-                    try:
-                        downloaded = await _download_photo_bytes(
-                            media_url,
-                            source_username or _SAD_INSTA_USERNAME,
-                        )
-                        if downloaded is not None:
-                            photo_bytes, filename = downloaded
-                            await message.answer_photo(BufferedInputFile(photo_bytes, filename=filename))
-                            return
-                        await message.answer_photo(media_url)
-                        return
-                    except TelegramAPIError:
-                        if post_url:
-                            try:
-                                await message.answer(post_url)
-                                return
-                            except TelegramAPIError:
-                                pass
+                    media_type = str(selected.get("media_type") or "").strip()
+                    media_url = str(selected.get("media_url") or "").strip()
+                    post_url = str(selected.get("post_url") or "").strip()
+                    source_username = str(selected.get("source_username") or "").strip()
+                    if not media_type or not media_url:
                         continue
 
-                if media_type == "video":
-                    try:
-                        await message.answer_video(media_url)
-                        return
-                    except TelegramAPIError:
-                        if post_url:
-                            try:
-                                await message.answer(post_url)
-                                return
-                            except TelegramAPIError:
-                                pass
-                        continue
+                    if media_type == "photo":
+                        try:
+                            async with _open_photo_stream(media_url, source_username or _SAD_INSTA_USERNAME) as photo:
+                                await message.answer_photo(photo or media_url)
+                            return
+                        except TelegramAPIError:
+                            if post_url:
+                                try:
+                                    await message.answer(post_url)
+                                    return
+                                except TelegramAPIError:
+                                    pass
+                            continue
+
+                    if media_type == "video":
+                        try:
+                            async with chat_action(bot, message.chat.id, ChatAction.UPLOAD_VIDEO):
+                                await message.answer_video(media_url)
+                            return
+                        except TelegramAPIError:
+                            if post_url:
+                                try:
+                                    await message.answer(post_url)
+                                    return
+                                except TelegramAPIError:
+                                    pass
+                            continue
 
-            await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
-            return
+                await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
+                return
         except Exception:
             logger.exception("Unexpected error while handling sad trigger request")
             await message.reply("Ща не нашел мем, попробуй еще раз через пару секунд.")
@@ -1351,12 +1802,18 @@ async def on_group_text(message: Message, bot: Bot) -> None:
         if _PAROSHKA_MEDIA_PATH is None:
             logger.warning("parochka media file was not found in %s", _GIFS_DIR)
             return
+        if await _is_rate_limited(message, kind, resumed):
+            return
         try:
             await message.reply_animation(FSInputFile(_PAROSHKA_MEDIA_PATH))
         except TelegramAPIError:
             logger.exception("Failed to send paroshka animation")
         return
 
+    # Every trigger below always answers.
+    if await _is_rate_limited(message, kind, resumed):
+        return
+
     if is_em_trigger:
         await message.reply("э" * randint(1, 10) + "м" * randint(1, 10))
         return
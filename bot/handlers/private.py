@@ -7,6 +7,7 @@ from aiogram.types import Message
 from aiogram.utils.deep_linking import decode_payload
 
 from bot.anonymous_state import pop_pending_target, set_pending_target
+from bot.config import RESTART_ONLY_FIELDS, get_runtime_config, reload_runtime_config
 from bot.storage import get_group, get_group_by_anonymous_token
 from bot.texts import ANON_PROMPT_TEXT, PRIVATE_HELP_TEXT, PRIVATE_START_TEXT
 
@@ -62,6 +63,22 @@ async def private_help(message: Message) -> None:
     await message.answer(PRIVATE_HELP_TEXT)
 
 
+@router.message(F.chat.type == "private", Command("reload_config"))
+async def private_reload_config(message: Message) -> None:
+    if not message.from_user or message.from_user.id not in get_runtime_config().bot_admin_ids:
+        return
+
+    changed, problems = reload_runtime_config()
+    lines = [f"Конфиг обновил. Поменялось: {', '.join(changed)}" if changed else "Конфиг перечитал, ничего не поменялось"]
+    restart_only = [name for name in changed if name in RESTART_ONLY_FIELDS]
+    if restart_only:
+        lines.append(f"Это заработает только после рестарта: {', '.join(restart_only)}")
+    if problems:
+        lines.append("Косяки в .env:")
+        lines.extend(f"- {problem}" for problem in problems)
+    await message.answer("\n".join(lines))
+
+
 @router.message(F.chat.type == "private", F.text)
 async def private_text(message: Message, bot: Bot) -> None:
     if not message.from_user:
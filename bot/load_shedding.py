@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from time import monotonic, time
+
+from bot.catch_up import get_in_flight_count
+from bot.config import get_runtime_config
+from bot.metrics import Counter, Gauge, loop_lag_last
+from bot.storage import add_ai_message, add_ai_messages
+
+logger = logging.getLogger(__name__)
+
+SHED_NONE = 0
+SHED_AI = 1
+SHED_MEDIA = 2
+SHED_INGEST_ONLY = 3
+_LEVEL_NAMES = ("норм", "без ИИ", "без медиа", "только запись")
+_CONTROLLER_INTERVAL_SECONDS = 0.5
+_INGEST_BATCH_MAX = 500
+# Stepping down needs the signals well under the level's threshold, so the
+# controller does not flap around the boundary.
+_RECOVERY_FACTOR = 0.5
+
+load_shed_level = Gauge("bot_load_shed_level", "Current load shedding level, 0 means normal operation.")
+shed_actions = Counter(
+    "bot_load_shed_actions_total",
+    "Work skipped because of load shedding.",
+    ("action",),
+)
+
+_level = SHED_NONE
+_calm_since: float | None = None
+_pending_messages: list[tuple[int, int, str, str, int]] = []
+
+
+def get_load_shed_level() -> int:
+    return _level
+
+
+def _signal_level(queue: int, lag: float, factor: float = 1.0) -> int:
+    config = get_runtime_config()
+    level = SHED_NONE
+    thresholds = zip(config.load_shed_queue_levels, config.load_shed_lag_levels)
+    for index, (queue_threshold, lag_threshold) in enumerate(thresholds, start=1):
+        if queue >= queue_threshold * factor or lag >= lag_threshold * factor:
+            level = index
+    return level
+
+
+def update_load_shed_level(queue: int, lag: float, now: float) -> int:
+    # Escalates as soon as a signal crosses a threshold, recovers one step
+    # at a time after a quiet window.
+    global _level, _calm_since
+    if not get_runtime_config().load_shedding:
+        _level, _calm_since = SHED_NONE, None
+    elif (target := _signal_level(queue, lag)) > _level:
+        logger.warning(
+            "Load shedding up to level %s (%s): %s updates in flight, loop lag %.2fs",
+            target,
+            _LEVEL_NAMES[target],
+            queue,
+            lag,
+        )
+        _level, _calm_since = target, None
+    elif _level > SHED_NONE and _signal_level(queue, lag, _RECOVERY_FACTOR) < _level:
+        if _calm_since is None:
+            _calm_since = now
+        elif now - _calm_since >= get_runtime_config().load_shed_recover_seconds:
+            _level -= 1
+            _calm_since = now
+            logger.info("Load shedding down to level %s (%s)", _level, _LEVEL_NAMES[_level])
+    else:
+        _calm_since = None
+    load_shed_level.set(_level)
+    return _level
+
+
+def describe_load_shedding() -> str:
+    return (
+        f"уровень {_level} ({_LEVEL_NAMES[_level]}), "
+        f"в очереди {get_in_flight_count()}, лаг {loop_lag_last.get():.2f}с"
+    )
+
+
+def ingest_ai_message(chat_id: int, user_id: int, username: str, text: str) -> None:
+    # Once buffering starts, later messages queue behind it until the next
+    # flush so chat history keeps its order.
+    if _level < SHED_INGEST_ONLY and not _pending_messages:
+        add_ai_message(chat_id, user_id, username, text)
+        return
+    _pending_messages.append((chat_id, user_id, username, text, int(time())))
+    if len(_pending_messages) >= _INGEST_BATCH_MAX:
+        flush_ingest_buffer()
+
+
+def flush_ingest_buffer() -> None:
+    if not _pending_messages:
+        return
+    batch = list(_pending_messages)
+    _pending_messages.clear()
+    add_ai_messages(batch)
+
+
+async def run_load_shedding_controller() -> None:
+    while True:
+        await asyncio.sleep(_CONTROLLER_INTERVAL_SECONDS)
+        try:
+            update_load_shed_level(get_in_flight_count(), loop_lag_last.get(), monotonic())
+            flush_ingest_buffer()
+        except Exception:
+            logger.exception("Load shedding controller tick failed")
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+from time import monotonic
+import traceback
+
+from bot.config import get_runtime_config
+from bot.metrics import observe_loop_stall
+
+logger = logging.getLogger(__name__)
+_PING_INTERVAL_SECONDS = 0.1
+_MAX_SAMPLES = 3
+
+
+def get_loop_block_seconds() -> float:
+    return get_runtime_config().loop_block_seconds
+
+
+class LoopWatchdog:
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float) -> None:
+        self.loop = loop
+        self.threshold = threshold
+        self.loop_thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def _sample(self) -> str:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return ""
+        return "".join(traceback.format_stack(frame))
+
+    def _run(self) -> None:
+        # The loop is responsive if a callback posted from this thread runs
+        # within the threshold; otherwise something synchronous holds it and
+        # the loop thread's current frame is the culprit.
+        while not self._stop.is_set():
+            pong = threading.Event()
+            started = monotonic()
+            try:
+                self.loop.call_soon_threadsafe(pong.set)
+            except RuntimeError:
+                return
+            if pong.wait(self.threshold):
+                self._stop.wait(_PING_INTERVAL_SECONDS)
+                continue
+
+            samples: list[str] = []
+            while not pong.is_set() and not self._stop.is_set():
+                stack = self._sample()
+                if stack and stack not in samples and len(samples) < _MAX_SAMPLES:
+                    samples.append(stack)
+                pong.wait(self.threshold)
+            if self._stop.is_set():
+                return
+
+            duration = monotonic() - started
+            logger.warning(
+                "Event loop blocked for %.3fs (threshold %.3fs):\n%s",
+                duration,
+                self.threshold,
+                "\n--- later sample ---\n".join(samples) or "no stack captured",
+            )
+            try:
+                self.loop.call_soon_threadsafe(observe_loop_stall, duration)
+            except RuntimeError:
+                return
+
+
+def start_loop_watchdog() -> LoopWatchdog:
+    watchdog = LoopWatchdog(asyncio.get_running_loop(), get_loop_block_seconds())
+    watchdog.start()
+    return watchdog
@@ -1,29 +1,105 @@
 ﻿import asyncio
+from contextlib import suppress
 import logging
+import signal
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
 
+from bot.ai_service import run_model_keeper
+from bot.catch_up import load_update_cursor, run_update_cursor_flusher
 from bot.commands import setup_bot_commands
-from bot.config import load_config
+from bot.config import get_runtime_config, load_config, reload_runtime_config
 from bot.handlers import routers
+from bot.load_shedding import run_load_shedding_controller
+from bot.loop_watchdog import start_loop_watchdog
+from bot.metrics import run_loop_lag_monitor, start_metrics_server
+from bot.middlewares import (
+    HandlerMetricsMiddleware,
+    ProfilingMiddleware,
+    TelegramRequestMetricsMiddleware,
+    UpdateCursorMiddleware,
+    UpdateRecorderMiddleware,
+    get_update_record_path,
+)
+from bot.retrieval import run_embedding_indexer
+from bot.search import run_search_index_sync
+from bot.shutdown import graceful_shutdown, resume_interrupted_updates
+from bot.state_snapshot import restore_state_snapshot
 from bot.storage import init_storage
+from bot.style_profile import run_style_profile_refresher
+from bot.summarizer import run_chat_summarizer
+
+logger = logging.getLogger(__name__)
+
+
+def create_bot(token: str, session: BaseSession | None = None) -> Bot:
+    bot = Bot(token=token, session=session)
+    bot.session.middleware(TelegramRequestMetricsMiddleware())
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    dp.update.outer_middleware(UpdateCursorMiddleware())
+    record_path = get_update_record_path()
+    if record_path:
+        dp.update.outer_middleware(UpdateRecorderMiddleware(record_path))
+    dp.update.outer_middleware(ProfilingMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    for router in routers:
+        dp.include_router(router)
+    return dp
 
 
 async def main() -> None:
     logging.basicConfig(level=logging.INFO)
 
     config = load_config()
+    get_runtime_config()
     init_storage(config.db_path)
 
-    bot = Bot(token=config.bot_token)
-    dp = Dispatcher()
-
-    for router in routers:
-        dp.include_router(router)
+    bot = create_bot(config.bot_token)
+    dp = create_dispatcher()
+    dp.shutdown.register(graceful_shutdown)
+    restore_state_snapshot()
+    resume_from = load_update_cursor(bot.id)
+    if resume_from:
+        logger.info("Resuming after update %s", resume_from)
 
-    await setup_bot_commands(bot)
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Warm the model in the background so the first AI trigger does not pay
+    # the load time; handlers serve fallbacks until it reports "up".
+    background_tasks = [
+        asyncio.create_task(run_model_keeper()),
+        asyncio.create_task(run_style_profile_refresher()),
+        asyncio.create_task(run_embedding_indexer()),
+        asyncio.create_task(run_search_index_sync()),
+        asyncio.create_task(run_chat_summarizer()),
+        asyncio.create_task(run_loop_lag_monitor()),
+        asyncio.create_task(run_load_shedding_controller()),
+        asyncio.create_task(run_update_cursor_flusher()),
+        asyncio.create_task(resume_interrupted_updates(dp, bot)),
+    ]
+    sighup = getattr(signal, "SIGHUP", None)
+    if sighup is not None:
+        # kill -HUP re-reads .env; tuning knobs apply without a restart.
+        asyncio.get_running_loop().add_signal_handler(sighup, reload_runtime_config)
+    metrics_runner = await start_metrics_server()
+    watchdog = start_loop_watchdog()
+    try:
+        # Updates sent while the bot was down are kept: the cursor skips the
+        # ones already handled and stale triggers are dropped per message.
+        await asyncio.gather(setup_bot_commands(bot), bot.delete_webhook(drop_pending_updates=False))
+        await dp.start_polling(bot)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        for task in background_tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        watchdog.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
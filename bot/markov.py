@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+from array import array
+import asyncio
+from collections import OrderedDict
+import re
+from random import choice, randrange
+
+from bot.storage import AIMessage, add_ai_message_listener, get_ai_message_corpus
+from bot.style_profile import get_tracked_style_username
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_BOUNDARY = 0
+_KEY_BASE = 1 << 16
+_MAX_VOCAB = _KEY_BASE - 1
+_MAX_FOLLOWERS = 32
+_MAX_REPLY_WORDS = 12
+_MIN_TRAINED_MESSAGES = 20
+_BOOTSTRAP_MESSAGES = 5000
+# A chain trained on the bootstrap corpus takes a few MB, so only the chats
+# that asked for a reply most recently keep theirs.
+_MAX_CACHED_CHATS = 16
+
+
+class MarkovChain:
+    def __init__(self) -> None:
+        self.vocab: dict[str, int] = {"": _BOUNDARY}
+        self.words: list[str] = [""]
+        # Followers are stored with repetition, so a uniform pick from the
+        # array is a frequency-weighted pick. array('H') keeps each entry at
+        # two bytes, which is why the vocabulary is capped below 2**16.
+        self.pairs: dict[int, array] = {}
+        self.singles: dict[int, array] = {}
+        self.message_count = 0
+
+    def observe(self, text: str) -> None:
+        ids = [word_id for word_id in map(self._word_id, _WORD_PATTERN.findall(text.casefold())) if word_id]
+        if not ids:
+            return
+
+        self.message_count += 1
+        sequence = [_BOUNDARY, _BOUNDARY, *ids, _BOUNDARY]
+        for index in range(2, len(sequence)):
+            follower = sequence[index]
+            _add_follower(self.pairs, sequence[index - 2] * _KEY_BASE + sequence[index - 1], follower)
+            _add_follower(self.singles, sequence[index - 1], follower)
+
+    def generate(self, seed_words: list[str] | None = None, max_words: int = _MAX_REPLY_WORDS) -> str | None:
+        seeds = [
+            word_id
+            for word_id in (self.vocab.get(word, _BOUNDARY) for word in seed_words or ())
+            if word_id and word_id in self.singles
+        ]
+        output: list[int] = []
+        previous, current = _BOUNDARY, _BOUNDARY
+        if seeds:
+            current = choice(seeds)
+            output.append(current)
+
+        while len(output) < max_words:
+            followers = self.pairs.get(previous * _KEY_BASE + current) or self.singles.get(current)
+            if not followers:
+                break
+            follower = followers[randrange(len(followers))]
+            if follower == _BOUNDARY:
+                break
+            output.append(follower)
+            previous, current = current, follower
+
+        if not output or [self.words[word_id] for word_id in output] == seed_words:
+            return None
+        return " ".join(self.words[word_id] for word_id in output)
+
+    def _word_id(self, word: str) -> int:
+        word_id = self.vocab.get(word)
+        if word_id is not None:
+            return word_id
+        if len(self.words) > _MAX_VOCAB:
+            return _BOUNDARY
+        word_id = len(self.words)
+        self.vocab[word] = word_id
+        self.words.append(word)
+        return word_id
+
+
+# Least recently used first: chat id -> (chat chain, style username, style chain).
+_chains: OrderedDict[int, tuple[MarkovChain, str, MarkovChain]] = OrderedDict()
+_chain_loads: dict[tuple[int, str], asyncio.Task[tuple[MarkovChain, MarkovChain]]] = {}
+
+
+def _add_follower(table: dict[int, array], key: int, follower: int) -> None:
+    followers = table.get(key)
+    if followers is None:
+        table[key] = array("H", (follower,))
+    elif len(followers) < _MAX_FOLLOWERS:
+        followers.append(follower)
+    else:
+        followers[randrange(_MAX_FOLLOWERS)] = follower
+
+
+def _build_chains(
+    chat_id: int,
+    style_username: str,
+    chat_chain: MarkovChain | None,
+) -> tuple[MarkovChain, MarkovChain]:
+    # Runs in a worker thread and only touches chains nobody else sees yet.
+    corpus = get_ai_message_corpus(chat_id, limit=_BOOTSTRAP_MESSAGES)
+    if chat_chain is None:
+        chat_chain = MarkovChain()
+        for _, text in corpus:
+            chat_chain.observe(text)
+    style_chain = MarkovChain()
+    for username, text in corpus:
+        if username.casefold() == style_username:
+            style_chain.observe(text)
+    return chat_chain, style_chain
+
+
+async def _load_chains(
+    chat_id: int,
+    style_username: str,
+    chat_chain: MarkovChain | None,
+) -> tuple[MarkovChain, MarkovChain]:
+    try:
+        chat_chain, style_chain = await asyncio.to_thread(_build_chains, chat_id, style_username, chat_chain)
+    finally:
+        _chain_loads.pop((chat_id, style_username), None)
+    _chains[chat_id] = (chat_chain, style_username, style_chain)
+    _chains.move_to_end(chat_id)
+    while len(_chains) > _MAX_CACHED_CHATS:
+        _chains.popitem(last=False)
+    return chat_chain, style_chain
+
+
+async def _chains_for(chat_id: int) -> tuple[MarkovChain, MarkovChain]:
+    style_username = get_tracked_style_username(chat_id)
+    entry = _chains.get(chat_id)
+    if entry is not None:
+        _chains.move_to_end(chat_id)
+        if entry[1] == style_username:
+            return entry[0], entry[2]
+
+    # A changed style user keeps the chat chain and retrains only the style
+    # chain; concurrent replies share one build.
+    key = (chat_id, style_username)
+    load = _chain_loads.get(key)
+    if load is None:
+        load = asyncio.create_task(_load_chains(chat_id, style_username, entry[0] if entry else None))
+        _chain_loads[key] = load
+    return await asyncio.shield(load)
+
+
+def _observe_message(message: AIMessage) -> None:
+    entry = _chains.get(message.chat_id)
+    if entry is None:
+        # Not trained yet or evicted: the next reply bootstraps from
+        # ai_messages.
+        return
+
+    chat_chain, style_username, style_chain = entry
+    chat_chain.observe(message.text)
+    if message.username.casefold() == style_username:
+        style_chain.observe(message.text)
+
+
+async def generate_local_reply(chat_id: int, seed_text: str = "") -> str | None:
+    chat_chain, style_chain = await _chains_for(chat_id)
+    seed_words = _WORD_PATTERN.findall(seed_text.casefold())
+    for chain in (style_chain, chat_chain):
+        if chain.message_count < _MIN_TRAINED_MESSAGES:
+            continue
+        reply = chain.generate(seed_words)
+        if reply:
+            return reply
+    return None
+
+
+add_ai_message_listener(_observe_message)
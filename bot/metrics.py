@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import asyncio
+from bisect import bisect_left
+from contextvars import ContextVar
+import logging
+from time import perf_counter
+from typing import Callable
+
+from aiohttp import web
+
+from bot.config import get_runtime_config
+
+logger = logging.getLogger(__name__)
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_STORAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+_LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+_LOOP_LAG_INTERVAL_SECONDS = 0.5
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_handler_kind: ContextVar[str | None] = ContextVar("handler_kind", default=None)
+_update_phases: ContextVar[tuple[asyncio.Task | None, dict[str, float]] | None] = ContextVar(
+    "update_phases",
+    default=None,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        _registry.append(self)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+
+class Gauge:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        function: Callable[[], float] | None = None,
+    ) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.function = function
+        self._values: dict[tuple[str, ...], float] = {}
+        _registry.append(self)
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def collect(self) -> list[str]:
+        values = dict(self._values)
+        if self.function is not None:
+            try:
+                values[()] = float(self.function())
+            except Exception:
+                logger.exception("Failed to collect gauge %s", self.name)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = _LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: non-cumulative bucket counts (+Inf last), sum, count.
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+            self._series[labels] = series
+        counts, totals = series
+        counts[bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, totals) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+                )
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_number(totals[0])}")
+            lines.append(f"{self.name}_count{label_text} {int(totals[1])}")
+        return lines
+
+
+_registry: list[Counter | Gauge | Histogram] = []
+
+handler_updates = Counter("bot_handler_updates_total", "Handled updates by trigger kind.", ("kind",))
+handler_errors = Counter("bot_handler_errors_total", "Handler exceptions by trigger kind.", ("kind",))
+handler_seconds = Histogram("bot_handler_seconds", "Handler latency by trigger kind.", ("kind",))
+storage_seconds = Histogram(
+    "bot_storage_query_seconds",
+    "SQLite time per storage function.",
+    ("operation",),
+    buckets=_STORAGE_BUCKETS,
+)
+upstream_requests = Counter(
+    "bot_upstream_requests_total",
+    "Upstream HTTP requests by outcome, including ones skipped as breaker_open or negative_cache.",
+    ("upstream", "outcome"),
+)
+upstream_seconds = Histogram("bot_upstream_request_seconds", "Upstream HTTP request latency.", ("upstream",))
+cache_requests = Counter("bot_cache_requests_total", "In-memory cache lookups.", ("cache", "result"))
+loop_lag_seconds = Histogram(
+    "bot_event_loop_lag_seconds",
+    "Delay of a periodic event-loop timer over its schedule.",
+    buckets=_LOOP_LAG_BUCKETS,
+)
+update_seconds = Histogram("bot_update_seconds", "End-to-end update processing time.", ("update_type",))
+update_phase_seconds = Histogram(
+    "bot_update_phase_seconds",
+    "Update processing time split into handler, storage and network phases.",
+    ("phase",),
+)
+loop_lag_last = Gauge("bot_event_loop_lag_last_seconds", "Most recent event-loop lag sample.")
+loop_stalls = Counter("bot_event_loop_stalls_total", "Times the event loop was blocked past the watchdog threshold.")
+loop_stall_seconds = Histogram(
+    "bot_event_loop_stall_seconds",
+    "Duration of event-loop stalls caught by the watchdog.",
+    buckets=_LOOP_LAG_BUCKETS,
+)
+loop_stall_max = Gauge("bot_event_loop_stall_max_seconds", "Longest event-loop stall since start.")
+
+
+def set_handler_kind(kind: str) -> None:
+    _handler_kind.set(kind)
+
+
+def get_handler_kind() -> str | None:
+    return _handler_kind.get()
+
+
+def start_update_phases() -> dict[str, float]:
+    phases: dict[str, float] = {}
+    _update_phases.set((asyncio.current_task(), phases))
+    return phases
+
+
+def _add_phase_time(phase: str, seconds: float) -> None:
+    current = _update_phases.get()
+    if current is None:
+        return
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return
+    # Tasks spawned by a handler inherit the context; only time spent in the
+    # update's own task is attributed to it.
+    if task is current[0]:
+        current[1][phase] = current[1].get(phase, 0.0) + seconds
+
+
+def observe_update(update_type: str, seconds: float, phases: dict[str, float]) -> None:
+    update_seconds.observe(seconds, update_type)
+    for phase, value in phases.items():
+        update_phase_seconds.observe(value, phase)
+
+
+def observe_handler(kind: str, seconds: float, failed: bool = False) -> None:
+    handler_updates.inc(kind)
+    handler_seconds.observe(seconds, kind)
+    if failed:
+        handler_errors.inc(kind)
+
+
+def observe_storage_query(operation: str, seconds: float) -> None:
+    storage_seconds.observe(seconds, operation)
+    _add_phase_time("storage", seconds)
+
+
+def observe_upstream(upstream: str, seconds: float, ok: bool) -> None:
+    upstream_requests.inc(upstream, "ok" if ok else "error")
+    upstream_seconds.observe(seconds, upstream)
+    _add_phase_time("network", seconds)
+
+
+def count_upstream_skip(upstream: str, reason: str) -> None:
+    upstream_requests.inc(upstream, reason)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    cache_requests.inc(cache, "hit" if hit else "miss")
+
+
+def observe_loop_stall(seconds: float) -> None:
+    loop_stalls.inc()
+    loop_stall_seconds.observe(seconds)
+    loop_stall_max.set(max(seconds, loop_stall_max.get()))
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+def get_metrics_port() -> int:
+    return get_runtime_config().metrics_port
+
+
+def get_metrics_host() -> str:
+    return get_runtime_config().metrics_host
+
+
+async def _metrics_view(_: web.Request) -> web.Response:
+    return web.Response(body=render_metrics().encode("utf-8"), headers={"Content-Type": _CONTENT_TYPE})
+
+
+async def start_metrics_server() -> web.AppRunner | None:
+    port = get_metrics_port()
+    if not port:
+        return None
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, get_metrics_host(), port).start()
+    logger.info("Metrics are served on http://%s:%s/metrics", get_metrics_host(), port)
+    return runner
+
+
+async def run_loop_lag_monitor() -> None:
+    while True:
+        started = perf_counter()
+        await asyncio.sleep(_LOOP_LAG_INTERVAL_SECONDS)
+        lag = max(0.0, perf_counter() - started - _LOOP_LAG_INTERVAL_SECONDS)
+        loop_lag_seconds.observe(lag)
+        loop_lag_last.set(lag)
@@ -0,0 +1,4 @@
+from .catch_up import UpdateCursorMiddleware
+from .metrics import HandlerMetricsMiddleware, TelegramRequestMetricsMiddleware
+from .profiling import ProfilingMiddleware
+from .recorder import UpdateRecorderMiddleware, get_update_record_path
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.catch_up import is_already_processed, update_finished, update_started
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateCursorMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        # Telegram redelivers the last batch if we stopped before confirming
+        # it; anything at or below the stored cursor was already handled.
+        # Updates cut off by the last shutdown come back flagged as resumed.
+        if not data.get("resumed") and is_already_processed(event.update_id):
+            logger.debug("Skipping already processed update %s", event.update_id)
+            return None
+
+        update_started(event)
+        try:
+            return await handler(event, data)
+        finally:
+            update_finished(event.update_id)
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from bot.metrics import get_handler_kind, observe_handler, observe_upstream, set_handler_kind
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        # Handlers may narrow the label with set_handler_kind(); by default it
+        # is the handler function name.
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        set_handler_kind(getattr(callback, "__name__", "unknown"))
+        started = perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            observe_handler(get_handler_kind() or "unknown", perf_counter() - started, failed)
+
+
+class TelegramRequestMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> TelegramType:
+        # Long polling waits by design; it is not Bot API latency.
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+
+        started = perf_counter()
+        ok = False
+        try:
+            # The session raises on API errors and returns the bare result.
+            result = await make_request(bot, method)
+            ok = True
+            return result
+        finally:
+            observe_upstream("telegram", perf_counter() - started, ok)
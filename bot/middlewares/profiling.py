@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+from time import perf_counter, time
+import traceback
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.config import get_runtime_config
+from bot.metrics import get_handler_kind, observe_update, start_update_phases
+from bot.middlewares.recorder import (
+    anonymize_update,
+    get_plain_usernames,
+    get_update_record_salt,
+    sanitize_update,
+)
+
+logger = logging.getLogger(__name__)
+_slow_logger = logging.getLogger("bot.slow_updates")
+_SLOW_LOG_MAX_BYTES = 5 * 1024 * 1024
+_SLOW_LOG_BACKUPS = 3
+_STACK_SAMPLE_INTERVAL_SECONDS = 1.0
+_MAX_STACK_SAMPLES = 5
+_TEXT_KEYS = {"text", "caption"}
+
+
+def get_slow_update_seconds() -> float:
+    return get_runtime_config().slow_update_seconds
+
+
+def get_slow_update_log_path() -> str:
+    return get_runtime_config().slow_update_log
+
+
+def _ensure_slow_log_handler() -> None:
+    if _slow_logger.handlers:
+        return
+    handler = RotatingFileHandler(
+        get_slow_update_log_path(),
+        maxBytes=_SLOW_LOG_MAX_BYTES,
+        backupCount=_SLOW_LOG_BACKUPS,
+        encoding="utf-8",
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _slow_logger.addHandler(handler)
+    _slow_logger.setLevel(logging.INFO)
+    _slow_logger.propagate = False
+
+
+def _redact_text(value: Any) -> Any:
+    # Only the length of a message matters for a slow update.
+    if isinstance(value, dict):
+        return {
+            key: f"<{len(item)} chars>" if key in _TEXT_KEYS and isinstance(item, str) else _redact_text(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact_text(item) for item in value]
+    return value
+
+
+def _slow_update_payload(event: TelegramObject, chat_id: int | None) -> Any:
+    # Same ids and username hashes as the update recorder, so a slow update
+    # can be found in a recording without the log exposing anyone.
+    payload = sanitize_update(event.model_dump(mode="json", exclude_none=True, by_alias=True))
+    return _redact_text(anonymize_update(payload, get_update_record_salt(), get_plain_usernames(chat_id)))
+
+
+def _await_chain_stack(task: asyncio.Task) -> str:
+    # Task.get_stack() stops at the task's own coroutine; follow cr_await to
+    # reach the frame the update is actually waiting in.
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append((frame, frame.f_lineno))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return "".join(traceback.StackSummary.extract(frames).format())
+
+
+def _sample_stack(
+    task: asyncio.Task | None,
+    samples: list[str],
+    handles: list[asyncio.TimerHandle],
+    started: float,
+) -> None:
+    if task is None or task.done():
+        return
+    samples.append(f"+{perf_counter() - started:.2f}s\n{_await_chain_stack(task)}")
+    if len(samples) < _MAX_STACK_SAMPLES:
+        loop = asyncio.get_running_loop()
+        handles.append(
+            loop.call_later(_STACK_SAMPLE_INTERVAL_SECONDS, _sample_stack, task, samples, handles, started)
+        )
+
+
+def _log_slow_update(
+    event: TelegramObject,
+    chat_id: int | None,
+    total: float,
+    phases: dict[str, float],
+    samples: list[str],
+) -> None:
+    try:
+        _ensure_slow_log_handler()
+        _slow_logger.info(
+            json.dumps(
+                {
+                    "ts": int(time()),
+                    "seconds": round(total, 4),
+                    "kind": get_handler_kind(),
+                    "phases": {phase: round(value, 4) for phase, value in phases.items()},
+                    "update": _slow_update_payload(event, chat_id),
+                    "stacks": samples,
+                },
+                ensure_ascii=False,
+            )
+        )
+    except Exception:
+        logger.exception("Failed to write the slow update log")
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        phases = start_update_phases()
+        threshold = get_slow_update_seconds()
+        samples: list[str] = []
+        handles: list[asyncio.TimerHandle] = []
+        started = perf_counter()
+        # Stacks are sampled only once an update is already slow, so fast
+        # updates pay for one timer and nothing else.
+        handles.append(
+            asyncio.get_running_loop().call_later(
+                threshold, _sample_stack, asyncio.current_task(), samples, handles, started
+            )
+        )
+        try:
+            return await handler(event, data)
+        finally:
+            for timer in handles:
+                timer.cancel()
+            total = perf_counter() - started
+            phases["handler"] = max(0.0, total - sum(phases.values()))
+            update_type = (event.event_type if isinstance(event, Update) else None) or type(event).__name__
+            observe_update(update_type, total, phases)
+            if total >= threshold:
+                chat = data.get("event_chat")
+                _log_slow_update(event, chat.id if chat else None, total, phases, samples)
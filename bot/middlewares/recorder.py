@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+from time import time
+from typing import IO, Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import TelegramObject, Update
+
+from bot.config import get_runtime_config
+from bot.storage import get_bot_state, set_bot_state
+from bot.style_profile import get_tracked_style_username
+
+logger = logging.getLogger(__name__)
+_SALT_STATE_KEY = "update_record_salt"
+_HASHED_ID_KEYS = {"user_id", "chat_id", "sender_chat_id"}
+_MASKED_KEYS = {"title", "description", "invite_link"}
+_SENSITIVE_KEYS = {"first_name", "last_name", "phone_number", "email", "bio", "vcard"}
+# Usernames the group handlers branch on (see group_features) stay readable,
+# together with each chat's /ai_style user, so a replay takes the same paths.
+_TRIGGER_USERNAMES = frozenset({"yeuoia", "odeyalow"})
+_record_salt = b""
+
+
+def get_update_record_path() -> str:
+    return get_runtime_config().update_record_path
+
+
+def get_update_record_salt() -> bytes:
+    # Kept in the bot database so hashes stay stable across restarts and the
+    # salt never travels with the log itself.
+    global _record_salt
+    if not _record_salt:
+        salt = get_bot_state(_SALT_STATE_KEY)
+        if not salt:
+            salt = secrets.token_hex(16)
+            set_bot_state(_SALT_STATE_KEY, salt)
+        _record_salt = salt.encode("ascii")
+    return _record_salt
+
+
+def sanitize_update(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            key: "***" if key in _SENSITIVE_KEYS else sanitize_update(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [sanitize_update(item) for item in value]
+    return value
+
+
+def _hash_id(salt: bytes, value: int) -> int:
+    digest = hmac.new(salt, str(abs(value)).encode("ascii"), hashlib.sha256).digest()
+    hashed = int.from_bytes(digest[:6], "big") or 1
+    return -hashed if value < 0 else hashed
+
+
+def _hash_username(salt: bytes, value: str) -> str:
+    digest = hmac.new(salt, value.casefold().encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"u{digest[:10]}"
+
+
+def get_plain_usernames(chat_id: int | None) -> frozenset[str]:
+    if chat_id is None:
+        return _TRIGGER_USERNAMES
+    return _TRIGGER_USERNAMES | {get_tracked_style_username(chat_id)}
+
+
+def anonymize_update(value: Any, salt: bytes, plain_usernames: frozenset[str] = frozenset()) -> Any:
+    if isinstance(value, list):
+        return [anonymize_update(item, salt, plain_usernames) for item in value]
+    if not isinstance(value, dict):
+        return value
+    # Users and chats carry an "id" next to is_bot/type; bots stay as they
+    # are so replies to the bot still match on replay.
+    is_account = "is_bot" in value or "type" in value
+    is_bot_account = bool(value.get("is_bot"))
+    result: dict[str, Any] = {}
+    for key, item in value.items():
+        if key == "id" and is_account and not is_bot_account and isinstance(item, int):
+            result[key] = _hash_id(salt, item)
+        elif key in _HASHED_ID_KEYS and isinstance(item, int):
+            result[key] = _hash_id(salt, item)
+        elif key == "username" and not is_bot_account and isinstance(item, str):
+            result[key] = item if item.casefold() in plain_usernames else _hash_username(salt, item)
+        elif key in _MASKED_KEYS and isinstance(item, str):
+            result[key] = "***"
+        else:
+            result[key] = anonymize_update(item, salt, plain_usernames)
+    return result
+
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file: IO[str] | None = None
+        self._salt = b""
+
+    def _open(self, bot: Bot) -> IO[str]:
+        if self._file is None:
+            self._salt = get_update_record_salt()
+            self._file = open(self.path, "a", encoding="utf-8")
+            # Every session starts with a header so replay knows the bot id.
+            self._write({"bot_id": bot.id, "started": round(time(), 3)})
+        return self._file
+
+    def _write(self, record: dict[str, Any]) -> None:
+        assert self._file is not None
+        # Flushed per line so a crash loses at most the update in flight.
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        bot = data.get("bot")
+        if isinstance(event, Update) and isinstance(bot, Bot):
+            try:
+                self._open(bot)
+                chat = data.get("event_chat")
+                payload = anonymize_update(
+                    sanitize_update(event.model_dump(mode="json", exclude_none=True, by_alias=True)),
+                    self._salt,
+                    get_plain_usernames(chat.id if chat else None),
+                )
+                self._write({"ts": round(time(), 3), "update": payload})
+            except Exception:
+                logger.exception("Failed to record update")
+        return await handler(event, data)
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+import logging
+from random import random
+from typing import AsyncIterator
+
+import aiohttp
+
+from bot.config import get_runtime_config
+from bot.resilience import BREAKER_CLOSED, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+_HEALTH_TIMEOUT_SECONDS = 5
+_BREAKER_FAILURE_THRESHOLD = 3
+_BREAKER_RESET_SECONDS = 30.0
+
+
+def _new_breaker() -> CircuitBreaker:
+    return CircuitBreaker(failure_threshold=_BREAKER_FAILURE_THRESHOLD, reset_timeout=_BREAKER_RESET_SECONDS)
+
+
+@dataclass
+class OllamaBackend:
+    base_url: str
+    breaker: CircuitBreaker = field(default_factory=_new_breaker)
+    # Embedding calls get their own breaker: a broken embed model must not
+    # take the backend away from chat replies.
+    embed_breaker: CircuitBreaker = field(default_factory=_new_breaker)
+    outstanding: int = 0
+    reachable: bool = True
+    loaded_models: frozenset[str] = frozenset()
+
+    def has_model(self, model: str) -> bool:
+        return normalize_model_name(model) in self.loaded_models
+
+    def breaker_for(self, embed: bool) -> CircuitBreaker:
+        return self.embed_breaker if embed else self.breaker
+
+
+_backends: list[OllamaBackend] = []
+
+
+def normalize_model_name(value: str) -> str:
+    cleaned = value.strip().casefold()
+    return cleaned if ":" in cleaned else f"{cleaned}:latest"
+
+
+def get_ollama_base_urls() -> list[str]:
+    return list(get_runtime_config().ollama_base_urls)
+
+
+def get_backends() -> list[OllamaBackend]:
+    global _backends
+    urls = get_ollama_base_urls()
+    if [backend.base_url for backend in _backends] != urls:
+        existing = {backend.base_url: backend for backend in _backends}
+        _backends = [existing.get(url) or OllamaBackend(base_url=url) for url in urls]
+    return _backends
+
+
+def pick_backend(model: str, exclude: set[str] | None = None, *, embed: bool = False) -> OllamaBackend | None:
+    skipped = exclude or set()
+    candidates = [
+        backend
+        for backend in get_backends()
+        if backend.base_url not in skipped and backend.reachable and backend.breaker_for(embed).is_available()
+    ]
+    if not candidates:
+        # Every backend looks unhealthy: still try the ones whose breaker
+        # allows it, the health data may simply be stale.
+        candidates = [
+            backend
+            for backend in get_backends()
+            if backend.base_url not in skipped and backend.breaker_for(embed).is_available()
+        ]
+
+    candidates.sort(
+        key=lambda backend: (
+            0 if backend.has_model(model) else 1,
+            backend.outstanding,
+            random(),
+        )
+    )
+    for backend in candidates:
+        if backend.breaker_for(embed).allow_request():
+            return backend
+    return None
+
+
+@asynccontextmanager
+async def acquire_backend(
+    model: str,
+    exclude: set[str] | None = None,
+    *,
+    embed: bool = False,
+) -> AsyncIterator[OllamaBackend | None]:
+    backend = pick_backend(model, exclude, embed=embed)
+    if backend is None:
+        yield None
+        return
+
+    backend.outstanding += 1
+    try:
+        yield backend
+    finally:
+        backend.outstanding -= 1
+
+
+async def _check_backend(session: aiohttp.ClientSession, backend: OllamaBackend) -> None:
+    timeout = aiohttp.ClientTimeout(total=_HEALTH_TIMEOUT_SECONDS)
+    try:
+        async with session.get(f"{backend.base_url}/api/ps", timeout=timeout) as response:
+            response.raise_for_status()
+            data = await response.json()
+    except (aiohttp.ClientError, TimeoutError, ValueError) as exc:
+        if backend.reachable:
+            logger.warning("Ollama backend is unreachable: url=%s error=%s", backend.base_url, exc)
+        backend.reachable = False
+        backend.loaded_models = frozenset()
+        backend.breaker.record_failure()
+        return
+
+    models = data.get("models") if isinstance(data, dict) else None
+    backend.loaded_models = frozenset(
+        normalize_model_name(str(item.get("name") or item.get("model") or ""))
+        for item in models or ()
+        if isinstance(item, dict)
+    )
+    if not backend.reachable:
+        logger.info("Ollama backend is reachable again: url=%s", backend.base_url)
+    backend.reachable = True
+    for breaker in (backend.breaker, backend.embed_breaker):
+        if breaker.state != BREAKER_CLOSED:
+            breaker.reset()
+
+
+async def refresh_backends() -> list[OllamaBackend]:
+    backends = list(get_backends())
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(_check_backend(session, backend) for backend in backends))
+    return backends
+
+
+def describe_backends() -> str:
+    parts = []
+    for backend in get_backends():
+        status = backend.breaker.state if backend.reachable else "down"
+        if backend.reachable and backend.embed_breaker.state != BREAKER_CLOSED:
+            status += f", embed {backend.embed_breaker.state}"
+        parts.append(f"{backend.base_url} [{status}, {backend.outstanding} in flight]")
+    return ", ".join(parts)
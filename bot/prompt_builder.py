@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from math import ceil
+import re
+from typing import Iterable
+
+_TOKEN_PIECE_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\W\d_A-Za-z]+|[^\w\s]|_", re.UNICODE)
+# Rough BPE densities for Qwen/Llama-style vocabularies: English words are
+# ~4 chars per token, Cyrillic ~2.5, digits are split into short groups.
+_LATIN_CHARS_PER_TOKEN = 4.0
+_OTHER_CHARS_PER_TOKEN = 2.5
+_DIGITS_PER_TOKEN = 3.0
+_MESSAGE_OVERHEAD_TOKENS = 6
+_SAFETY_MARGIN_TOKENS = 24
+_MESSAGE_MAX_TOKENS = 80
+_STYLE_LINE_MAX_TOKENS = 36
+_HISTORY_LINE_MAX_TOKENS = 48
+_STYLE_MAX_EXAMPLES = 3
+_HISTORY_MAX_LINES = 4
+_HISTORY_MAX_LINES_WITH_SUMMARY = 2
+_SUMMARY_MAX_TOKENS = 96
+_REPLY_MIN_WORDS = 4
+_REPLY_MAX_WORDS = 24
+_REPLY_TOKENS_PER_WORD = 2.5
+_REPLY_SLACK_TOKENS = 4
+REPLY_STOP_SEQUENCES = ("\n",)
+
+
+@dataclass(frozen=True)
+class PromptPlan:
+    system: str
+    user: str
+    num_predict: int
+    stop: tuple[str, ...]
+    prompt_tokens: int
+
+
+def estimate_tokens(text: str) -> int:
+    total = 0
+    for piece in _TOKEN_PIECE_PATTERN.findall(text):
+        first = piece[0]
+        if first.isdigit():
+            total += ceil(len(piece) / _DIGITS_PER_TOKEN)
+        elif first.isascii() and first.isalpha():
+            total += ceil(len(piece) / _LATIN_CHARS_PER_TOKEN)
+        elif first.isalpha():
+            total += ceil(len(piece) / _OTHER_CHARS_PER_TOKEN)
+        else:
+            total += 1
+    return total
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    cleaned = " ".join(text.split())
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(cleaned) <= max_tokens:
+        return cleaned
+
+    words = cleaned.split(" ")
+    kept: list[str] = []
+    used = 0
+    for word in words:
+        cost = estimate_tokens(word)
+        if used + cost > max_tokens:
+            break
+        kept.append(word)
+        used += cost
+    return " ".join(kept)
+
+
+def choose_num_predict(user_message: str, max_tokens: int) -> int:
+    # Short pokes get short answers; the reply never needs more words than a
+    # bit over the message it answers.
+    words = len(user_message.split())
+    expected_words = max(_REPLY_MIN_WORDS, min(_REPLY_MAX_WORDS, ceil(words * 1.5)))
+    wanted = ceil(expected_words * _REPLY_TOKENS_PER_WORD) + _REPLY_SLACK_TOKENS
+    return max(1, min(max_tokens, wanted))
+
+
+def _fill_lines(
+    lines: Iterable[str],
+    *,
+    budget: int,
+    max_lines: int,
+    line_max_tokens: int,
+    prefix: str,
+) -> tuple[list[str], int]:
+    picked: list[str] = []
+    used = 0
+    for line in lines:
+        if len(picked) >= max_lines:
+            break
+        trimmed = trim_to_tokens(line, line_max_tokens)
+        if not trimmed:
+            continue
+        formatted = f"{prefix}{trimmed}"
+        cost = estimate_tokens(formatted) + 1
+        if used + cost > budget:
+            break
+        picked.append(formatted)
+        used += cost
+    return picked, used
+
+
+def _history_lines_newest_first(history: list[dict[str, str]]) -> list[str]:
+    lines: list[str] = []
+    for item in reversed(history):
+        text = (item.get("text") or "").strip()
+        if text:
+            lines.append(f"@{(item.get('username') or 'user').strip()}: {text}")
+    return lines
+
+
+def _reply_instruction() -> str:
+    return "Return one short reply in the same style."
+
+
+def build_prompt_plan(
+    *,
+    system_prompt: str,
+    user_message: str,
+    style_username: str,
+    style_examples: list[str],
+    style_words: list[str],
+    history: list[dict[str, str]],
+    num_ctx: int,
+    summary: str = "",
+    max_tokens: int,
+    context_tokens: int = 0,
+    include_system: bool = True,
+    include_style: bool = True,
+) -> PromptPlan | None:
+    num_predict = choose_num_predict(user_message, max_tokens)
+    budget = num_ctx - context_tokens - num_predict - _SAFETY_MARGIN_TOKENS
+    system = system_prompt if include_system else ""
+    budget -= estimate_tokens(system) + (_MESSAGE_OVERHEAD_TOKENS if system else 0)
+    budget -= _MESSAGE_OVERHEAD_TOKENS + estimate_tokens(_reply_instruction())
+
+    message_header = "Current user message:\n"
+    message = trim_to_tokens(user_message, min(_MESSAGE_MAX_TOKENS, budget - estimate_tokens(message_header)))
+    if not message:
+        return None
+    budget -= estimate_tokens(message_header + message) + 2
+
+    sections: list[str] = []
+    if include_style:
+        style_header = f"Style examples of @{style_username}:\n"
+        style_budget = budget - estimate_tokens(style_header)
+        style_lines, used = _fill_lines(
+            style_examples,
+            budget=style_budget,
+            max_lines=_STYLE_MAX_EXAMPLES,
+            line_max_tokens=_STYLE_LINE_MAX_TOKENS,
+            prefix="- ",
+        )
+        words_line = f"Частые слова: {', '.join(style_words)}" if style_words else ""
+        if words_line and used + estimate_tokens(words_line) + 1 <= style_budget:
+            style_lines.append(words_line)
+            used += estimate_tokens(words_line) + 1
+        if style_lines:
+            sections.append(style_header + "\n".join(style_lines))
+            budget -= estimate_tokens(style_header) + used + 2
+
+    # The summary stands in for the older part of the chat, so only the last
+    # couple of raw lines are kept next to it. It is already part of the
+    # cached context on reused turns.
+    summary_text = ""
+    if include_style and summary.strip():
+        summary_header = "Chat summary:\n"
+        summary_text = trim_to_tokens(
+            summary, min(_SUMMARY_MAX_TOKENS, budget - estimate_tokens(summary_header) - 2)
+        )
+        if summary_text:
+            sections.append(summary_header + summary_text)
+            budget -= estimate_tokens(summary_header + summary_text) + 2
+
+    history_header = "Recent chat context:\n" if include_style else "New chat lines:\n"
+    history_lines, used = _fill_lines(
+        _history_lines_newest_first(history),
+        budget=budget - estimate_tokens(history_header),
+        max_lines=_HISTORY_MAX_LINES_WITH_SUMMARY if summary_text else _HISTORY_MAX_LINES,
+        line_max_tokens=_HISTORY_LINE_MAX_TOKENS,
+        prefix="",
+    )
+    if history_lines:
+        sections.append(history_header + "\n".join(reversed(history_lines)))
+
+    sections.append(message_header + message)
+    sections.append(_reply_instruction())
+    user = "\n\n".join(sections)
+
+    prompt_tokens = estimate_tokens(user) + _MESSAGE_OVERHEAD_TOKENS
+    if system:
+        prompt_tokens += estimate_tokens(system) + _MESSAGE_OVERHEAD_TOKENS
+    return PromptPlan(
+        system=system,
+        user=user,
+        num_predict=num_predict,
+        stop=REPLY_STOP_SEQUENCES,
+        prompt_tokens=prompt_tokens,
+    )
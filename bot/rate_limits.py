@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from time import monotonic
+
+from bot.metrics import Counter
+from bot.state_snapshot import monotonic_to_wall, register_state, wall_to_monotonic
+from bot.storage import delete_trigger_rate_limit, get_trigger_rate_limits, set_trigger_rate_limit
+
+RATE_LIMIT_SCOPES = ("chat", "user")
+TRIGGER_KINDS = (
+    "mem_photo_request",
+    "mem_request",
+    "paroshka_trigger",
+    "em_trigger",
+    "sad_trigger",
+    "pr_trigger",
+    "ai_trigger",
+    "do_it_trigger",
+    "who_am_i",
+    "anon_link_text",
+    "aldik_name",
+    "yeuoia_user",
+    "moderator_word",
+    "custom_trigger",
+)
+# Scrapes and model calls are what spam actually costs; canned replies stay
+# unlimited unless a chat admin sets a limit.
+DEFAULT_RATE_LIMITS: dict[tuple[str, str], tuple[int, float]] = {
+    ("mem_photo_request", "chat"): (6, 60.0),
+    ("mem_photo_request", "user"): (2, 60.0),
+    ("mem_request", "chat"): (6, 60.0),
+    ("mem_request", "user"): (2, 60.0),
+    ("sad_trigger", "chat"): (4, 60.0),
+    ("sad_trigger", "user"): (2, 60.0),
+    ("paroshka_trigger", "chat"): (10, 60.0),
+    ("paroshka_trigger", "user"): (3, 60.0),
+    ("ai_trigger", "chat"): (12, 60.0),
+    ("ai_trigger", "user"): (4, 60.0),
+}
+MAX_RATE_LIMIT_CAPACITY = 1000
+MAX_RATE_LIMIT_PERIOD_SECONDS = 3600.0
+_BUCKET_SWEEP_SIZE = 10_000
+
+rate_limited_triggers = Counter(
+    "bot_rate_limited_triggers_total",
+    "Triggers dropped because a token bucket was empty.",
+    ("kind", "scope"),
+)
+
+
+@dataclass(frozen=True)
+class RateLimitHit:
+    scope: str
+    retry_after: float
+    first: bool
+
+
+# Overrides per chat, loaded from the database once and dropped on change.
+_chat_limits: dict[int, dict[tuple[str, str], tuple[int, float]]] = {}
+# (kind, scope, chat_id, user_id or 0) -> (tokens, updated_at, warned)
+_buckets: dict[tuple[str, str, int, int], tuple[float, float, bool]] = {}
+
+
+def get_chat_rate_limits(chat_id: int) -> dict[tuple[str, str], tuple[int, float]]:
+    limits = _chat_limits.get(chat_id)
+    if limits is None:
+        limits = dict(DEFAULT_RATE_LIMITS)
+        for item in get_trigger_rate_limits(chat_id):
+            limits[(item.kind, item.scope)] = (item.capacity, item.per_seconds)
+        _chat_limits[chat_id] = limits
+    return limits
+
+
+def set_chat_rate_limit(chat_id: int, kind: str, scope: str, capacity: int, per_seconds: float) -> None:
+    set_trigger_rate_limit(chat_id, kind, scope, capacity, per_seconds)
+    _chat_limits.pop(chat_id, None)
+
+
+def reset_chat_rate_limit(chat_id: int, kind: str, scope: str) -> bool:
+    deleted = delete_trigger_rate_limit(chat_id, kind, scope)
+    _chat_limits.pop(chat_id, None)
+    return deleted
+
+
+def acquire_trigger(chat_id: int, user_id: int, kind: str, now: float | None = None) -> RateLimitHit | None:
+    now = monotonic() if now is None else now
+    limits = get_chat_rate_limits(chat_id)
+    charged: list[tuple[tuple[str, str, int, int], float]] = []
+    for scope in RATE_LIMIT_SCOPES:
+        capacity, per_seconds = limits.get((kind, scope), (0, 0.0))
+        if capacity <= 0:
+            continue
+        key = (kind, scope, chat_id, user_id if scope == "user" else 0)
+        tokens, updated_at, warned = _buckets.get(key, (float(capacity), now, False))
+        tokens = min(float(capacity), tokens + (now - updated_at) * capacity / per_seconds)
+        if tokens < 1.0:
+            _buckets[key] = (tokens, now, True)
+            rate_limited_triggers.inc(kind, scope)
+            return RateLimitHit(
+                scope=scope,
+                retry_after=(1.0 - tokens) * per_seconds / capacity,
+                first=not warned,
+            )
+        charged.append((key, tokens))
+
+    # Every bucket must have a token before any of them is charged, so a
+    # user blocked by their own limit does not drain the chat's.
+    for key, tokens in charged:
+        _buckets[key] = (tokens - 1.0, now, False)
+    if len(_buckets) > _BUCKET_SWEEP_SIZE:
+        _sweep_buckets(now)
+    return None
+
+
+def _sweep_buckets(now: float) -> None:
+    # Any bucket idle for the longest allowed period has refilled completely.
+    for key, (_, updated_at, _) in list(_buckets.items()):
+        if now - updated_at >= MAX_RATE_LIMIT_PERIOD_SECONDS:
+            del _buckets[key]
+
+
+def describe_rate_limits(chat_id: int) -> list[str]:
+    limits = get_chat_rate_limits(chat_id)
+    overridden = {(item.kind, item.scope) for item in get_trigger_rate_limits(chat_id)}
+    lines: list[str] = []
+    for kind in TRIGGER_KINDS:
+        parts: list[str] = []
+        for scope in RATE_LIMIT_SCOPES:
+            capacity, per_seconds = limits.get((kind, scope), (0, 0.0))
+            if capacity <= 0 and (kind, scope) not in overridden:
+                continue
+            value = f"{capacity}/{per_seconds:g}с" if capacity > 0 else "без лимита"
+            mark = "*" if (kind, scope) in overridden else ""
+            parts.append(f"{scope} {value}{mark}")
+        if parts:
+            lines.append(f"{kind}: {', '.join(parts)}")
+    return lines
+
+
+def _dump_buckets() -> list[list]:
+    return [
+        [kind, scope, chat_id, user_id, tokens, monotonic_to_wall(updated_at), warned]
+        for (kind, scope, chat_id, user_id), (tokens, updated_at, warned) in _buckets.items()
+    ]
+
+
+def _restore_buckets(value: list[list]) -> None:
+    for kind, scope, chat_id, user_id, tokens, updated_at, warned in value:
+        _buckets[(str(kind), str(scope), int(chat_id), int(user_id))] = (
+            float(tokens),
+            wall_to_monotonic(float(updated_at)),
+            bool(warned),
+        )
+
+
+register_state("rate_limit_buckets", _dump_buckets, _restore_buckets)
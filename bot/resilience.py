@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Hashable
+import random
+from time import monotonic
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, *, failure_threshold: int = 3, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = BREAKER_CLOSED
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == BREAKER_OPEN and monotonic() - self._opened_at >= self.reset_timeout:
+            return BREAKER_HALF_OPEN
+        return self._state
+
+    def is_available(self) -> bool:
+        state = self.state
+        if state == BREAKER_CLOSED:
+            return True
+        return state == BREAKER_HALF_OPEN and not self._probe_in_flight
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == BREAKER_CLOSED:
+            return True
+        if state == BREAKER_OPEN or self._probe_in_flight:
+            return False
+        # Half-open: let exactly one probe through and keep the rest on the
+        # fast path until it reports back.
+        self._state = BREAKER_HALF_OPEN
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probe_in_flight = False
+        self._state = BREAKER_CLOSED
+
+    def record_failure(self) -> None:
+        self._probe_in_flight = False
+        if self._state == BREAKER_HALF_OPEN:
+            self._trip()
+            return
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._trip()
+
+    def release_probe(self) -> None:
+        if self._probe_in_flight:
+            self._probe_in_flight = False
+            self._state = BREAKER_OPEN
+
+    def reset(self) -> None:
+        self.record_success()
+
+    def _trip(self) -> None:
+        self._state = BREAKER_OPEN
+        self._opened_at = monotonic()
+        self._failures = 0
+
+
+class NegativeCache:
+    # Remembers recent failed lookups so callers can answer "nothing there"
+    # without asking the upstream again until the entry expires.
+    def __init__(self, *, ttl: float, max_size: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires: dict[Hashable, float] = {}
+
+    def contains(self, key: Hashable) -> bool:
+        expires = self._expires.get(key)
+        if expires is None:
+            return False
+        if monotonic() >= expires:
+            del self._expires[key]
+            return False
+        return True
+
+    def remember(self, key: Hashable) -> None:
+        now = monotonic()
+        if len(self._expires) >= self.max_size:
+            for stale_key, expires in list(self._expires.items()):
+                if expires <= now:
+                    del self._expires[stale_key]
+            while len(self._expires) >= self.max_size:
+                del self._expires[next(iter(self._expires))]
+        self._expires.pop(key, None)
+        self._expires[key] = now + self.ttl
+
+    def forget(self, key: Hashable) -> None:
+        self._expires.pop(key, None)
+
+
+def backoff_delay(attempt: int, *, base: float, cap: float) -> float:
+    # Equal jitter: at least half of the exponential step so retries never
+    # fire back to back, the rest random so callers do not retry in sync.
+    step = min(cap, base * 2**attempt)
+    return step / 2 + random.uniform(0.0, step / 2)
+
+
+class LatencyTracker:
+    def __init__(self, *, alpha: float = 0.2, window: int = 50) -> None:
+        self.alpha = alpha
+        self._samples: deque[float] = deque(maxlen=window)
+        self._ewma: float | None = None
+
+    @property
+    def count(self) -> int:
+        return len(self._samples)
+
+    @property
+    def ewma(self) -> float | None:
+        return self._ewma
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        if self._ewma is None:
+            self._ewma = seconds
+        else:
+            self._ewma += self.alpha * (seconds - self._ewma)
+
+    def percentile(self, fraction: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+        return ordered[index]
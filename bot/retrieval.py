@@ -0,0 +1,352 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import logging
+import re
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, retrieval stays off without it
+    np = None
+
+from bot.ai_service import post_ollama
+from bot.config import get_runtime_config
+from bot.metrics import record_cache
+from bot.storage import (
+    AIMessage,
+    delete_stale_ai_message_embeddings,
+    get_ai_message_embeddings,
+    get_ai_messages_after,
+    get_ai_messages_by_ids,
+    get_last_embedded_ai_message_id,
+    save_ai_message_embeddings,
+)
+
+logger = logging.getLogger(__name__)
+STUB_EMBED_MODEL = "stub"
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_EMBED_BATCH_SIZE = 64
+_EMBED_TIMEOUT_SECONDS = 60
+_QUERY_TIMEOUT_SECONDS = 1.5
+_INDEX_IDLE_SECONDS = 5.0
+_PRUNE_EVERY_BATCHES = 200
+# Only the recent window of a chat is searched, and only the busiest chats
+# keep their index in memory: about 10 MB per chat at the default dim.
+_INDEX_MAX_ROWS = 10_000
+_MAX_CACHED_INDEXES = 8
+_PROJECTION_SEED = 20240611
+_MIN_SCORE = 0.2
+
+
+@dataclass(frozen=True)
+class RetrievedContext:
+    history: list[dict[str, str]]
+    style_examples: list[str]
+
+
+class ChatVectorIndex:
+    def __init__(self, dim: int, capacity: int = 1024, max_rows: int = _INDEX_MAX_ROWS) -> None:
+        self.dim = dim
+        self.max_rows = max_rows
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.user_codes = np.zeros(capacity, dtype=np.int32)
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._user_codes: dict[str, int] = {}
+
+    def user_code(self, username: str) -> int:
+        key = username.casefold()
+        code = self._user_codes.get(key)
+        if code is None:
+            code = len(self._user_codes) + 1
+            self._user_codes[key] = code
+        return code
+
+    def add(self, message_ids: list[int], usernames: list[str], vectors: np.ndarray) -> None:
+        if self.size:
+            # Rows the index already holds can arrive again while it loads.
+            newest = int(self.ids[self.size - 1])
+            keep = [position for position, message_id in enumerate(message_ids) if message_id > newest]
+            if len(keep) < len(message_ids):
+                message_ids = [message_ids[position] for position in keep]
+                usernames = [usernames[position] for position in keep]
+                vectors = vectors[keep]
+        count = len(message_ids)
+        if not count:
+            return
+        self._reserve(self.size + count)
+        end = self.size + count
+        self.ids[self.size:end] = message_ids
+        self.user_codes[self.size:end] = [self.user_code(name) for name in usernames]
+        self.vectors[self.size:end] = vectors
+        self.size = end
+        if self.size > self.max_rows:
+            self.drop_before(int(self.ids[self.size - self.max_rows]))
+
+    def drop_before(self, min_id: int) -> None:
+        cut = int(np.searchsorted(self.ids[: self.size], min_id))
+        if cut <= 0:
+            return
+        remaining = self.size - cut
+        self.ids[:remaining] = self.ids[cut : self.size]
+        self.user_codes[:remaining] = self.user_codes[cut : self.size]
+        self.vectors[:remaining] = self.vectors[cut : self.size]
+        self.size = remaining
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        return self.vectors[: self.size] @ query
+
+    def top_k(self, scores: np.ndarray, k: int, username: str | None = None) -> list[tuple[int, float]]:
+        if self.size == 0 or k <= 0:
+            return []
+        if username is not None:
+            code = self._user_codes.get(username.casefold())
+            if code is None:
+                return []
+            scores = np.where(self.user_codes[: self.size] == code, scores, -np.inf)
+        k = min(k, self.size)
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [
+            (int(self.ids[index]), float(scores[index]))
+            for index in top
+            if np.isfinite(scores[index]) and scores[index] >= _MIN_SCORE
+        ]
+
+    def _reserve(self, needed: int) -> None:
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self.ids = np.resize(self.ids, capacity)
+        self.user_codes = np.resize(self.user_codes, capacity)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[: self.size] = self.vectors[: self.size]
+        self.vectors = vectors
+
+
+# Least recently queried first; a chat pushed out is rebuilt on its next query.
+_indexes: OrderedDict[int, ChatVectorIndex] = OrderedDict()
+_index_loads: dict[int, asyncio.Task[ChatVectorIndex]] = {}
+# Batches embedded while a chat's index is being read from the database.
+_pending_batches: dict[int, list[tuple[list[int], list[str], np.ndarray]]] = {}
+_projections: dict[int, np.ndarray] = {}
+_warned_missing_numpy = False
+
+
+def get_ai_retrieval_enabled() -> bool:
+    global _warned_missing_numpy
+    if not get_runtime_config().ai_retrieval:
+        return False
+    if np is None:
+        if not _warned_missing_numpy:
+            logger.warning("AI_RETRIEVAL is on but numpy is not installed, retrieval is disabled")
+            _warned_missing_numpy = True
+        return False
+    return True
+
+
+def get_ai_embed_model() -> str:
+    return get_runtime_config().ai_embed_model or STUB_EMBED_MODEL
+
+
+def get_ai_retrieval_dim() -> int:
+    return get_runtime_config().ai_retrieval_dim
+
+
+def _stub_embeddings(texts: list[str], dim: int) -> np.ndarray:
+    # Signed feature hashing of words and bigrams: no model needed, good
+    # enough for keyword-level similarity and for offline runs.
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = _WORD_PATTERN.findall(text.casefold())
+        for feature in (*words, *(f"{left} {right}" for left, right in zip(words, words[1:]))):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vectors[row, value % dim] += 1.0 if value & (1 << 63) else -1.0
+    return vectors
+
+
+def _project(vectors: np.ndarray, dim: int) -> np.ndarray:
+    source_dim = vectors.shape[1]
+    if source_dim == dim:
+        return vectors
+    projection = _projections.get(source_dim)
+    if projection is None or projection.shape[1] != dim:
+        # Fixed Gaussian random projection: keeps cosine similarity roughly
+        # intact while shrinking the matrix scanned on every query.
+        generator = np.random.default_rng(_PROJECTION_SEED)
+        projection = generator.standard_normal((source_dim, dim)).astype(np.float32) / np.sqrt(dim)
+        _projections[source_dim] = projection
+    return vectors @ projection
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+async def embed_texts(texts: list[str], timeout_seconds: float = _EMBED_TIMEOUT_SECONDS) -> np.ndarray | None:
+    dim = get_ai_retrieval_dim()
+    model = get_ai_embed_model()
+    if model == STUB_EMBED_MODEL:
+        return _normalize(_stub_embeddings(texts, dim))
+
+    data = await post_ollama("/api/embed", {"model": model, "input": texts}, timeout_seconds, embed=True)
+    embeddings = (data or {}).get("embeddings")
+    if not isinstance(embeddings, list) or len(embeddings) != len(texts):
+        return None
+    try:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+    except ValueError:
+        return None
+    return _normalize(_project(vectors, dim))
+
+
+def _build_index(chat_id: int, model: str, dim: int) -> ChatVectorIndex:
+    rows = [row for row in get_ai_message_embeddings(chat_id, model, _INDEX_MAX_ROWS) if len(row[2]) == dim * 4]
+    index = ChatVectorIndex(dim, capacity=max(1024, len(rows)))
+    if rows:
+        vectors = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.float32).reshape(len(rows), dim)
+        index.add([row[0] for row in rows], [row[1] for row in rows], vectors)
+    return index
+
+
+async def _load_index_in_thread(chat_id: int) -> ChatVectorIndex:
+    _pending_batches[chat_id] = []
+    try:
+        index = await asyncio.to_thread(_build_index, chat_id, get_ai_embed_model(), get_ai_retrieval_dim())
+        for message_ids, usernames, vectors in _pending_batches[chat_id]:
+            index.add(message_ids, usernames, vectors)
+    finally:
+        _pending_batches.pop(chat_id, None)
+        _index_loads.pop(chat_id, None)
+    _indexes[chat_id] = index
+    while len(_indexes) > _MAX_CACHED_INDEXES:
+        _indexes.popitem(last=False)
+    return index
+
+
+async def _load_index(chat_id: int) -> ChatVectorIndex:
+    index = _indexes.get(chat_id)
+    record_cache("vector_index", index is not None)
+    if index is not None:
+        _indexes.move_to_end(chat_id)
+        return index
+
+    # Concurrent queries for the same chat share one load, and a caller
+    # that gives up does not cancel it for the others.
+    load = _index_loads.get(chat_id)
+    if load is None:
+        load = asyncio.create_task(_load_index_in_thread(chat_id))
+        _index_loads[chat_id] = load
+    return await asyncio.shield(load)
+
+
+async def _index_batch(messages: list[AIMessage]) -> bool:
+    vectors = await embed_texts([message.text for message in messages])
+    if vectors is None:
+        return False
+
+    model = get_ai_embed_model()
+    save_ai_message_embeddings(
+        model,
+        [
+            (message.id, message.chat_id, message.username, vector.tobytes())
+            for message, vector in zip(messages, vectors)
+        ],
+    )
+    by_chat: dict[int, list[int]] = {}
+    for position, message in enumerate(messages):
+        by_chat.setdefault(message.chat_id, []).append(position)
+    for chat_id, positions in by_chat.items():
+        batch = (
+            [messages[position].id for position in positions],
+            [messages[position].username for position in positions],
+            vectors[positions],
+        )
+        index = _indexes.get(chat_id)
+        if index is not None:
+            index.add(*batch)
+        elif chat_id in _pending_batches:
+            _pending_batches[chat_id].append(batch)
+    return True
+
+
+async def run_embedding_indexer() -> None:
+    last_id: int | None = None
+    batches = 0
+    while True:
+        if not get_ai_retrieval_enabled():
+            await asyncio.sleep(_INDEX_IDLE_SECONDS * 6)
+            continue
+        if last_id is None:
+            last_id = get_last_embedded_ai_message_id(get_ai_embed_model())
+
+        messages = get_ai_messages_after(last_id, _EMBED_BATCH_SIZE)
+        if not messages:
+            await asyncio.sleep(_INDEX_IDLE_SECONDS)
+            continue
+        try:
+            indexed = await _index_batch(messages)
+        except Exception:
+            logger.exception("Failed to embed ai messages")
+            indexed = False
+        if not indexed:
+            await asyncio.sleep(_INDEX_IDLE_SECONDS * 6)
+            continue
+
+        last_id = messages[-1].id
+        batches += 1
+        if batches % _PRUNE_EVERY_BATCHES == 0:
+            delete_stale_ai_message_embeddings()
+            oldest = get_ai_messages_after(0, 1)
+            for index in _indexes.values():
+                index.drop_before(oldest[0].id if oldest else last_id + 1)
+        # Yield between batches so indexing never starves message handling.
+        await asyncio.sleep(0)
+
+
+async def retrieve_context(
+    chat_id: int,
+    query: str,
+    style_username: str,
+    *,
+    history_limit: int = 4,
+    style_limit: int = 3,
+) -> RetrievedContext | None:
+    if not get_ai_retrieval_enabled() or not query.strip():
+        return None
+
+    index = await _load_index(chat_id)
+    if index.size == 0:
+        return None
+    vectors = await embed_texts([query], timeout_seconds=_QUERY_TIMEOUT_SECONDS)
+    if vectors is None:
+        return None
+
+    # One matrix-vector product serves both the chat-wide and the style-user
+    # lookups.
+    scores = index.scores(vectors[0])
+    history_hits = index.top_k(scores, history_limit)
+    style_hits = index.top_k(scores, style_limit, username=style_username)
+    messages = {
+        message.id: message
+        for message in get_ai_messages_by_ids(sorted({message_id for message_id, _ in history_hits + style_hits}))
+    }
+    history = [
+        {
+            "user_id": str(messages[message_id].user_id),
+            "username": messages[message_id].username,
+            "text": messages[message_id].text,
+            "sent_at": str(messages[message_id].sent_at),
+        }
+        for message_id in sorted(message_id for message_id, _ in history_hits if message_id in messages)
+    ]
+    style_examples = [messages[message_id].text for message_id, _ in style_hits if message_id in messages]
+    return RetrievedContext(history=history, style_examples=style_examples)
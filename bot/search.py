@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+
+from bot.storage import AIMessage, prune_ai_messages, search_ai_messages, sync_ai_messages_fts
+
+logger = logging.getLogger(__name__)
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_MIN_TERM_LENGTH = 3
+_MAX_TERMS = 8
+_SYNC_BATCH_SIZE = 500
+_SYNC_IDLE_SECONDS = 2.0
+_PRUNE_INTERVAL_SECONDS = 10 * 60
+
+
+def extract_search_terms(text: str) -> list[str]:
+    terms: list[str] = []
+    for word in _WORD_PATTERN.findall(text.casefold()):
+        if len(word) < _MIN_TERM_LENGTH or word.isdigit() or word in terms:
+            continue
+        terms.append(word)
+        if len(terms) >= _MAX_TERMS:
+            break
+    return terms
+
+
+def search_chat_messages(chat_id: int, query: str, username: str | None = None, limit: int = 10) -> list[AIMessage]:
+    terms = extract_search_terms(query)
+    if not terms:
+        return []
+    return search_ai_messages(chat_id, terms, username=username, limit=limit)
+
+
+def find_keyword_style_examples(chat_id: int, prompt: str, style_username: str, limit: int = 2) -> list[str]:
+    return [
+        message.text
+        for message in search_chat_messages(chat_id, prompt, username=style_username, limit=limit)
+    ]
+
+
+async def run_search_index_sync() -> None:
+    loop = asyncio.get_running_loop()
+    next_prune_at = loop.time()
+    while True:
+        try:
+            indexed = sync_ai_messages_fts(_SYNC_BATCH_SIZE)
+            if loop.time() >= next_prune_at:
+                # The expired batches are deleted in a worker thread so a
+                # large prune never blocks the handlers.
+                await asyncio.to_thread(prune_ai_messages)
+                next_prune_at = loop.time() + _PRUNE_INTERVAL_SECONDS
+        except Exception:
+            logger.exception("Failed to sync the message search index")
+            indexed = 0
+        # A full batch means a backlog (first start, bursts): keep going, but
+        # yield to the handlers between batches.
+        await asyncio.sleep(0 if indexed >= _SYNC_BATCH_SIZE else _SYNC_IDLE_SECONDS)
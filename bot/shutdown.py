@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from bot.catch_up import flush_update_cursor, get_in_flight_updates
+from bot.config import get_runtime_config
+from bot.load_shedding import flush_ingest_buffer
+from bot.state_snapshot import register_state, save_state_snapshot
+from bot.style_profile import refresh_style_profiles
+
+logger = logging.getLogger(__name__)
+
+_interrupted_updates: list[dict[str, Any]] = []
+_resumed_updates: list[dict[str, Any]] = []
+
+
+def get_shutdown_drain_seconds() -> float:
+    return get_runtime_config().shutdown_drain_seconds
+
+
+def _dump_interrupted_updates() -> list[dict[str, Any]]:
+    return list(_interrupted_updates)
+
+
+def _restore_interrupted_updates(value: list[dict[str, Any]]) -> None:
+    _resumed_updates.extend(value)
+
+
+register_state("interrupted_updates", _dump_interrupted_updates, _restore_interrupted_updates)
+
+
+async def drain_updates(timeout: float) -> list[Update]:
+    current = asyncio.current_task()
+    tasks = {
+        task: update
+        for update, task in get_in_flight_updates()
+        if task is not None and task is not current and not task.done()
+    }
+    if not tasks:
+        return []
+
+    logger.info("Waiting up to %.0fs for %s in-flight updates", timeout, len(tasks))
+    _, pending = await asyncio.wait(tasks, timeout=timeout) if timeout > 0 else (set(), set(tasks))
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if pending:
+        logger.warning("Cancelled %s updates still running at the shutdown deadline", len(pending))
+    return [tasks[task] for task in pending]
+
+
+async def graceful_shutdown() -> None:
+    # Runs after polling has stopped taking updates and before the bot
+    # session closes, so finishing handlers can still reply. This is the only
+    # place state is persisted on exit: drain first, then buffered messages,
+    # the style profiles they feed, the cursor and finally the snapshot.
+    interrupted = await drain_updates(get_shutdown_drain_seconds())
+    _interrupted_updates[:] = [
+        update.model_dump(mode="json", exclude_none=True, by_alias=True) for update in interrupted
+    ]
+    for step in (flush_ingest_buffer, refresh_style_profiles, flush_update_cursor, save_state_snapshot):
+        try:
+            step()
+        except Exception:
+            logger.exception("Shutdown step %s failed", step.__name__)
+
+
+async def resume_interrupted_updates(dp: Dispatcher, bot: Bot) -> None:
+    updates = [Update.model_validate(item) for item in _resumed_updates]
+    _resumed_updates.clear()
+    if not updates:
+        return
+
+    logger.info("Resuming %s updates cut off by the last shutdown", len(updates))
+    results = await asyncio.gather(
+        *(dp.feed_update(bot, update, resumed=True) for update in updates),
+        return_exceptions=True,
+    )
+    for update, result in zip(updates, results):
+        if isinstance(result, Exception):
+            logger.error("Resumed update %s failed", update.update_id, exc_info=result)
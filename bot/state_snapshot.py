@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+import json
+import logging
+from time import monotonic, time
+from typing import Any
+
+from bot.storage import delete_bot_state, get_bot_state, set_bot_state
+
+logger = logging.getLogger(__name__)
+_SNAPSHOT_STATE_KEY = "state_snapshot"
+# Cooldowns and counters are meaningless after a long outage.
+_SNAPSHOT_MAX_AGE_SECONDS = 60 * 60
+
+_providers: dict[str, tuple[Callable[[], Any], Callable[[Any], None]]] = {}
+
+
+def register_state(name: str, dump: Callable[[], Any], restore: Callable[[Any], None]) -> None:
+    _providers[name] = (dump, restore)
+
+
+def monotonic_to_wall(value: float) -> float:
+    return time() - (monotonic() - value)
+
+
+def wall_to_monotonic(value: float) -> float:
+    return monotonic() - (time() - value)
+
+
+def save_state_snapshot() -> None:
+    state: dict[str, Any] = {}
+    for name, (dump, _) in _providers.items():
+        try:
+            state[name] = dump()
+        except Exception:
+            logger.exception("Failed to snapshot state %s", name)
+    set_bot_state(_SNAPSHOT_STATE_KEY, json.dumps({"saved_at": time(), "state": state}, ensure_ascii=False))
+    logger.info("Saved state snapshot: %s", ", ".join(sorted(state)) or "empty")
+
+
+def restore_state_snapshot() -> None:
+    raw = get_bot_state(_SNAPSHOT_STATE_KEY)
+    if not raw:
+        return
+    # Consumed once, so a later crash never brings back an older snapshot.
+    delete_bot_state(_SNAPSHOT_STATE_KEY)
+    try:
+        snapshot = json.loads(raw)
+    except ValueError:
+        logger.warning("Ignoring unreadable state snapshot")
+        return
+    age = time() - float(snapshot.get("saved_at") or 0)
+    if age > _SNAPSHOT_MAX_AGE_SECONDS:
+        logger.info("Ignoring state snapshot saved %.0fs ago", age)
+        return
+
+    for name, value in (snapshot.get("state") or {}).items():
+        provider = _providers.get(name)
+        if provider is None:
+            continue
+        try:
+            provider[1](value)
+        except Exception:
+            logger.exception("Failed to restore state %s", name)
+    logger.info("Restored state snapshot from %.1fs ago", age)
@@ -1,13 +1,23 @@
 ﻿from __future__ import annotations
 
+from contextlib import contextmanager
+import logging
 import sqlite3
+import sys
 from dataclasses import dataclass
 from pathlib import Path
-from time import time
+from time import perf_counter, time
+from typing import Callable, Iterator
 from uuid import uuid4
 
+from bot.metrics import observe_storage_query
+
 _MEM_HISTORY_RETENTION_SECONDS = 45 * 24 * 60 * 60
 _AI_HISTORY_RETENTION_SECONDS = 30 * 24 * 60 * 60
+_AI_FTS_WATERMARK_KEY = "ai_messages_fts_last_id"
+_AI_FTS_CANDIDATES = 500
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass(frozen=True)
@@ -27,7 +37,44 @@ class AIGroupSettings:
     ai_style_username: str
 
 
+@dataclass(frozen=True)
+class AIMessage:
+    id: int
+    chat_id: int
+    user_id: int
+    username: str
+    text: str
+    sent_at: int
+
+
+@dataclass(frozen=True)
+class AIChatSummary:
+    chat_id: int
+    summary: str
+    last_message_id: int
+    updated_at: int
+
+
+@dataclass(frozen=True)
+class TriggerRateLimit:
+    chat_id: int
+    kind: str
+    scope: str
+    capacity: int
+    per_seconds: float
+
+
+@dataclass(frozen=True)
+class CustomTrigger:
+    id: int
+    chat_id: int
+    match_type: str
+    pattern: str
+    reply: str
+
+
 _db_path = Path("bot.db")
+_ai_message_listeners: list[Callable[[AIMessage], None]] = []
 
 
 def init_storage(db_path: str) -> None:
@@ -37,6 +84,14 @@ def init_storage(db_path: str) -> None:
         _db_path.parent.mkdir(parents=True, exist_ok=True)
 
     with _connect() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+            """
+        )
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS groups (
@@ -110,6 +165,99 @@ def init_storage(db_path: str) -> None:
             ON ai_messages(chat_id, username, sent_at)
             """
         )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_ai_messages_sent_at
+            ON ai_messages(sent_at)
+            """
+        )
+        # External-content FTS index over ai_messages. The chat id is indexed
+        # as a token ("c123", "cn100..." for negative ids) so a chat filter is
+        # part of the MATCH instead of a post-filter over every hit.
+        conn.execute(
+            """
+            CREATE VIEW IF NOT EXISTS ai_messages_fts_source AS
+            SELECT
+                id,
+                'c' || replace(CAST(chat_id AS TEXT), '-', 'n') AS chat_key,
+                text
+            FROM ai_messages
+            """
+        )
+        conn.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS ai_messages_fts USING fts5(
+                chat_key,
+                text,
+                content='ai_messages_fts_source',
+                content_rowid='id'
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ai_message_embeddings (
+                message_id INTEGER PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                username TEXT NOT NULL DEFAULT '',
+                vector BLOB NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_ai_message_embeddings_chat_model
+            ON ai_message_embeddings(chat_id, model, message_id)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ai_style_profiles (
+                chat_id INTEGER NOT NULL,
+                username TEXT NOT NULL,
+                profile TEXT NOT NULL,
+                updated_at INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, username)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ai_chat_summaries (
+                chat_id INTEGER PRIMARY KEY,
+                summary TEXT NOT NULL,
+                last_message_id INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS trigger_rate_limits (
+                chat_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                capacity INTEGER NOT NULL,
+                per_seconds REAL NOT NULL,
+                PRIMARY KEY (chat_id, kind, scope)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS custom_triggers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                match_type TEXT NOT NULL,
+                pattern TEXT NOT NULL,
+                reply TEXT NOT NULL,
+                created_by INTEGER NOT NULL,
+                created_at INTEGER NOT NULL,
+                UNIQUE (chat_id, match_type, pattern)
+            )
+            """
+        )
 
 
 def ensure_group(chat_id: int, title: str = "") -> GroupSettings:
@@ -297,21 +445,71 @@ def add_ai_message(
         return
 
     timestamp = int(sent_at if sent_at is not None else time())
+    clean_username = (username or "").strip()
     with _connect() as conn:
-        conn.execute(
+        cursor = conn.execute(
             """
             INSERT INTO ai_messages (chat_id, user_id, username, text, sent_at)
             VALUES (?, ?, ?, ?, ?)
             """,
-            (chat_id, user_id, (username or "").strip(), payload, timestamp),
+            (chat_id, user_id, clean_username, payload, timestamp),
         )
-        conn.execute(
-            """
-            DELETE FROM ai_messages
-            WHERE sent_at < ?
-            """,
-            (timestamp - _AI_HISTORY_RETENTION_SECONDS,),
+        message_id = int(cursor.lastrowid or 0)
+
+    _notify_ai_message_listeners(
+        AIMessage(
+            id=message_id,
+            chat_id=chat_id,
+            user_id=user_id,
+            username=clean_username,
+            text=payload,
+            sent_at=timestamp,
         )
+    )
+
+
+def add_ai_messages(rows: list[tuple[int, int, str, str, int]]) -> None:
+    # One transaction for a whole buffered batch instead of one per message.
+    messages: list[AIMessage] = []
+    with _connect() as conn:
+        for chat_id, user_id, username, text, sent_at in rows:
+            payload = text.strip()
+            if not payload:
+                continue
+            clean_username = (username or "").strip()
+            cursor = conn.execute(
+                """
+                INSERT INTO ai_messages (chat_id, user_id, username, text, sent_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (chat_id, user_id, clean_username, payload, int(sent_at)),
+            )
+            messages.append(
+                AIMessage(
+                    id=int(cursor.lastrowid or 0),
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    username=clean_username,
+                    text=payload,
+                    sent_at=int(sent_at),
+                )
+            )
+
+    for message in messages:
+        _notify_ai_message_listeners(message)
+
+
+def add_ai_message_listener(listener: Callable[[AIMessage], None]) -> None:
+    if listener not in _ai_message_listeners:
+        _ai_message_listeners.append(listener)
+
+
+def _notify_ai_message_listeners(message: AIMessage) -> None:
+    for listener in _ai_message_listeners:
+        try:
+            listener(message)
+        except Exception:
+            logger.exception("AI message listener failed: %r", listener)
 
 
 def get_recent_ai_messages(chat_id: int, limit: int = 30) -> list[dict[str, str]]:
@@ -363,6 +561,486 @@ def get_recent_ai_messages_by_username(chat_id: int, username: str, limit: int =
     return [str(row["text"] or "") for row in reversed(rows) if str(row["text"] or "").strip()]
 
 
+def get_ai_message_texts_by_username(chat_id: int, username: str, limit: int = 2000) -> list[str]:
+    cleaned = username.strip().lstrip("@")
+    if not cleaned:
+        return []
+
+    with _connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT text
+            FROM ai_messages
+            WHERE chat_id = ?
+              AND lower(username) = lower(?)
+            ORDER BY id DESC
+            LIMIT ?
+            """,
+            (chat_id, cleaned, max(1, limit)),
+        ).fetchall()
+
+    return [str(row[0] or "") for row in reversed(rows)]
+
+
+def get_ai_message_corpus(chat_id: int, limit: int = 5000) -> list[tuple[str, str]]:
+    with _connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT username, text
+            FROM ai_messages
+            WHERE chat_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+            """,
+            (chat_id, max(1, limit)),
+        ).fetchall()
+
+    return [(str(row[0] or ""), str(row[1] or "")) for row in reversed(rows)]
+
+
+def get_ai_messages_after(after_id: int, limit: int = 64) -> list[AIMessage]:
+    with _connect(row_factory=True) as conn:
+        rows = conn.execute(
+            """
+            SELECT id, chat_id, user_id, username, text, sent_at
+            FROM ai_messages
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (after_id, max(1, limit)),
+        ).fetchall()
+    return [_row_to_ai_message(row) for row in rows]
+
+
+def get_ai_chat_messages_after(
+    chat_id: int,
+    after_id: int,
+    limit: int = 64,
+    newest: bool = True,
+) -> list[AIMessage]:
+    # The newest (or the oldest) `limit` messages after `after_id`, oldest
+    # first either way.
+    order = "DESC" if newest else "ASC"
+    with _connect(row_factory=True) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, chat_id, user_id, username, text, sent_at
+            FROM ai_messages
+            WHERE chat_id = ?
+              AND id > ?
+            ORDER BY id {order}
+            LIMIT ?
+            """,
+            (chat_id, after_id, max(1, limit)),
+        ).fetchall()
+    if newest:
+        rows.reverse()
+    return [_row_to_ai_message(row) for row in rows]
+
+
+def get_ai_chats_pending_summary(min_new_messages: int, window: int = 5000, limit: int = 20) -> list[int]:
+    with _connect() as conn:
+        max_id = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM ai_messages").fetchone()[0])
+        # Only the newest `window` rows are scanned: chats quiet for longer
+        # than that have nothing worth summarizing anyway.
+        rows = conn.execute(
+            """
+            SELECT m.chat_id
+            FROM ai_messages AS m
+            LEFT JOIN ai_chat_summaries AS s ON s.chat_id = m.chat_id
+            WHERE m.id > ?
+              AND m.id > COALESCE(s.last_message_id, 0)
+            GROUP BY m.chat_id
+            HAVING COUNT(*) >= ?
+            ORDER BY COUNT(*) DESC
+            LIMIT ?
+            """,
+            (max_id - max(1, window), max(1, min_new_messages), max(1, limit)),
+        ).fetchall()
+    return [int(row[0]) for row in rows]
+
+
+def get_ai_chat_summary(chat_id: int) -> AIChatSummary | None:
+    with _connect(row_factory=True) as conn:
+        row = conn.execute(
+            """
+            SELECT chat_id, summary, last_message_id, updated_at
+            FROM ai_chat_summaries
+            WHERE chat_id = ?
+            """,
+            (chat_id,),
+        ).fetchone()
+    if not row:
+        return None
+    return AIChatSummary(
+        chat_id=int(row["chat_id"]),
+        summary=str(row["summary"] or ""),
+        last_message_id=int(row["last_message_id"]),
+        updated_at=int(row["updated_at"]),
+    )
+
+
+def save_ai_chat_summary(chat_id: int, summary: str, last_message_id: int) -> AIChatSummary:
+    now = int(time())
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO ai_chat_summaries (chat_id, summary, last_message_id, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                summary = excluded.summary,
+                last_message_id = excluded.last_message_id,
+                updated_at = excluded.updated_at
+            """,
+            (chat_id, summary, last_message_id, now),
+        )
+    return AIChatSummary(chat_id=chat_id, summary=summary, last_message_id=last_message_id, updated_at=now)
+
+
+def get_ai_messages_by_ids(message_ids: list[int]) -> list[AIMessage]:
+    if not message_ids:
+        return []
+
+    placeholders = ", ".join("?" for _ in message_ids)
+    with _connect(row_factory=True) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, chat_id, user_id, username, text, sent_at
+            FROM ai_messages
+            WHERE id IN ({placeholders})
+            """,
+            message_ids,
+        ).fetchall()
+    return [_row_to_ai_message(row) for row in rows]
+
+
+def get_last_embedded_ai_message_id(model: str) -> int:
+    with _connect() as conn:
+        row = conn.execute(
+            """
+            SELECT MAX(message_id)
+            FROM ai_message_embeddings
+            WHERE model = ?
+            """,
+            (model,),
+        ).fetchone()
+    return int(row[0] or 0) if row else 0
+
+
+def save_ai_message_embeddings(model: str, rows: list[tuple[int, int, str, bytes]]) -> None:
+    if not rows:
+        return
+
+    with _connect() as conn:
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO ai_message_embeddings (message_id, chat_id, model, username, vector)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(message_id, chat_id, model, username, vector) for message_id, chat_id, username, vector in rows],
+        )
+
+
+def get_ai_message_embeddings(chat_id: int, model: str, limit: int) -> list[tuple[int, str, bytes]]:
+    with _connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT message_id, username, vector
+            FROM ai_message_embeddings
+            WHERE chat_id = ?
+              AND model = ?
+            ORDER BY message_id DESC
+            LIMIT ?
+            """,
+            (chat_id, model, limit),
+        ).fetchall()
+    rows.reverse()
+    return [(int(row[0]), str(row[1] or ""), bytes(row[2])) for row in rows]
+
+
+def delete_stale_ai_message_embeddings() -> int:
+    with _connect() as conn:
+        cursor = conn.execute(
+            """
+            DELETE FROM ai_message_embeddings
+            WHERE message_id < (SELECT COALESCE(MIN(id), 0) FROM ai_messages)
+            """
+        )
+    return cursor.rowcount
+
+
+def get_trigger_rate_limits(chat_id: int) -> list[TriggerRateLimit]:
+    with _connect(row_factory=True) as conn:
+        rows = conn.execute(
+            """
+            SELECT chat_id, kind, scope, capacity, per_seconds
+            FROM trigger_rate_limits
+            WHERE chat_id = ?
+            ORDER BY kind, scope
+            """,
+            (chat_id,),
+        ).fetchall()
+
+    return [
+        TriggerRateLimit(
+            chat_id=int(row["chat_id"]),
+            kind=str(row["kind"]),
+            scope=str(row["scope"]),
+            capacity=int(row["capacity"]),
+            per_seconds=float(row["per_seconds"]),
+        )
+        for row in rows
+    ]
+
+
+def set_trigger_rate_limit(chat_id: int, kind: str, scope: str, capacity: int, per_seconds: float) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO trigger_rate_limits (chat_id, kind, scope, capacity, per_seconds)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id, kind, scope) DO UPDATE SET
+                capacity = excluded.capacity,
+                per_seconds = excluded.per_seconds
+            """,
+            (chat_id, kind, scope, capacity, per_seconds),
+        )
+
+
+def delete_trigger_rate_limit(chat_id: int, kind: str, scope: str) -> bool:
+    with _connect() as conn:
+        cursor = conn.execute(
+            "DELETE FROM trigger_rate_limits WHERE chat_id = ? AND kind = ? AND scope = ?",
+            (chat_id, kind, scope),
+        )
+    return cursor.rowcount > 0
+
+
+def get_custom_triggers(chat_id: int) -> list[CustomTrigger]:
+    with _connect(row_factory=True) as conn:
+        rows = conn.execute(
+            """
+            SELECT id, chat_id, match_type, pattern, reply
+            FROM custom_triggers
+            WHERE chat_id = ?
+            ORDER BY id
+            """,
+            (chat_id,),
+        ).fetchall()
+
+    return [
+        CustomTrigger(
+            id=int(row["id"]),
+            chat_id=int(row["chat_id"]),
+            match_type=str(row["match_type"]),
+            pattern=str(row["pattern"]),
+            reply=str(row["reply"]),
+        )
+        for row in rows
+    ]
+
+
+def add_custom_trigger(chat_id: int, match_type: str, pattern: str, reply: str, created_by: int) -> int:
+    # Re-adding the same pattern replaces its reply and keeps the id.
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO custom_triggers (chat_id, match_type, pattern, reply, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id, match_type, pattern) DO UPDATE SET
+                reply = excluded.reply,
+                created_by = excluded.created_by,
+                created_at = excluded.created_at
+            """,
+            (chat_id, match_type, pattern, reply, created_by, int(time())),
+        )
+        row = conn.execute(
+            "SELECT id FROM custom_triggers WHERE chat_id = ? AND match_type = ? AND pattern = ?",
+            (chat_id, match_type, pattern),
+        ).fetchone()
+    return int(row[0])
+
+
+def delete_custom_trigger(chat_id: int, trigger_id: int) -> bool:
+    with _connect() as conn:
+        cursor = conn.execute(
+            "DELETE FROM custom_triggers WHERE chat_id = ? AND id = ?",
+            (chat_id, trigger_id),
+        )
+    return cursor.rowcount > 0
+
+
+def count_custom_triggers(chat_id: int) -> int:
+    with _connect() as conn:
+        row = conn.execute("SELECT COUNT(*) FROM custom_triggers WHERE chat_id = ?", (chat_id,)).fetchone()
+    return int(row[0])
+
+
+def get_bot_state(key: str) -> str | None:
+    with _connect() as conn:
+        row = conn.execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()
+    return str(row[0]) if row else None
+
+
+def set_bot_state(key: str, value: str) -> None:
+    with _connect() as conn:
+        _set_bot_state(conn, key, value)
+
+
+def delete_bot_state(key: str) -> None:
+    with _connect() as conn:
+        conn.execute("DELETE FROM bot_state WHERE key = ?", (key,))
+
+
+def _set_bot_state(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute(
+        """
+        INSERT INTO bot_state (key, value)
+        VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """,
+        (key, value),
+    )
+
+
+def _fts_chat_key(chat_id: int) -> str:
+    return f"c{chat_id}".replace("-", "n")
+
+
+def _fts_watermark(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM bot_state WHERE key = ?", (_AI_FTS_WATERMARK_KEY,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def sync_ai_messages_fts(batch_size: int = 500) -> int:
+    with _connect() as conn:
+        last_id = _fts_watermark(conn)
+        rows = conn.execute(
+            """
+            SELECT id, chat_key, text
+            FROM ai_messages_fts_source
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, max(1, batch_size)),
+        ).fetchall()
+        if not rows:
+            return 0
+        conn.executemany(
+            "INSERT INTO ai_messages_fts (rowid, chat_key, text) VALUES (?, ?, ?)",
+            rows,
+        )
+        _set_bot_state(conn, _AI_FTS_WATERMARK_KEY, str(rows[-1][0]))
+    return len(rows)
+
+
+def prune_ai_messages(now: int | None = None, batch_size: int = 1000) -> int:
+    cutoff = int(now if now is not None else time()) - _AI_HISTORY_RETENTION_SECONDS
+    deleted = 0
+    while True:
+        with _connect() as conn:
+            # The sent_at index limits the work to expired rows; without it
+            # a prune with nothing to delete scanned the whole table.
+            rows = conn.execute(
+                """
+                SELECT id, chat_key, text
+                FROM ai_messages_fts_source
+                WHERE id IN (
+                    SELECT id
+                    FROM ai_messages
+                    WHERE sent_at < ?
+                    ORDER BY sent_at
+                    LIMIT ?
+                )
+                """,
+                (cutoff, max(1, batch_size)),
+            ).fetchall()
+            if not rows:
+                return deleted
+
+            indexed_until = _fts_watermark(conn)
+            conn.executemany(
+                """
+                INSERT INTO ai_messages_fts (ai_messages_fts, rowid, chat_key, text)
+                VALUES ('delete', ?, ?, ?)
+                """,
+                [row for row in rows if row[0] <= indexed_until],
+            )
+            conn.executemany("DELETE FROM ai_messages WHERE id = ?", [(row[0],) for row in rows])
+        deleted += len(rows)
+        if len(rows) < batch_size:
+            return deleted
+
+
+def search_ai_messages(
+    chat_id: int,
+    terms: list[str],
+    username: str | None = None,
+    limit: int = 10,
+) -> list[AIMessage]:
+    quoted = [f'"{term.replace(chr(34), chr(34) * 2)}"*' for term in terms if term]
+    if not quoted:
+        return []
+
+    match = f"chat_key:{_fts_chat_key(chat_id)} AND text:({' OR '.join(quoted)})"
+    cleaned_username = (username or "").strip().lstrip("@")
+    with _connect(row_factory=True) as conn:
+        # Rank only the newest matches: walking the doclist by rowid stays
+        # cheap however large the history grows.
+        rows = conn.execute(
+            f"""
+            SELECT m.id, m.chat_id, m.user_id, m.username, m.text, m.sent_at
+            FROM (
+                SELECT rowid AS id, bm25(ai_messages_fts) AS score
+                FROM ai_messages_fts
+                WHERE ai_messages_fts MATCH ?
+                ORDER BY rowid DESC
+                LIMIT {_AI_FTS_CANDIDATES}
+            ) AS hits
+            JOIN ai_messages AS m ON m.id = hits.id
+            WHERE ? = '' OR lower(m.username) = lower(?)
+            ORDER BY hits.score
+            LIMIT ?
+            """,
+            (match, cleaned_username, cleaned_username, max(1, limit)),
+        ).fetchall()
+    return [_row_to_ai_message(row) for row in rows]
+
+
+def get_ai_style_profile(chat_id: int, username: str) -> str | None:
+    with _connect() as conn:
+        row = conn.execute(
+            """
+            SELECT profile
+            FROM ai_style_profiles
+            WHERE chat_id = ?
+              AND username = ?
+            """,
+            (chat_id, username),
+        ).fetchone()
+    return str(row[0]) if row else None
+
+
+def save_ai_style_profiles(profiles: list[tuple[int, str, str]]) -> None:
+    if not profiles:
+        return
+
+    now = int(time())
+    with _connect() as conn:
+        conn.executemany(
+            """
+            INSERT INTO ai_style_profiles (chat_id, username, profile, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id, username) DO UPDATE SET
+                profile = excluded.profile,
+                updated_at = excluded.updated_at
+            """,
+            [(chat_id, username, profile, now) for chat_id, username, profile in profiles],
+        )
+
+
 def ensure_anonymous_token(chat_id: int) -> str:
     settings = ensure_group(chat_id)
     if settings.anonymous_token:
@@ -426,11 +1104,32 @@ def add_meme_history(chat_id: int, video_id: str, sent_at: int | None = None) ->
         )
 
 
-def _connect(row_factory: bool = False) -> sqlite3.Connection:
+@contextmanager
+def _connect(row_factory: bool = False) -> Iterator[sqlite3.Connection]:
+    # Timed per calling storage function: frame 0 is this generator, 1 is
+    # contextmanager.__enter__, 2 is the caller.
+    operation = sys._getframe(2).f_code.co_name
+    started = perf_counter()
     conn = sqlite3.connect(_db_path)
     if row_factory:
         conn.row_factory = sqlite3.Row
-    return conn
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+        observe_storage_query(operation, perf_counter() - started)
+
+
+def _row_to_ai_message(row: sqlite3.Row) -> AIMessage:
+    return AIMessage(
+        id=int(row["id"]),
+        chat_id=int(row["chat_id"]),
+        user_id=int(row["user_id"]),
+        username=str(row["username"] or ""),
+        text=str(row["text"] or ""),
+        sent_at=int(row["sent_at"]),
+    )
 
 
 def _row_to_settings(row: sqlite3.Row) -> GroupSettings:
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+import json
+import logging
+from math import log
+from random import randrange
+import re
+
+from bot.metrics import record_cache
+from bot.storage import (
+    AIMessage,
+    add_ai_message_listener,
+    get_ai_group_settings,
+    get_ai_message_texts_by_username,
+    get_ai_style_profile,
+    save_ai_style_profiles,
+)
+
+logger = logging.getLogger(__name__)
+_DEFAULT_STYLE_USERNAME = "odeyalow"
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_LINK_PATTERN = re.compile(r"https?://|www\.|t\.me/", re.IGNORECASE)
+_MAX_TERMS = 400
+_SAMPLE_SIZE = 24
+_SNAPSHOT_EXAMPLES = 3
+_SNAPSHOT_WORDS = 12
+_SNAPSHOT_BIGRAMS = 6
+_EXAMPLE_MIN_WORDS = 2
+_EXAMPLE_MAX_WORDS = 25
+_BOOTSTRAP_MESSAGES = 2000
+_REFRESH_INTERVAL_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class StyleSnapshot:
+    username: str
+    message_count: int
+    examples: tuple[str, ...]
+    top_words: tuple[str, ...]
+    top_bigrams: tuple[str, ...]
+
+
+@dataclass
+class StyleProfile:
+    username: str
+    message_count: int = 0
+    eligible_count: int = 0
+    words: Counter[str] = field(default_factory=Counter)
+    bigrams: Counter[str] = field(default_factory=Counter)
+    sample: list[str] = field(default_factory=list)
+
+    def observe(self, text: str) -> None:
+        tokens = _tokenize(text)
+        if not tokens:
+            return
+
+        self.message_count += 1
+        self.words.update(tokens)
+        self.bigrams.update(f"{left} {right}" for left, right in zip(tokens, tokens[1:]))
+        _prune_counter(self.words)
+        _prune_counter(self.bigrams)
+
+        if not _is_example_candidate(text, tokens):
+            return
+        # Reservoir sampling keeps a uniform sample over the whole history
+        # without storing it.
+        self.eligible_count += 1
+        cleaned = " ".join(text.split())
+        if len(self.sample) < _SAMPLE_SIZE:
+            self.sample.append(cleaned)
+            return
+        slot = randrange(self.eligible_count)
+        if slot < _SAMPLE_SIZE:
+            self.sample[slot] = cleaned
+
+    def snapshot(self) -> StyleSnapshot:
+        ranked = sorted(self.sample, key=self._typicality, reverse=True)
+        examples: list[str] = []
+        for text in ranked:
+            if text.casefold() not in {item.casefold() for item in examples}:
+                examples.append(text)
+            if len(examples) >= _SNAPSHOT_EXAMPLES:
+                break
+        return StyleSnapshot(
+            username=self.username,
+            message_count=self.message_count,
+            examples=tuple(examples),
+            top_words=tuple(word for word, _ in self.words.most_common(_SNAPSHOT_WORDS)),
+            top_bigrams=tuple(pair for pair, _ in self.bigrams.most_common(_SNAPSHOT_BIGRAMS)),
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "u": self.username,
+                "n": self.message_count,
+                "e": self.eligible_count,
+                "w": self.words.most_common(_MAX_TERMS),
+                "b": self.bigrams.most_common(_MAX_TERMS),
+                "s": self.sample,
+            },
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_json(cls, raw: str) -> StyleProfile:
+        data = json.loads(raw)
+        return cls(
+            username=str(data.get("u") or ""),
+            message_count=int(data.get("n") or 0),
+            eligible_count=int(data.get("e") or 0),
+            words=Counter({str(word): int(count) for word, count in data.get("w") or ()}),
+            bigrams=Counter({str(pair): int(count) for pair, count in data.get("b") or ()}),
+            sample=[str(text) for text in data.get("s") or ()],
+        )
+
+    def _typicality(self, text: str) -> float:
+        # Mean log-frequency of the words: messages built from the user's
+        # habitual vocabulary rank above one-off phrases.
+        tokens = _tokenize(text)
+        if not tokens:
+            return 0.0
+        return sum(log(1 + self.words.get(token, 0)) for token in tokens) / len(tokens)
+
+
+_tracked_usernames: dict[int, str] = {}
+_profiles: dict[tuple[int, str], StyleProfile] = {}
+_snapshots: dict[tuple[int, str], StyleSnapshot] = {}
+_dirty: set[tuple[int, str]] = set()
+
+
+def _tokenize(text: str) -> list[str]:
+    return _WORD_PATTERN.findall(text.casefold())
+
+
+def _prune_counter(counter: Counter[str]) -> None:
+    if len(counter) <= _MAX_TERMS * 2:
+        return
+    kept = counter.most_common(_MAX_TERMS)
+    counter.clear()
+    counter.update(dict(kept))
+
+
+def _is_example_candidate(text: str, tokens: list[str]) -> bool:
+    if text.lstrip().startswith("/") or _LINK_PATTERN.search(text):
+        return False
+    return _EXAMPLE_MIN_WORDS <= len(tokens) <= _EXAMPLE_MAX_WORDS
+
+
+def _profile_key(chat_id: int, username: str) -> tuple[int, str]:
+    return (chat_id, username.strip().lstrip("@").casefold())
+
+
+def get_tracked_style_username(chat_id: int) -> str:
+    username = _tracked_usernames.get(chat_id)
+    if username is None:
+        settings = get_ai_group_settings(chat_id)
+        username = (settings.ai_style_username if settings else _DEFAULT_STYLE_USERNAME).casefold()
+        _tracked_usernames[chat_id] = username
+    return username
+
+
+def _load_profile(chat_id: int, username: str) -> tuple[StyleProfile, bool]:
+    key = _profile_key(chat_id, username)
+    profile = _profiles.get(key)
+    if profile is not None:
+        return profile, False
+
+    raw = get_ai_style_profile(*key)
+    if raw:
+        try:
+            profile = StyleProfile.from_json(raw)
+        except (ValueError, TypeError):
+            logger.warning("Broken style profile for chat=%s user=%s, rebuilding", *key)
+
+    bootstrapped = profile is None
+    if profile is None:
+        profile = StyleProfile(username=key[1])
+        for text in get_ai_message_texts_by_username(chat_id, key[1], limit=_BOOTSTRAP_MESSAGES):
+            profile.observe(text)
+        _dirty.add(key)
+
+    _profiles[key] = profile
+    return profile, bootstrapped
+
+
+def track_style_username(chat_id: int, username: str) -> None:
+    key = _profile_key(chat_id, username)
+    _tracked_usernames[chat_id] = key[1]
+    profile, _ = _load_profile(*key)
+    _snapshots[key] = profile.snapshot()
+
+
+def _observe_message(message: AIMessage) -> None:
+    if not message.username or message.username.casefold() != get_tracked_style_username(message.chat_id):
+        return
+
+    key = _profile_key(message.chat_id, message.username)
+    profile, bootstrapped = _load_profile(*key)
+    # A fresh bootstrap read ai_messages, which already holds this message.
+    if not bootstrapped:
+        profile.observe(message.text)
+    _dirty.add(key)
+
+
+def get_style_snapshot(chat_id: int, username: str) -> StyleSnapshot:
+    key = _profile_key(chat_id, username)
+    snapshot = _snapshots.get(key)
+    record_cache("style_snapshot", snapshot is not None)
+    if snapshot is None:
+        profile, _ = _load_profile(*key)
+        snapshot = profile.snapshot()
+        _snapshots[key] = snapshot
+    return snapshot
+
+
+def refresh_style_profiles() -> int:
+    dirty = tuple(_dirty)
+    _dirty.clear()
+    rows: list[tuple[int, str, str]] = []
+    for key in dirty:
+        profile = _profiles.get(key)
+        if profile is None:
+            continue
+        _snapshots[key] = profile.snapshot()
+        rows.append((key[0], key[1], profile.to_json()))
+    save_ai_style_profiles(rows)
+    return len(rows)
+
+
+async def run_style_profile_refresher() -> None:
+    while True:
+        await asyncio.sleep(_REFRESH_INTERVAL_SECONDS)
+        try:
+            refresh_style_profiles()
+        except Exception:
+            logger.exception("Failed to refresh style profiles")
+
+
+add_ai_message_listener(_observe_message)
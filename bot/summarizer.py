@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from bot.ai_service import (
+    is_generation_available,
+    is_generation_idle,
+    is_model_ready,
+    request_chat_summary,
+)
+from bot.config import get_runtime_config
+from bot.metrics import record_cache
+from bot.storage import (
+    AIChatSummary,
+    get_ai_chat_messages_after,
+    get_ai_chat_summary,
+    get_ai_chats_pending_summary,
+    save_ai_chat_summary,
+)
+
+logger = logging.getLogger(__name__)
+# The newest lines go into the prompt verbatim, the summary covers the rest.
+_KEEP_RAW_MESSAGES = 4
+_MIN_NEW_MESSAGES = 24
+_WINDOW_MESSAGES = 80
+# Rounds one chat may take per check before the next chat gets its turn.
+_MAX_ROUNDS_PER_CHAT = 10
+_IDLE_BEFORE_SECONDS = 30.0
+_CHECK_INTERVAL_SECONDS = 60
+_REQUEST_TIMEOUT_SECONDS = 90
+_PREEMPT_POLL_SECONDS = 0.25
+
+_summaries: dict[int, AIChatSummary | None] = {}
+
+
+def get_ai_summaries_enabled() -> bool:
+    return get_runtime_config().ai_summaries
+
+
+def get_chat_summary(chat_id: int) -> str:
+    if not get_ai_summaries_enabled():
+        return ""
+    cached = chat_id in _summaries
+    record_cache("chat_summary", cached)
+    if not cached:
+        _summaries[chat_id] = get_ai_chat_summary(chat_id)
+    summary = _summaries[chat_id]
+    return summary.summary if summary else ""
+
+
+async def _request_preemptible(previous: str, lines: list[str]) -> tuple[str, int] | None:
+    # Summaries share the model with replies: drop the request as soon as a
+    # reply starts instead of making a user wait behind it.
+    task = asyncio.create_task(request_chat_summary(previous, lines, _REQUEST_TIMEOUT_SECONDS))
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=_PREEMPT_POLL_SECONDS)
+            if not task.done() and not is_generation_idle(0):
+                task.cancel()
+                return None
+        return task.result()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def summarize_chat(chat_id: int) -> bool:
+    current = get_ai_chat_summary(chat_id)
+    if current is None:
+        # A chat without a summary starts from its newest window; older
+        # history is never summarized.
+        messages = get_ai_chat_messages_after(chat_id, 0, limit=_WINDOW_MESSAGES)
+    else:
+        # Afterwards the cursor walks forward window by window, so a backlog
+        # is summarized in order instead of skipping to the newest lines.
+        messages = get_ai_chat_messages_after(
+            chat_id,
+            current.last_message_id,
+            limit=_WINDOW_MESSAGES,
+            newest=False,
+        )
+    pending = messages[:-_KEEP_RAW_MESSAGES]
+    if len(pending) < _MIN_NEW_MESSAGES:
+        return False
+
+    lines = [f"@{message.username or 'user'}: {' '.join(message.text.split())}" for message in pending]
+    result = await _request_preemptible(current.summary if current else "", lines)
+    if result is None:
+        return False
+
+    summary, used = result
+    # The cursor stops at the last line the model saw; lines that did not
+    # fit the context stay pending for the next round.
+    _summaries[chat_id] = save_ai_chat_summary(chat_id, summary, pending[used - 1].id)
+    return True
+
+
+def _can_run() -> bool:
+    return (
+        get_ai_summaries_enabled()
+        and is_model_ready()
+        and is_generation_available()
+        and is_generation_idle(_IDLE_BEFORE_SECONDS)
+    )
+
+
+async def run_chat_summarizer() -> None:
+    while True:
+        await asyncio.sleep(_CHECK_INTERVAL_SECONDS)
+        if not _can_run():
+            continue
+        try:
+            chat_ids = get_ai_chats_pending_summary(_MIN_NEW_MESSAGES + _KEEP_RAW_MESSAGES)
+        except Exception:
+            logger.exception("Failed to list chats for summarization")
+            continue
+
+        for chat_id in chat_ids:
+            # Catch up while the model stays idle instead of one window per
+            # check, which let a busy chat fall further behind every minute.
+            for _ in range(_MAX_ROUNDS_PER_CHAT):
+                if not _can_run():
+                    break
+                try:
+                    if not await summarize_chat(chat_id):
+                        break
+                except Exception:
+                    logger.exception("Failed to summarize chat=%s", chat_id)
+                    break
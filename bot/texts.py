@@ -46,6 +46,11 @@ GROUP_HELP_TEXT = (
     "/bot_off - мены ошред, но ошрмеш пж умаляю\n"
     "/anon_on - анон сообтарды косады крч\n"
     "/anon_off - aнон сообтарды ошред\n"
+    "/limits - триггерлердын лимиттерын корстет\n"
+    "/set_limit - лимит кояд, мысалы /set_limit mem_request user 2/60\n"
+    "/triggers - озымыздын триггерлерды корстет\n"
+    "/trigger_add - триггер косад, мысалы /trigger_add prefix салам => салем родной\n"
+    "/trigger_del - триггерды ошред, номерын /triggers тен ал\n"
 )
 
 PRIVATE_HELP_TEXT = (
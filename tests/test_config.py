@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+import os
+
+import pytest
+
+from bot import config
+from bot.config import get_runtime_config, reload_runtime_config
+
+
+@pytest.fixture
+def dotenv(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict[str, str]]:
+    values: dict[str, str] = {}
+    monkeypatch.setattr(config, "dotenv_values", lambda: dict(values))
+    monkeypatch.setattr(config, "_dotenv_applied", {})
+    monkeypatch.delenv("SEARCH_RESULTS_LIMIT", raising=False)
+    monkeypatch.delenv("OLLAMA_MODEL", raising=False)
+    yield values
+    reload_runtime_config(read_dotenv=False)
+
+
+def test_key_removed_from_dotenv_is_dropped_on_reload(dotenv: dict[str, str]) -> None:
+    reload_runtime_config(read_dotenv=False)
+    default = get_runtime_config().search_results_limit
+    dotenv["SEARCH_RESULTS_LIMIT"] = str(default + 1)
+    changed, _ = reload_runtime_config()
+    assert "search_results_limit" in changed
+    assert get_runtime_config().search_results_limit == default + 1
+
+    del dotenv["SEARCH_RESULTS_LIMIT"]
+    changed, _ = reload_runtime_config()
+    assert "search_results_limit" in changed
+    assert get_runtime_config().search_results_limit == default
+    assert "SEARCH_RESULTS_LIMIT" not in os.environ
+
+
+def test_removed_key_restores_process_environment(dotenv: dict[str, str], monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("OLLAMA_MODEL", "from-env")
+    dotenv["OLLAMA_MODEL"] = "from-dotenv"
+    reload_runtime_config()
+    assert os.environ["OLLAMA_MODEL"] == "from-dotenv"
+
+    del dotenv["OLLAMA_MODEL"]
+    reload_runtime_config()
+    assert os.environ["OLLAMA_MODEL"] == "from-env"
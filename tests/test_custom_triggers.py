@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from bot.custom_triggers import CustomTriggerMatcher, check_regex_pattern
+from bot.storage import CustomTrigger
+
+
+def _regex_trigger(trigger_id: int, pattern: str) -> CustomTrigger:
+    return CustomTrigger(
+        id=trigger_id,
+        chat_id=1,
+        match_type="regex",
+        pattern=pattern,
+        reply="ok",
+    )
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [r"(?:a+)+$", r"(?:a*)*b", r"(?:\w+\s?)+$", r"(?:a|aa)+$", r"(?:x(?:ab){2,})+"],
+)
+def test_catastrophic_patterns_are_rejected(pattern: str) -> None:
+    error = check_regex_pattern(pattern)
+    assert error is not None
+    assert "зависнуть" in error
+
+
+@pytest.mark.parametrize("pattern", [r"\bпр[иеы]+вет", r"(?:ха)+", r"^бот,?\s+\w+", r"a{2}b+"])
+def test_ordinary_patterns_are_accepted(pattern: str) -> None:
+    assert check_regex_pattern(pattern) is None
+
+
+def test_slow_rule_is_cut_off_and_dropped() -> None:
+    # Chained .* pass the static check but backtrack polynomially; the
+    # deadline has to stop them.
+    pattern = r".*a.*b.*c.*d.*e"
+    assert check_regex_pattern(pattern) is None
+    matcher = CustomTriggerMatcher([_regex_trigger(1, pattern)])
+    text = "abcd" * 500
+    started = time.perf_counter()
+    assert matcher.match(text, text) is None
+    assert time.perf_counter() - started < 1.0
+    assert matcher.match("abcde", "abcde") is None
+
+
+def test_oldest_matching_regex_wins() -> None:
+    matcher = CustomTriggerMatcher([_regex_trigger(2, r"привет"), _regex_trigger(1, r"при\w+")])
+    assert matcher.match("привет", "привет").id == 1
+
+
+def test_oldest_full_scan_regex_wins_over_leftmost() -> None:
+    # Neither rule has a literal, so both go through the alternation, where
+    # the newer rule matches further left.
+    matcher = CustomTriggerMatcher([_regex_trigger(2, r"[a-z]"), _regex_trigger(1, r"\d\d")])
+    assert matcher.full_scan_regex_count == 2
+    assert matcher.match("x 42", "x 42").id == 1
+    assert matcher.match("x 4", "x 4").id == 2
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+
+from aiohttp import web
+import pytest
+
+from bot import ollama_pool
+from bot.ai_service import post_ollama
+from bot.bench.stubs import OLLAMA_STUB_FAULTS, create_ollama_stub_app, start_stub, stub_base_url
+from bot.resilience import BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN
+
+_MODEL = "stub:latest"
+_CHAT = {"model": _MODEL, "stream": False, "messages": [{"role": "user", "content": "салам"}]}
+
+
+@pytest.fixture
+def pool(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    urls: list[str] = []
+    monkeypatch.setattr(ollama_pool, "get_ollama_base_urls", lambda: list(urls))
+    monkeypatch.setattr(ollama_pool, "_backends", [])
+    return urls
+
+
+async def _start(urls: list[str], *apps: web.Application) -> list[web.AppRunner]:
+    runners = [await start_stub(app, "127.0.0.1", 0) for app in apps]
+    urls.extend(stub_base_url(runner) for runner in runners)
+    return runners
+
+
+async def _stop(runners: list[web.AppRunner]) -> None:
+    for runner in runners:
+        await runner.cleanup()
+
+
+def _backend(url: str) -> ollama_pool.OllamaBackend:
+    return next(backend for backend in ollama_pool.get_backends() if backend.base_url == url)
+
+
+def test_server_error_fails_over_to_next_backend(pool: list[str]) -> None:
+    async def run() -> None:
+        runners = await _start(
+            pool,
+            create_ollama_stub_app(latency=0, load_delay=0, error_rate=1.0),
+            create_ollama_stub_app(latency=0, load_delay=0),
+        )
+        broken, healthy = list(pool)
+        try:
+            # Pin the model to the broken backend so it is tried first.
+            _backend(broken).loaded_models = frozenset({_MODEL})
+            data = await post_ollama("/api/chat", _CHAT, 5)
+        finally:
+            await _stop(runners)
+
+        assert data is not None and data["message"]["content"]
+        assert _backend(broken).breaker._failures == 1
+        assert _MODEL in _backend(healthy).loaded_models
+
+    asyncio.run(run())
+
+
+def test_missing_model_drops_affinity_without_tripping(pool: list[str]) -> None:
+    async def run() -> None:
+        runners = await _start(
+            pool,
+            create_ollama_stub_app(latency=0, load_delay=0, models=frozenset()),
+            create_ollama_stub_app(latency=0, load_delay=0),
+        )
+        evicted, healthy = list(pool)
+        try:
+            _backend(evicted).loaded_models = frozenset({_MODEL})
+            data = await post_ollama("/api/chat", _CHAT, 5)
+        finally:
+            await _stop(runners)
+
+        assert data is not None
+        assert _MODEL not in _backend(evicted).loaded_models
+        assert _backend(evicted).breaker.state == BREAKER_CLOSED
+        assert _backend(evicted).breaker._failures == 0
+        assert _MODEL in _backend(healthy).loaded_models
+
+    asyncio.run(run())
+
+
+def test_breaker_half_opens_and_recovers(pool: list[str]) -> None:
+    async def run() -> None:
+        app = create_ollama_stub_app(latency=0, load_delay=0, error_rate=1.0)
+        runners = await _start(pool, app)
+        breaker = _backend(pool[0]).breaker
+        breaker.reset_timeout = 0.05
+        try:
+            for _ in range(breaker.failure_threshold):
+                assert await post_ollama("/api/chat", _CHAT, 5) is None
+            assert breaker.state == BREAKER_OPEN
+            # While open the backend is not even tried.
+            app[OLLAMA_STUB_FAULTS]["error_rate"] = 0.0
+            assert await post_ollama("/api/chat", _CHAT, 5) is None
+            assert breaker.state == BREAKER_OPEN
+
+            # A failed half-open probe opens it again straight away.
+            await asyncio.sleep(breaker.reset_timeout)
+            app[OLLAMA_STUB_FAULTS]["error_rate"] = 1.0
+            assert breaker.state == BREAKER_HALF_OPEN
+            assert await post_ollama("/api/chat", _CHAT, 5) is None
+            assert breaker.state == BREAKER_OPEN
+
+            await asyncio.sleep(breaker.reset_timeout)
+            app[OLLAMA_STUB_FAULTS]["error_rate"] = 0.0
+            assert await post_ollama("/api/chat", _CHAT, 5) is not None
+            assert breaker.state == BREAKER_CLOSED
+        finally:
+            await _stop(runners)
+
+    asyncio.run(run())
+
+
+def test_malformed_json_counts_as_failure(pool: list[str]) -> None:
+    async def garbage(request: web.Request) -> web.Response:
+        return web.Response(text="{not json", content_type="application/json")
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_post("/api/chat", garbage)
+        runners = await _start(pool, app)
+        breaker = _backend(pool[0]).breaker
+        breaker.reset_timeout = 0.05
+        try:
+            for _ in range(breaker.failure_threshold):
+                assert await post_ollama("/api/chat", _CHAT, 5) is None
+            assert breaker.state == BREAKER_OPEN
+
+            await asyncio.sleep(breaker.reset_timeout)
+            assert await post_ollama("/api/chat", _CHAT, 5) is None
+            # The probe reported back, so the breaker is not stuck half-open.
+            assert breaker.state == BREAKER_OPEN
+            assert not breaker._probe_in_flight
+        finally:
+            await _stop(runners)
+
+    asyncio.run(run())
+
+
+def test_embed_failures_leave_chat_breaker_alone(pool: list[str]) -> None:
+    async def broken_embed(request: web.Request) -> web.Response:
+        return web.json_response({"error": "embed model crashed"}, status=500)
+
+    async def run() -> None:
+        app = create_ollama_stub_app(latency=0, load_delay=0)
+        app.router.add_post("/api/embed", broken_embed)
+        runners = await _start(pool, app)
+        backend = _backend(pool[0])
+        try:
+            embed = {"model": "embed:latest", "input": ["салам"]}
+            for _ in range(backend.embed_breaker.failure_threshold):
+                assert await post_ollama("/api/embed", embed, 5, embed=True) is None
+            assert backend.embed_breaker.state == BREAKER_OPEN
+            assert backend.breaker.state == BREAKER_CLOSED
+            assert await post_ollama("/api/chat", _CHAT, 5) is not None
+        finally:
+            await _stop(runners)
+
+    asyncio.run(run())